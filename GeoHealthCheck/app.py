@@ -35,7 +35,8 @@ import logging
 from io import StringIO
 
 from flask import (abort, flash, g, jsonify, redirect,
-                   render_template, request, url_for)
+                   render_template, request, url_for, Response,
+                   stream_with_context)
 from flask_babel import gettext
 from flask_login import (LoginManager, login_user, logout_user,
                          current_user, login_required)
@@ -47,10 +48,11 @@ from __init__ import __version__
 from enums import RESOURCE_TYPES
 from factory import Factory
 from init import App
-from models import Resource, Run, ProbeVars, CheckVars, Tag, User, Recipient
+from models import Resource, Run, RunRollup, ProbeVars, CheckVars, Tag, \
+    User, Recipient, get_run_reports
 from resourceauth import ResourceAuth
 from util import send_email, geocode, format_checked_datetime, \
-    format_run_status, format_obj_value
+    format_run_status, format_obj_value, parse_datetime
 
 # Module globals for convenience
 LOGGER = logging.getLogger(__name__)
@@ -266,17 +268,22 @@ def export():
 
     query = request.args.get('q')
 
-    response = views.list_resources(resource_type, query)
+    response = views.list_resources(resource_type, query,
+                                    **get_list_resources_args())
 
     if request.url_rule.rule == '/json':
         json_dict = {'total': response['total'], 'resources': []}
+        # Reports of last Runs of all Resources at once
+        last_reports = get_run_reports(
+            [r.last_run.identifier for r in response['resources']
+             if r.last_run])
         for r in response['resources']:
             try:
                 ghc_url = '%s/resource/%s' % \
                           (CONFIG['GHC_SITE_URL'], r.identifier)
                 last_run_report = '-'
                 if r.last_run:
-                    last_run_report = r.last_run.report
+                    last_run_report = last_reports.get(r.last_run.identifier)
 
                 json_dict['resources'].append({
                     'resource_type': r.resource_type,
@@ -418,38 +425,110 @@ def export_resource_history(identifier):
 
     resource = views.get_resource_by_id(identifier)
 
+    period = request.args.get('period')
+    if period in RunRollup.PERIODS:
+        return export_resource_rollups(resource, period)
+
+    # Streamed, a batch of Runs at a time: constant memory use and the
+    # first bytes are sent right away, also for years of history
+    owner = resource.owner.username
+    runs = views.get_run_history(resource.identifier)
+
+    def batches():
+        batch = []
+        for run in runs:
+            batch.append(run)
+            if len(batch) == views.HISTORY_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
     if 'json' in request.url_rule.rule:
-        json_dict = {'runs': []}
-
-        for run in resource.runs:
-            json_dict['runs'].append({
-                'owner': resource.owner.username,
-                'resource_type': resource.resource_type,
-                'checked_datetime': format_checked_datetime(run),
-                'title': resource.title,
-                'url': resource.url,
-                'response_time': round(run.response_time, 2),
-                'status': format_run_status(run)
-            })
-        return jsonify(json_dict)
+        def generate_json():
+            yield '{"runs": ['
+            separator = ''
+            for batch in batches():
+                output = []
+                for run in batch:
+                    output.append(separator + json.dumps({
+                        'owner': owner,
+                        'resource_type': resource.resource_type,
+                        'checked_datetime': format_checked_datetime(run),
+                        'title': resource.title,
+                        'url': resource.url,
+                        'response_time': round(run.response_time, 2),
+                        'status': format_run_status(run)
+                    }, sort_keys=True))
+                    separator = ', '
+                yield ''.join(output)
+            yield ']}\n'
+
+        return Response(stream_with_context(generate_json()),
+                        mimetype='application/json')
+    elif 'csv' in request.url_rule.rule:
+        def generate_csv():
+            output = StringIO()
+            writer = csv.writer(output)
+            header = [
+                'owner', 'resource_type', 'checked_datetime', 'title', 'url',
+                'response_time', 'status'
+            ]
+            writer.writerow(header)
+            for batch in batches():
+                for run in batch:
+                    writer.writerow([
+                        owner,
+                        resource.resource_type,
+                        format_checked_datetime(run),
+                        resource.title,
+                        resource.url,
+                        round(run.response_time, 2),
+                        format_run_status(run),
+                    ])
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+            yield output.getvalue()
+
+        return Response(stream_with_context(generate_csv()),
+                        mimetype='text/csv')
+
+
+def export_resource_rollups(resource, period):
+    """export hourly or daily rollups of resource history as JSON or CSV"""
+
+    header = [
+        'owner', 'resource_type', 'period_start', 'title', 'url', 'count',
+        'reliability', 'response_time_min', 'response_time_avg',
+        'response_time_max', 'response_time_p50', 'response_time_p95'
+    ]
+    rows = []
+    for rollup in resource.run_rollups.filter_by(period=period).order_by(
+            RunRollup.period_start):
+        sketch = rollup.sketch
+        rows.append([
+            resource.owner.username,
+            resource.resource_type,
+            rollup.period_start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            resource.title,
+            resource.url,
+            rollup.count,
+            round(rollup.reliability, 2),
+            round(rollup.response_time_min, 2),
+            round(rollup.average_response_time, 2),
+            round(rollup.response_time_max, 2),
+            round(sketch.quantile(0.5), 2),
+            round(sketch.quantile(0.95), 2)
+        ])
+
+    if 'json' in request.url_rule.rule:
+        return jsonify({'rollups': [dict(zip(header, row)) for row in rows]})
     elif 'csv' in request.url_rule.rule:
         output = StringIO()
         writer = csv.writer(output)
-        header = [
-            'owner', 'resource_type', 'checked_datetime', 'title', 'url',
-            'response_time', 'status'
-        ]
         writer.writerow(header)
-        for run in resource.runs:
-            writer.writerow([
-                resource.owner.username,
-                resource.resource_type,
-                format_checked_datetime(run),
-                resource.title,
-                resource.url,
-                round(run.response_time, 2),
-                format_run_status(run),
-            ])
+        writer.writerows(rows)
         return output.getvalue(), 200, {'Content-type': 'text/csv'}
 
 
@@ -472,10 +551,27 @@ def resources():
 
     query = request.args.get('q')
 
-    response = views.list_resources(resource_type, query, tag)
+    response = views.list_resources(
+        resource_type, query, tag, **get_list_resources_args(
+            per_page=CONFIG['GHC_RESOURCES_PER_PAGE']))
     return render_template('resources.html', response=response)
 
 
+def get_list_resources_args(per_page=None):
+    """
+    sort and pagination arguments of resource listings from request
+    :param per_page: max resources per page without per_page argument,
+                     default all
+    """
+
+    return {
+        'sort': request.args.get('sort'),
+        'order': request.args.get('order'),
+        'page': request.args.get('page', type=int),
+        'per_page': request.args.get('per_page', per_page, type=int)
+    }
+
+
 @APP.route('/resource/<identifier>')
 def get_resource_by_id(identifier):
     """show resource"""
@@ -606,6 +702,9 @@ def add():
         for check_to_add in checks_to_add:
             DB.session.add(check_to_add)
             DB.session.add(run_to_add)
+        if checks_to_add:
+            resource_to_add.update_state(run_to_add)
+            RunRollup.add_run(run_to_add)
 
     try:
         DB.session.commit()
@@ -817,7 +916,11 @@ def get_probe_edit_form(probe_class, resource_identifier=None):
         resource = views.get_resource_by_id(resource_identifier)
         if resource:
             probe_obj._resource = resource
+            # Expand from Capabilities stored by the runner
+            probe_obj.use_stored_metadata = True
+            probe_obj.own_param_defs()
             probe_obj.expand_params(resource)
+            db_commit()
 
     probe_info = probe_obj.get_plugin_vars()
     probe_vars = ProbeVars(
@@ -1062,12 +1165,29 @@ def api_probes_avail(resource_type=None, resource_id=None):
 @APP.route('/api/v1.0/runs/<int:resource_id>/<int:run_id>.<content_type>')
 def api_runs(resource_id, run_id=None, content_type='json'):
     """
-    Get Runs (History of results) for Resource.
+    Get Runs (History of results) for Resource, in time order, a page
+    at a time: pass 'next_after_id' of the response as 'after_id' to get
+    the next page. Optional 'limit', 'from' and 'to' (UTC, e.g.
+    2024-01-31T12:00:00Z) and 'report' ('false' to omit reports).
     """
+    next_after_id = None
+    with_report = request.args.get('report', 'true').lower() != 'false'
     if run_id:
         runs = [views.get_run_by_id(run_id)]
     else:
-        runs = views.get_run_by_resource_id(resource_id)
+        try:
+            from_datetime, to_datetime = [
+                parse_datetime(request.args[arg])
+                if request.args.get(arg) else None
+                for arg in ['from', 'to']]
+        except ValueError:
+            abort(400)
+
+        runs, next_after_id = views.get_run_by_resource_id(
+            resource_id, after_id=request.args.get('after_id', type=int),
+            limit=request.args.get('limit', type=int),
+            from_datetime=from_datetime, to_datetime=to_datetime,
+            with_report=with_report)
 
     run_arr = []
     for run in runs:
@@ -1076,12 +1196,14 @@ def api_runs(resource_id, run_id=None, content_type='json'):
             'success': run.success,
             'response_time':  run.response_time,
             'checked_datetime': run.checked_datetime,
-            'message':  run.message,
-            'report': run.report
+            'message':  run.message
         }
+        if with_report:
+            run_dict['report'] = run.report
         run_arr.append(run_dict)
 
-    runs_dict = {'total': len(run_arr), 'runs': run_arr}
+    runs_dict = {'total': len(run_arr), 'runs': run_arr,
+                 'next_after_id': next_after_id}
     result = 'unknown'
     if content_type == 'json':
         result = jsonify(runs_dict)
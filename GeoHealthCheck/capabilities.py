@@ -0,0 +1,643 @@
+import logging
+import sys
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from lxml import etree
+
+LOGGER = logging.getLogger(__name__)
+
+EXCEPTION_ROOTS = ['ServiceExceptionReport', 'ExceptionReport']
+"""
+Local names of root elements of OWS Exception documents.
+"""
+
+FORMAT_VERSION = 2
+"""
+Version of the `to_dict()` format of summaries, bump on any change such
+that stored summaries in older formats are not used.
+"""
+
+
+def capabilities_url(url, service, version, request='GetCapabilities',
+                     **params):
+    """
+    Build KVP request URL for OWS endpoint `url`, keeping any
+    request parameters already present in `url`.
+    :param url: OWS endpoint URL
+    :param service: OWS service type e.g. 'WMS'
+    :param version: OWS service version
+    :param request: OWS request name
+    :param params: optional extra request parameters
+    :return: request URL
+    """
+    query = []
+    if '?' in url:
+        url, query_string = url.split('?', 1)
+        query = parse_qsl(query_string)
+
+    present = [name.lower() for name, value in query]
+    params.update(service=service, version=version, request=request)
+    for name in ['service', 'version', 'request'] + sorted(params):
+        if name.lower() not in present:
+            present.append(name.lower())
+            query.append((name, params[name]))
+
+    return '%s?%s' % (url, urlencode(query))
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def text(elem):
+    if elem.text is None:
+        return None
+    return elem.text.strip() or None
+
+
+def corner(elem):
+    return [float(value) for value in elem.text.split()]
+
+
+class LayerSummary(object):
+    """
+    Summary of a Layer, FeatureType or Coverage: just what Probes need
+    to expand their PARAM_DEFS.
+    """
+
+    __slots__ = ('name', 'crs_options', 'bbox', 'bbox_wgs84',
+                 'formats', 'tilematrixsets')
+
+    def __init__(self, parent=None):
+        self.name = None
+        # List of CRS (string) options
+        self.crs_options = []
+        # minx, miny, maxx, maxy, CRS (string)
+        self.bbox = None
+        # minx, miny, maxx, maxy in WGS84
+        self.bbox_wgs84 = None
+        self.formats = []
+        # Identifiers of linked TileMatrixSets
+        self.tilematrixsets = []
+
+        if parent:
+            # Inherited properties e.g. from parent WMS Layer
+            self.crs_options = parent.crs_options
+            self.bbox = parent.bbox
+            self.bbox_wgs84 = parent.bbox_wgs84
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @staticmethod
+    def from_dict(layer_dict):
+        layer = LayerSummary()
+        for name, value in layer_dict.items():
+            setattr(layer, name, value)
+
+        # JSON has no tuples
+        if layer.bbox:
+            layer.bbox = tuple(layer.bbox)
+        if layer.bbox_wgs84:
+            layer.bbox_wgs84 = tuple(layer.bbox_wgs84)
+        return layer
+
+
+class TileMatrixSetSummary(object):
+    """
+    Summary of a WMTS TileMatrixSet.
+    """
+
+    __slots__ = ('identifier', 'crs', 'tilematrix')
+
+    def __init__(self):
+        self.identifier = None
+        self.crs = None
+        # TileMatrixSummary objects by identifier
+        self.tilematrix = OrderedDict()
+
+    def to_dict(self):
+        return {
+            'identifier': self.identifier,
+            'crs': self.crs,
+            'tilematrix': [tilematrix.to_dict()
+                           for tilematrix in self.tilematrix.values()]
+        }
+
+    @staticmethod
+    def from_dict(tilematrixset_dict):
+        tilematrixset = TileMatrixSetSummary()
+        tilematrixset.identifier = tilematrixset_dict['identifier']
+        tilematrixset.crs = tilematrixset_dict['crs']
+        for tilematrix_dict in tilematrixset_dict['tilematrix']:
+            tilematrix = TileMatrixSummary.from_dict(tilematrix_dict)
+            tilematrixset.tilematrix[tilematrix.identifier] = tilematrix
+        return tilematrixset
+
+
+class TileMatrixSummary(object):
+    """
+    Summary of a WMTS TileMatrix.
+    """
+
+    __slots__ = ('identifier', 'scaledenominator', 'topleftcorner',
+                 'tilewidth', 'tileheight', 'matrixwidth', 'matrixheight')
+
+    def __init__(self):
+        self.identifier = None
+        self.scaledenominator = None
+        self.topleftcorner = None
+        self.tilewidth = None
+        self.tileheight = None
+        self.matrixwidth = None
+        self.matrixheight = None
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    @staticmethod
+    def from_dict(tilematrix_dict):
+        tilematrix = TileMatrixSummary()
+        for name, value in tilematrix_dict.items():
+            setattr(tilematrix, name, value)
+
+        # JSON has no tuples
+        if tilematrix.topleftcorner:
+            tilematrix.topleftcorner = tuple(tilematrix.topleftcorner)
+        return tilematrix
+
+
+class CapabilitiesSummary(object):
+    """
+    Compact summary of an OWS Capabilities document, holding
+    far less than a full OWSLib Service object, thus cheap to cache.
+    """
+
+    __slots__ = ('service', 'version', 'contents', 'formats',
+                 'exceptions', 'nsmap', 'tilematrixsets', 'encodings')
+
+    def __init__(self, service):
+        self.service = service
+        self.version = None
+        # LayerSummary objects by name, in document order
+        self.contents = OrderedDict()
+        # Formats of main data request e.g. WMS GetMap
+        self.formats = []
+        # Exception formats
+        self.exceptions = []
+        # Namespace prefixes to URIs
+        self.nsmap = {}
+        # TileMatrixSetSummary objects by identifier
+        self.tilematrixsets = OrderedDict()
+        # Request encodings supported, e.g. WMTS 'KVP' and/or 'REST'
+        self.encodings = []
+
+    def to_dict(self):
+        """
+        Summary as `dict` suitable for JSON encoding, restore
+        with `from_dict()`.
+        """
+        return {
+            'format_version': FORMAT_VERSION,
+            'service': self.service,
+            'version': self.version,
+            'contents': [layer.to_dict() for layer in self.contents.values()],
+            'formats': self.formats,
+            'exceptions': self.exceptions,
+            'nsmap': self.nsmap,
+            'tilematrixsets': [tilematrixset.to_dict() for tilematrixset
+                               in self.tilematrixsets.values()],
+            'encodings': self.encodings
+        }
+
+    @staticmethod
+    def from_dict(summary_dict):
+        """
+        Restore summary from `to_dict()` result.
+        :param summary_dict: `dict` from `to_dict()`
+        :return: CapabilitiesSummary or None if in older format
+        """
+        if summary_dict.get('format_version') != FORMAT_VERSION:
+            return None
+
+        summary = CapabilitiesSummary(summary_dict['service'])
+        summary.version = summary_dict['version']
+        summary.formats = summary_dict['formats']
+        summary.exceptions = summary_dict['exceptions']
+        summary.nsmap = summary_dict['nsmap']
+        summary.encodings = summary_dict['encodings']
+        for layer_dict in summary_dict['contents']:
+            layer = LayerSummary.from_dict(layer_dict)
+            summary.contents[layer.name] = layer
+        for tilematrixset_dict in summary_dict['tilematrixsets']:
+            tilematrixset = TileMatrixSetSummary.from_dict(tilematrixset_dict)
+            summary.tilematrixsets[tilematrixset.identifier] = tilematrixset
+        return summary
+
+
+class Summariser(object):
+    """
+    Base class to summarise OWS documents in a single streaming
+    pass with lxml iterparse. Elements are freed as soon as they
+    are handled, so memory use does not grow with document size.
+    Subclasses handle `start` and `end` events, `path` holds the local
+    names of all open elements.
+    """
+
+    SERVICE = None
+
+    def __init__(self):
+        self.summary = CapabilitiesSummary(self.SERVICE)
+        self.path = []
+        self.exception = None
+        self.layer = None
+        self.lower_corner = None
+
+    def parse(self, source, huge_tree=False):
+        """
+        Parse and summarise document.
+        :param source: filename or file-like object
+        :param huge_tree: allow very deep trees and long text content
+        :return: CapabilitiesSummary
+        """
+        context = etree.iterparse(
+            source, events=('start', 'end'), resolve_entities=False,
+            no_network=True, huge_tree=huge_tree)
+
+        for event, elem in context:
+            name = local_name(elem.tag)
+            if event == 'start':
+                if not self.path:
+                    self.root(elem, name)
+                self.path.append(name)
+                self.start(elem, name)
+                continue
+
+            if self.exception is not None:
+                if name in ['ServiceException', 'ExceptionText']:
+                    self.exception.append(text(elem) or '')
+            else:
+                self.end(elem, name)
+            self.path.pop()
+
+            # Done with element: free it and its preceding siblings
+            elem.clear()
+            while self.path and elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+        if self.exception is not None:
+            raise Exception('%s: %s' % (
+                self.exception[0], ' '.join(self.exception[1:])))
+
+        return self.summary
+
+    def root(self, elem, name):
+        if name in EXCEPTION_ROOTS:
+            self.exception = [name]
+            return
+
+        self.summary.version = elem.get('version')
+        self.summary.nsmap.update(
+            (prefix, uri) for prefix, uri in elem.nsmap.items() if prefix)
+
+    def end_corner(self, elem, name):
+        """
+        Set WGS84 bbox of current `layer` from ows:WGS84BoundingBox
+        corners, LowerCorner comes first.
+        """
+        if name == 'LowerCorner':
+            self.lower_corner = corner(elem)
+        elif name == 'UpperCorner':
+            self.layer.bbox_wgs84 = tuple(self.lower_corner + corner(elem))
+
+    def parent(self, level=2):
+        if len(self.path) < level:
+            return None
+        return self.path[-level]
+
+    def start(self, elem, name):
+        pass
+
+    def end(self, elem, name):
+        pass
+
+
+class WmsSummariser(Summariser):
+    """
+    Summarise WMS (1.1.1, 1.3.0) Capabilities. Like OWSLib only
+    named Layers end up in contents, CRS and bounding boxes are inherited
+    from parent Layers.
+    """
+
+    SERVICE = 'WMS'
+
+    GEOGRAPHIC_BOUNDS = ['westBoundLongitude', 'southBoundLatitude',
+                         'eastBoundLongitude', 'northBoundLatitude']
+    """
+    Children of WMS 1.3.0 EX_GeographicBoundingBox in bbox_wgs84 order.
+    """
+
+    def __init__(self):
+        Summariser.__init__(self)
+        # Open Layers: [layer, own CRS list, own bbox]
+        self.layers = []
+        # Bounds of open EX_GeographicBoundingBox by local name
+        self.geographic_bounds = {}
+
+    def start(self, elem, name):
+        if name == 'Layer':
+            parent = self.layers[-1][0] if self.layers else None
+            self.layers.append([LayerSummary(parent), False, False])
+
+    def end(self, elem, name):
+        parent = self.parent()
+        if parent == 'Layer':
+            self.end_layer_child(elem, name)
+        elif parent == 'EX_GeographicBoundingBox':
+            self.geographic_bounds[name] = float(elem.text)
+        elif name == 'Format':
+            if parent == 'GetMap':
+                self.summary.formats.append(text(elem))
+            elif parent == 'Exception':
+                self.summary.exceptions.append(text(elem))
+
+        if name == 'Layer':
+            self.layers.pop()
+
+    def end_layer_child(self, elem, name):
+        entry = self.layers[-1]
+        layer = entry[0]
+        if name == 'Name':
+            layer.name = text(elem)
+            if layer.name:
+                # Add at Name to keep document order of nested Layers
+                self.summary.contents[layer.name] = layer
+        elif name in ['SRS', 'CRS']:
+            if not entry[1]:
+                # Copy on first own CRS, until then shared with parent
+                layer.crs_options = list(layer.crs_options)
+                entry[1] = True
+            # Some servers put whitespace separated CRS list in single SRS
+            for crs in (elem.text or '').split():
+                if crs not in layer.crs_options:
+                    # Same CRS strings repeat over many Layers
+                    layer.crs_options.append(sys.intern(crs))
+        elif name == 'BoundingBox' and not entry[2]:
+            layer.bbox = (float(elem.get('minx')), float(elem.get('miny')),
+                          float(elem.get('maxx')), float(elem.get('maxy')),
+                          elem.get('SRS', elem.get('CRS')))
+            entry[2] = True
+        elif name == 'LatLonBoundingBox':
+            layer.bbox_wgs84 = (
+                float(elem.get('minx')), float(elem.get('miny')),
+                float(elem.get('maxx')), float(elem.get('maxy')))
+        elif name == 'EX_GeographicBoundingBox':
+            # WMS 1.3.0 successor of LatLonBoundingBox
+            bounds = self.geographic_bounds
+            if all(bound in bounds for bound in self.GEOGRAPHIC_BOUNDS):
+                layer.bbox_wgs84 = tuple(
+                    bounds[bound] for bound in self.GEOGRAPHIC_BOUNDS)
+            self.geographic_bounds = {}
+
+
+class WfsSummariser(Summariser):
+    """
+    Summarise WFS (1.1.0, 2.0) Capabilities.
+    """
+
+    SERVICE = 'WFS'
+
+    def __init__(self):
+        Summariser.__init__(self)
+        self.operation = None
+        self.parameter = None
+
+    def start(self, elem, name):
+        if name == 'FeatureType':
+            self.layer = LayerSummary()
+            # FeatureType names may use prefixes declared here
+            self.summary.nsmap.update(
+                (prefix, uri) for prefix, uri in elem.nsmap.items()
+                if prefix)
+        elif name == 'Operation':
+            self.operation = elem.get('name')
+        elif name == 'Parameter':
+            self.parameter = elem.get('name')
+
+    def end(self, elem, name):
+        parent = self.parent()
+        layer = self.layer
+        if parent == 'FeatureType':
+            if name == 'Name':
+                layer.name = text(elem)
+            elif name in ['DefaultSRS', 'DefaultCRS']:
+                if text(elem):
+                    layer.crs_options.insert(0, text(elem))
+            elif name in ['OtherSRS', 'OtherCRS']:
+                if text(elem):
+                    layer.crs_options.append(text(elem))
+        elif parent == 'WGS84BoundingBox' and \
+                self.parent(3) == 'FeatureType':
+            self.end_corner(elem, name)
+        elif name == 'FeatureType':
+            if layer.name:
+                self.summary.contents[layer.name] = layer
+            self.layer = None
+        elif name == 'Value' and self.operation == 'GetFeature' \
+                and self.parameter == 'outputFormat':
+            self.summary.formats.append(text(elem))
+        elif name == 'Operation':
+            self.operation = None
+        elif name == 'Parameter':
+            self.parameter = None
+
+
+class WmtsSummariser(Summariser):
+    """
+    Summarise WMTS (1.0.0) Capabilities.
+    """
+
+    SERVICE = 'WMTS'
+
+    def __init__(self):
+        Summariser.__init__(self)
+        self.tilematrixset = None
+        self.tilematrix = None
+
+    def start(self, elem, name):
+        if self.parent() == 'Contents':
+            if name == 'Layer':
+                self.layer = LayerSummary()
+            elif name == 'TileMatrixSet':
+                self.tilematrixset = TileMatrixSetSummary()
+        elif name == 'TileMatrix' and self.parent() == 'TileMatrixSet':
+            self.tilematrix = TileMatrixSummary()
+
+    def end(self, elem, name):
+        parent = self.parent()
+        if parent == 'Layer':
+            if name == 'Identifier':
+                self.layer.name = text(elem)
+            elif name == 'Format':
+                self.layer.formats.append(text(elem))
+        elif parent == 'WGS84BoundingBox' and self.parent(3) == 'Layer':
+            self.end_corner(elem, name)
+        elif parent == 'TileMatrixSetLink' and name == 'TileMatrixSet':
+            self.layer.tilematrixsets.append(text(elem))
+        elif parent == 'TileMatrixSet' and self.tilematrixset:
+            if name == 'Identifier':
+                self.tilematrixset.identifier = text(elem)
+            elif name == 'SupportedCRS':
+                self.tilematrixset.crs = text(elem)
+            elif name == 'TileMatrix':
+                self.tilematrixset.tilematrix[
+                    self.tilematrix.identifier] = self.tilematrix
+                self.tilematrix = None
+        elif parent == 'TileMatrix' and self.tilematrix:
+            self.end_tilematrix_child(elem, name)
+        elif parent == 'Contents':
+            if name == 'Layer':
+                if self.layer.name:
+                    self.summary.contents[self.layer.name] = self.layer
+                self.layer = None
+            elif name == 'TileMatrixSet':
+                self.summary.tilematrixsets[
+                    self.tilematrixset.identifier] = self.tilematrixset
+                self.tilematrixset = None
+
+    def end_tilematrix_child(self, elem, name):
+        tilematrix = self.tilematrix
+        if name == 'Identifier':
+            tilematrix.identifier = text(elem)
+        elif name == 'ScaleDenominator':
+            tilematrix.scaledenominator = float(elem.text)
+        elif name == 'TopLeftCorner':
+            tilematrix.topleftcorner = tuple(corner(elem))
+        elif name == 'TileWidth':
+            tilematrix.tilewidth = int(elem.text)
+        elif name == 'TileHeight':
+            tilematrix.tileheight = int(elem.text)
+        elif name == 'MatrixWidth':
+            tilematrix.matrixwidth = int(elem.text)
+        elif name == 'MatrixHeight':
+            tilematrix.matrixheight = int(elem.text)
+
+
+class WcsSummariser(Summariser):
+    """
+    Summarise WCS (2.0) Capabilities. Coverage bounding boxes are
+    only available via DescribeCoverage, see DescribeCoverageSummariser.
+    """
+
+    SERVICE = 'WCS'
+
+    def start(self, elem, name):
+        if name == 'CoverageSummary':
+            self.layer = LayerSummary()
+            # Formats apply to all Coverages
+            self.layer.formats = self.summary.formats
+
+    def end(self, elem, name):
+        parent = self.parent()
+        if name == 'CoverageId' and parent == 'CoverageSummary':
+            self.layer.name = text(elem)
+        elif name == 'formatSupported' and parent == 'ServiceMetadata':
+            self.summary.formats.append(text(elem))
+        elif name == 'CoverageSummary':
+            if self.layer.name:
+                self.summary.contents[self.layer.name] = self.layer
+            self.layer = None
+
+
+class DescribeCoverageSummariser(Summariser):
+    """
+    Summarise WCS (2.0) DescribeCoverage response: the first
+    bounding box (gml:Envelope) with its CRS per Coverage.
+    """
+
+    SERVICE = 'WCS'
+
+    def __init__(self):
+        Summariser.__init__(self)
+        self.crs = None
+
+    def start(self, elem, name):
+        if name == 'CoverageDescription':
+            self.layer = LayerSummary()
+        elif name == 'Envelope' and self.parent() == 'boundedBy':
+            self.crs = elem.get('srsName')
+
+    def end(self, elem, name):
+        parent = self.parent()
+        layer = self.layer
+        if name == 'CoverageId' and parent == 'CoverageDescription':
+            layer.name = text(elem)
+        elif parent == 'Envelope' and self.parent(3) == 'boundedBy':
+            if name == 'lowerCorner':
+                self.lower_corner = corner(elem)
+            elif name == 'upperCorner' and not layer.bbox:
+                layer.bbox = tuple(self.lower_corner + corner(elem)) + \
+                    (self.crs,)
+                layer.crs_options = [self.crs]
+        elif name == 'CoverageDescription':
+            if layer.name:
+                self.summary.contents[layer.name] = layer
+            self.layer = None
+
+
+class TmsSummariser(Summariser):
+    """
+    Summarise TMS (1.0.0) TileMapService document: a Layer per TileMap,
+    named by its href like OWSLib. Tile formats are only available in
+    the TileMap documents, see TileMapSummariser.
+    """
+
+    SERVICE = 'TMS'
+
+    def end(self, elem, name):
+        if name == 'TileMap' and self.parent() == 'TileMaps':
+            layer = LayerSummary()
+            layer.name = elem.get('href')
+            if elem.get('srs'):
+                layer.crs_options = [elem.get('srs')]
+            if layer.name:
+                self.summary.contents[layer.name] = layer
+
+
+class TileMapSummariser(Summariser):
+    """
+    Summarise TMS (1.0.0) TileMap document: tile format extension in
+    `formats`.
+    """
+
+    SERVICE = 'TMS'
+
+    def end(self, elem, name):
+        if name == 'TileFormat' and elem.get('extension'):
+            self.summary.formats.append(elem.get('extension'))
+
+
+SUMMARISERS = {
+    'WMS': WmsSummariser,
+    'WFS': WfsSummariser,
+    'WMTS': WmtsSummariser,
+    'WCS': WcsSummariser,
+    'WCS:DescribeCoverage': DescribeCoverageSummariser,
+    'TMS': TmsSummariser,
+    'TMS:TileMap': TileMapSummariser
+}
+"""
+Summariser classes by (OWS) document type.
+"""
+
+
+def summarise(source, doc_type, huge_tree=False):
+    """
+    Summarise OWS document while streaming it.
+    :param source: filename or file-like object e.g. raw HTTP response
+    :param doc_type: key in SUMMARISERS, e.g. 'WMS'
+    :param huge_tree: allow very deep trees and long text content
+    :return: CapabilitiesSummary
+    """
+    return SUMMARISERS[doc_type]().parse(source, huge_tree=huge_tree)
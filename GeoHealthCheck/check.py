@@ -13,16 +13,19 @@ class Check(Plugin):
         self.probe = None
 
     # Lifecycle
-    def init(self, probe, check_vars):
+    def init(self, probe, check_vars, parameters=None):
         """
         Initialize Checker with parent Probe and parameters dict.
+        :param parameters: optional, already decoded check_vars.parameters
         :return:
         """
 
         self.probe = probe
         self.check_vars = check_vars
-        self._parameters = check_vars.parameters
-        self._result = CheckResult(self, check_vars)
+        if parameters is None:
+            parameters = check_vars.parameters
+        self._parameters = parameters
+        self._result = CheckResult(self, check_vars, parameters=parameters)
         self._result.start()
 
     # Lifecycle
@@ -39,6 +39,18 @@ SQLALCHEMY_DATABASE_URI = 'sqlite:///data.db'
 SECRET_KEY = None
 
 GHC_RETENTION_DAYS = 30
+# Runs older than GHC_RETENTION_DAYS are deleted in batches
+# of N Runs, pausing N seconds between batches.
+GHC_FLUSH_BATCH_SIZE = 10000
+GHC_FLUSH_PAUSE_SECS = 0.1
+# Reports of Runs stored before as JSON are compacted in the background
+# in batches of N Runs, pausing GHC_FLUSH_PAUSE_SECS between batches.
+GHC_COMPACT_BATCH_SIZE = 1000
+# Runs API: default and max number of Runs per page
+GHC_API_RUNS_LIMIT = 100
+GHC_API_RUNS_MAX_LIMIT = 1000
+# Resources page: default number of Resources per page, 0 for all
+GHC_RESOURCES_PER_PAGE = 50
 GHC_PROBE_HTTP_TIMEOUT_SECS = 30
 GHC_MINIMAL_RUN_FREQUENCY_MINS = 10
 GHC_SELF_REGISTER = False
@@ -63,6 +75,11 @@ GHC_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 # disable caching.
 GHC_METADATA_CACHE_SECS = 900
 
+# Expired metadata is still served for at most N
+# seconds while it is refreshed in the background.
+# Set to 0 to always wait for a fresh fetch.
+GHC_METADATA_CACHE_STALE_SECS = 300
+
 GHC_SMTP = {
     'server': None,
     'port': None,
@@ -11,6 +11,11 @@ class Factory:
     Also contains introspection util functions.
     """
 
+    CLASS_CACHE = {}
+    """
+    Resolved class objects by class string, see `create_class()`.
+    """
+
     @staticmethod
     def create_obj(class_string):
 
@@ -39,7 +44,10 @@ class Factory:
         Raises:
             ValueError if module part of the class is not specified.
         """
-        class_obj = None
+        class_obj = Factory.CLASS_CACHE.get(class_string)
+        if class_obj:
+            return class_obj
+
         try:
             module_name, dot, class_name = class_string.rpartition('.')
             if module_name == '':
@@ -51,6 +59,7 @@ class Factory:
             LOGGER.error("cannot create class '%s'" % class_string)
             raise e
 
+        Factory.CLASS_CACHE[class_string] = class_obj
         return class_obj
 
     @staticmethod
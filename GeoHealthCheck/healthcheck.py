@@ -35,18 +35,11 @@ from urllib.parse import urlparse
 from functools import partial
 from flask_babel import gettext
 
-from owslib.wms import WebMapService
-from owslib.wmts import WebMapTileService
-from owslib.tms import TileMapService
-from owslib.wfs import WebFeatureService
-from owslib.wcs import WebCoverageService
-from owslib.wps import WebProcessingService
-from owslib.csw import CatalogueServiceWeb
-from owslib.sos import SensorObservationService
-
 from init import App
+from capabilities import CapabilitiesSummary
 from enums import RESOURCE_TYPES
-from models import Resource, Run
+from factory import Factory
+from models import Resource, Run, RunRollup
 from probe import Probe
 from result import ResourceResult
 from notifications import notify
@@ -88,9 +81,8 @@ def run_resource(resourceid):
     # Get the status of the last run,
     # assume success if there is none
     last_run_success = True
-    last_run = resource.last_run
-    if last_run:
-        last_run_success = last_run.success
+    if resource.last_success is not None:
+        last_run_success = resource.last_success
 
     # Run test
     result = run_test_resource(resource)
@@ -98,6 +90,8 @@ def run_resource(resourceid):
     run1 = Run(resource, result, datetime.now(timezone.utc))
 
     DB.session.add(run1)
+    resource.update_state(run1)
+    RunRollup.add_run(run1)
 
     # commit or rollback each run to avoid long-lived transactions
     # see https://github.com/geopython/GeoHealthCheck/issues/14
@@ -111,10 +105,77 @@ def run_resource(resourceid):
             # Don't bail out on failure in order to commit the Run
             msg = str(err)
             logging.warn('error notifying: %s' % msg)
+
+    refresh_capabilities(resource)
+
     if not __name__ == '__main__':
         DB.session.remove()
 
 
+def refresh_capabilities(resource):
+    """
+    Store Capabilities summaries of Resource (for Probe edit forms):
+    for each version stored or summarised by a Probe of the Resource
+    (Probe.METADATA_VERSION) when missing or older than
+    GHC_METADATA_CACHE_SECS. Taken from the metadata cache shared with
+    the Probes, so mostly as just fetched by the Probes of this run.
+    """
+    max_age_secs = APP.config['GHC_METADATA_CACHE_SECS']
+    if max_age_secs <= 0:
+        # Caching disabled: Probe edit forms fetch Capabilities
+        return
+
+    probe_classes = {}
+    for stored in resource.capabilities.all():
+        probe_classes[stored.version] = stored.probe_class
+
+    for probe_vars in resource.probe_vars:
+        try:
+            version = Factory.create_class(
+                probe_vars.probe_class).METADATA_VERSION
+        except Exception as err:
+            LOGGER.warning('Cannot load Probe %s err=%s'
+                           % (probe_vars.probe_class, str(err)))
+            continue
+
+        if version is not None:
+            probe_classes.setdefault(version, probe_vars.probe_class)
+
+    for version, probe_class in probe_classes.items():
+        stored = resource.capabilities.filter_by(version=version).first()
+        if stored and stored.is_fresh(max_age_secs):
+            continue
+
+        try:
+            probe = Factory.create_obj(probe_class)
+            probe._resource = resource
+            summary = probe.get_metadata_shared(resource, version)
+        except Exception as err:
+            LOGGER.warning('Cannot refresh Capabilities for %s err=%s'
+                           % (resource.url, str(err)))
+            continue
+
+        if not isinstance(summary, CapabilitiesSummary):
+            continue
+
+        # Cached summary may be older: keep its fetch time, and skip
+        # while the cache still holds the summary stored. Cache via the
+        # Probe: plugins may import the probe module by another name.
+        updated_datetime = None
+        entry = probe.METADATA_CACHE.get(
+            probe.get_metadata_cache_key(resource, version))
+        if entry and entry['metadata'] is summary:
+            updated_datetime = entry['time']
+            if stored and stored.is_valid() and updated_datetime <= \
+                    stored.updated_datetime.replace(tzinfo=timezone.utc):
+                continue
+
+        resource.set_capabilities_summary(
+            probe_class, version, summary, updated_datetime)
+
+    db_commit()
+
+
 def run_test_resource(resource):
     """tests a service and provides run metrics"""
 
@@ -135,6 +196,17 @@ def run_test_resource(resource):
 def sniff_test_resource(config, resource_type, url):
     """tests a Resource endpoint for general compliance"""
 
+    # Imported here as these are slow to import and only needed
+    # when adding a Resource
+    from owslib.wms import WebMapService
+    from owslib.wmts import WebMapTileService
+    from owslib.tms import TileMapService
+    from owslib.wfs import WebFeatureService
+    from owslib.wcs import WebCoverageService
+    from owslib.wps import WebProcessingService
+    from owslib.csw import CatalogueServiceWeb
+    from owslib.sos import SensorObservationService
+
     out = []
     tag_list = []
     if resource_type not in RESOURCE_TYPES.keys():
@@ -0,0 +1,76 @@
+"""empty message
+
+Revision ID: 5a7c3e8b9f26
+Revises: 9d4e1f7c2a58
+Create Date: 2026-10-20 11:26:52.907183
+
+Add run_report table: Run report structures (reports without timings)
+stored once per content, keyed by hash. Add run.report_identifier and
+run.report_timings columns: reference to the structure and timings of
+the Run. Reports stored before are compacted in the background by the
+runner, or with python3 GeoHealthCheck/models.py compact
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = '5a7c3e8b9f26'
+down_revision = '9d4e1f7c2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not alembic_helpers.tables_exist(['run_report']):
+        print('Table run_report not present, will create')
+        op.create_table(
+            'run_report',
+            sa.Column('identifier', sa.Integer(), nullable=False),
+            sa.Column('hash', sa.Text(), nullable=False),
+            sa.Column('data', sa.LargeBinary(), nullable=False),
+            sa.PrimaryKeyConstraint('identifier'),
+            sa.UniqueConstraint('hash')
+        )
+    else:
+        print('Table run_report already present')
+
+    if not alembic_helpers.table_has_column('run', 'report_identifier'):
+        print('Column report_identifier not present in run table, '
+              'will create')
+        op.add_column(u'run', sa.Column('report_identifier', sa.Integer(),
+                      nullable=True))
+        # SQLite cannot add constraints without copying the run table
+        if op.get_bind().dialect.name != 'sqlite':
+            op.create_foreign_key('fk_run_report_identifier', 'run',
+                                  'run_report', ['report_identifier'],
+                                  ['identifier'])
+        alembic_helpers.create_index('ix_run_report_identifier', 'run',
+                                     ['report_identifier'])
+    else:
+        print('Column report_identifier already present in run table')
+
+    if not alembic_helpers.table_has_column('run', 'report_timings'):
+        print('Column report_timings not present in run table, will create')
+        op.add_column(u'run', sa.Column('report_timings', sa.Text(),
+                      nullable=True))
+    else:
+        print('Column report_timings already present in run table')
+
+    print('Reports are compacted in the background by the runner, or '
+          'with: python3 GeoHealthCheck/models.py compact')
+
+
+def downgrade():
+    # NB reports of Runs stored since are lost
+    print('Dropping Columns report_identifier and report_timings '
+          'from run table')
+    op.drop_index(op.f('ix_run_report_identifier'), table_name='run')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('fk_run_report_identifier', 'run',
+                           type_='foreignkey')
+    op.drop_column(u'run', 'report_identifier')
+    op.drop_column(u'run', 'report_timings')
+    print('Dropping table run_report')
+    op.drop_table('run_report')
@@ -0,0 +1,56 @@
+"""empty message
+
+Revision ID: 9d4e1f7c2a58
+Revises: b7f2c4e9a013
+Create Date: 2026-10-20 09:41:26.310472
+
+Add run.report_data column: compact (versioned, zlib compressed JSON)
+report of the Run. Reports stored before in run.report are compacted
+in the background by the runner, or with
+python3 GeoHealthCheck/models.py compact
+
+"""
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = '9d4e1f7c2a58'
+down_revision = 'b7f2c4e9a013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not alembic_helpers.table_has_column('run', 'report_data'):
+        print('Column report_data not present in run table, will create')
+        op.add_column(u'run', sa.Column('report_data', sa.LargeBinary(),
+                      nullable=True))
+        print('Reports are compacted in the background by the runner, or '
+              'with: python3 GeoHealthCheck/models.py compact')
+    else:
+        print('Column report_data already present in run table')
+
+
+def downgrade():
+    print('Restoring JSON reports from column report_data')
+    run = table('run',
+                column('identifier', sa.Integer),
+                column('report', sa.Text),
+                column('report_data', sa.LargeBinary))
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([run.c.identifier, run.c.report_data]).where(
+            run.c.report_data.isnot(None))).fetchall()
+    for identifier, data in rows:
+        # Format version 1: version byte and zlib compressed JSON
+        report = zlib.decompress(bytes(data)[1:]).decode('utf-8')
+        connection.execute(run.update().where(
+            run.c.identifier == identifier).values(report=report))
+
+    print('Dropping Column report_data from run table')
+    op.drop_column(u'run', 'report_data')
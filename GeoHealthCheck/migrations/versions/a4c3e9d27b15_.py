@@ -0,0 +1,34 @@
+"""empty message
+
+Revision ID: a4c3e9d27b15
+Revises: f0442f16a8f3
+Create Date: 2026-10-19 18:52:07.114520
+
+Add probe_vars.timing_sketch column: streaming quantile sketch of
+recent Probe response times, used by history-aware Checks.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = 'a4c3e9d27b15'
+down_revision = 'f0442f16a8f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not alembic_helpers.table_has_column('probe_vars', 'timing_sketch'):
+        print('Column timing_sketch not present in probe_vars table, '
+              'will create')
+        op.add_column(u'probe_vars', sa.Column('timing_sketch', sa.Text(),
+                      nullable=True))
+    else:
+        print('Column timing_sketch already present in probe_vars table')
+
+
+def downgrade():
+    print('Dropping Column timing_sketch from probe_vars table')
+    op.drop_column(u'probe_vars', 'timing_sketch')
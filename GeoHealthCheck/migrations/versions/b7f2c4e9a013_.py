@@ -0,0 +1,53 @@
+"""empty message
+
+Revision ID: b7f2c4e9a013
+Revises: e5d19a3b6c07
+Create Date: 2026-10-19 23:02:41.836514
+
+Add composite index on run (resource_identifier, checked_datetime)
+for Runs of a Resource ordered by time. In Postgres 11+ the index
+covers (INCLUDE) success and response_time for aggregates. Replaces
+index ix_run_resource_identifier, a prefix of the new index.
+
+"""
+from alembic import op
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = 'b7f2c4e9a013'
+down_revision = 'e5d19a3b6c07'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'ix_run_resource_identifier_checked_datetime'
+INCLUDE_MIN_POSTGRES_VERSION = (11,)
+
+
+def upgrade():
+    if not alembic_helpers.table_has_index('run', INDEX_NAME):
+        connection = op.get_bind()
+        if connection.dialect.name == 'postgresql' and \
+                connection.dialect.server_version_info >= \
+                INCLUDE_MIN_POSTGRES_VERSION:
+            print('Creating covering index %s' % INDEX_NAME)
+            op.execute(
+                'CREATE INDEX %s ON run (resource_identifier, '
+                'checked_datetime) INCLUDE (success, response_time)'
+                % INDEX_NAME)
+        else:
+            print('Creating index %s' % INDEX_NAME)
+            op.create_index(op.f(INDEX_NAME), 'run',
+                            ['resource_identifier', 'checked_datetime'])
+    else:
+        print('Index %s already present' % INDEX_NAME)
+
+    if alembic_helpers.table_has_index('run', 'ix_run_resource_identifier'):
+        print('Dropping index ix_run_resource_identifier')
+        op.drop_index(op.f('ix_run_resource_identifier'), table_name='run')
+
+
+def downgrade():
+    alembic_helpers.create_index('ix_run_resource_identifier', 'run',
+                                 ['resource_identifier'], unique=False)
+    print('Dropping index %s' % INDEX_NAME)
+    op.drop_index(op.f(INDEX_NAME), table_name='run')
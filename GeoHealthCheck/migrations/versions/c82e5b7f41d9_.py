@@ -0,0 +1,124 @@
+"""empty message
+
+Revision ID: c82e5b7f41d9
+Revises: a4c3e9d27b15
+Create Date: 2026-10-19 21:04:45.281936
+
+Add run_rollup table: hourly and daily aggregates of Runs per Resource,
+maintained by the runner. Filled from the Runs present, rebuilt with
+python3 GeoHealthCheck/models.py rollup
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column
+from GeoHealthCheck.migrations import alembic_helpers
+from GeoHealthCheck.sketch import QuantileSketch
+
+# revision identifiers, used by Alembic.
+revision = 'c82e5b7f41d9'
+down_revision = 'a4c3e9d27b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not alembic_helpers.tables_exist(['run_rollup']):
+        print('Table run_rollup not present, will create')
+        op.create_table(
+            'run_rollup',
+            sa.Column('identifier', sa.Integer(), nullable=False),
+            sa.Column('resource_identifier', sa.Integer(), nullable=False),
+            sa.Column('period', sa.Text(), nullable=False),
+            sa.Column('period_start', sa.DateTime(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.Column('success_count', sa.Integer(), nullable=False),
+            sa.Column('response_time_sum', sa.Float(), nullable=False),
+            sa.Column('response_time_min', sa.Float(), nullable=True),
+            sa.Column('response_time_max', sa.Float(), nullable=True),
+            sa.Column('sketch', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['resource_identifier'],
+                                    ['resource.identifier'], ),
+            sa.PrimaryKeyConstraint('identifier'),
+            sa.UniqueConstraint('resource_identifier', 'period',
+                                'period_start')
+        )
+        fill_rollups()
+    else:
+        print('Table run_rollup already present')
+
+
+def fill_rollups():
+    """
+    Build hourly and daily rollups of the Runs present, per Resource,
+    as RunRollup.add_run() does for each new Run.
+    """
+    print('Filling run_rollup table from Runs')
+    run = table('run',
+                column('resource_identifier', sa.Integer),
+                column('checked_datetime', sa.DateTime),
+                column('success', sa.Boolean),
+                column('response_time', sa.Float))
+    run_rollup = table('run_rollup',
+                       column('resource_identifier', sa.Integer),
+                       column('period', sa.Text),
+                       column('period_start', sa.DateTime),
+                       column('count', sa.Integer),
+                       column('success_count', sa.Integer),
+                       column('response_time_sum', sa.Float),
+                       column('response_time_min', sa.Float),
+                       column('response_time_max', sa.Float),
+                       column('sketch', sa.Text))
+
+    connection = op.get_bind()
+    resource_ids = [row[0] for row in connection.execute(
+        sa.select([run.c.resource_identifier]).distinct())]
+    for resource_id in resource_ids:
+        runs = connection.execute(
+            sa.select([run.c.checked_datetime, run.c.success,
+                       run.c.response_time]).where(
+                run.c.resource_identifier == resource_id).order_by(
+                run.c.checked_datetime))
+
+        rollups = {}
+        sketches = {}
+        for checked_datetime, success, response_time in runs:
+            response_time = float(response_time)
+            # UTC without timezone, see RunRollup.get_period_start()
+            hour_start = checked_datetime.replace(
+                minute=0, second=0, microsecond=0)
+            for key in [('hour', hour_start),
+                        ('day', hour_start.replace(hour=0))]:
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollup = rollups[key] = {
+                        'resource_identifier': resource_id,
+                        'period': key[0],
+                        'period_start': key[1],
+                        'count': 0,
+                        'success_count': 0,
+                        'response_time_sum': 0.0,
+                        'response_time_min': response_time,
+                        'response_time_max': response_time
+                    }
+                    sketches[key] = QuantileSketch(decay=1.0)
+                rollup['count'] += 1
+                if success:
+                    rollup['success_count'] += 1
+                rollup['response_time_sum'] += response_time
+                rollup['response_time_min'] = min(
+                    rollup['response_time_min'], response_time)
+                rollup['response_time_max'] = max(
+                    rollup['response_time_max'], response_time)
+                sketches[key].add(response_time)
+        runs.close()
+
+        for key, rollup in rollups.items():
+            rollup['sketch'] = sketches[key].to_json()
+        if rollups:
+            connection.execute(run_rollup.insert(), list(rollups.values()))
+
+
+def downgrade():
+    print('Dropping table run_rollup')
+    op.drop_table('run_rollup')
@@ -0,0 +1,94 @@
+"""empty message
+
+Revision ID: e5d19a3b6c07
+Revises: c82e5b7f41d9
+Create Date: 2026-10-19 22:17:03.528190
+
+Add current state columns to resource table, denormalized from the
+last Run of each Resource: last_run_identifier, last_success,
+last_checked, state_since and consecutive_failures. Filled from the
+Runs present.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = 'e5d19a3b6c07'
+down_revision = 'c82e5b7f41d9'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('last_run_identifier', sa.Integer(), nullable=True),
+    sa.Column('last_success', sa.Boolean(), nullable=True),
+    sa.Column('last_checked', sa.DateTime(), nullable=True),
+    sa.Column('state_since', sa.DateTime(), nullable=True),
+    sa.Column('consecutive_failures', sa.Integer(), nullable=False,
+              default=0, server_default='0')
+]
+
+
+def upgrade():
+    for col in COLUMNS:
+        if not alembic_helpers.table_has_column('resource', col.name):
+            print('Column %s not present in resource table, will create'
+                  % col.name)
+            op.add_column(u'resource', col.copy())
+        else:
+            print('Column %s already present in resource table' % col.name)
+
+    print('Filling current state columns from last Runs')
+    resource = table('resource',
+                     column('identifier', sa.Integer),
+                     column('last_run_identifier', sa.Integer),
+                     column('last_success', sa.Boolean),
+                     column('last_checked', sa.DateTime),
+                     column('state_since', sa.DateTime),
+                     column('consecutive_failures', sa.Integer))
+    run = table('run',
+                column('identifier', sa.Integer),
+                column('resource_identifier', sa.Integer),
+                column('checked_datetime', sa.DateTime),
+                column('success', sa.Boolean))
+
+    connection = op.get_bind()
+    resource_ids = [row[0] for row in connection.execute(
+        sa.select([resource.c.identifier]))]
+    for resource_id in resource_ids:
+        runs = connection.execute(
+            sa.select([run.c.identifier, run.c.checked_datetime,
+                       run.c.success]).where(
+                run.c.resource_identifier == resource_id).order_by(
+                run.c.checked_datetime.desc(), run.c.identifier.desc()))
+
+        state = None
+        for identifier, checked_datetime, success in runs:
+            if state is None:
+                state = {
+                    'last_run_identifier': identifier,
+                    'last_success': success,
+                    'last_checked': checked_datetime,
+                    'state_since': checked_datetime,
+                    'consecutive_failures': 0
+                }
+            elif success != state['last_success']:
+                break
+
+            # Runs (back in time) with the same success as the last Run
+            state['state_since'] = checked_datetime
+            if not success:
+                state['consecutive_failures'] += 1
+        runs.close()
+
+        if state is not None:
+            connection.execute(resource.update().where(
+                resource.c.identifier == resource_id).values(state))
+
+
+def downgrade():
+    for col in COLUMNS:
+        print('Dropping Column %s from resource table' % col.name)
+        op.drop_column(u'resource', col.name)
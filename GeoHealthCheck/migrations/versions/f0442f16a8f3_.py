@@ -0,0 +1,49 @@
+"""empty message
+
+Revision ID: f0442f16a8f3
+Revises: 933717a14052
+Create Date: 2026-10-19 10:12:31.472613
+
+Add resource_capabilities table: Capabilities summaries per Resource
+stored by the runner, used by Probe edit forms.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from GeoHealthCheck.migrations import alembic_helpers
+
+# revision identifiers, used by Alembic.
+revision = 'f0442f16a8f3'
+down_revision = '933717a14052'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not alembic_helpers.tables_exist(['resource_capabilities']):
+        print('Table resource_capabilities not present, will create')
+        op.create_table(
+            'resource_capabilities',
+            sa.Column('identifier', sa.Integer(), nullable=False),
+            sa.Column('resource_identifier', sa.Integer(), nullable=True),
+            sa.Column('probe_class', sa.Text(), nullable=False),
+            sa.Column('version', sa.Text(), nullable=False),
+            sa.Column('url', sa.Text(), nullable=False),
+            sa.Column('format_version', sa.Integer(), nullable=False),
+            sa.Column('updated_datetime', sa.DateTime(), nullable=False),
+            sa.Column('summary', sa.Text(), nullable=False),
+            sa.ForeignKeyConstraint(['resource_identifier'],
+                                    ['resource.identifier'], ),
+            sa.PrimaryKeyConstraint('identifier'),
+            sa.UniqueConstraint('resource_identifier', 'version')
+        )
+        alembic_helpers.create_index(
+            'ix_resource_capabilities_resource_identifier',
+            'resource_capabilities', ['resource_identifier'])
+    else:
+        print('Table resource_capabilities already present')
+
+
+def downgrade():
+    print('Dropping table resource_capabilities')
+    op.drop_table('resource_capabilities')
@@ -28,23 +28,29 @@
 #
 # =================================================================
 
+import hashlib
 import json
 import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from flask_babel import gettext as _
 from datetime import datetime, timedelta, timezone
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, case, exists, or_
 
-from sqlalchemy.orm import deferred
+from sqlalchemy.orm import deferred, selectinload, undefer_group
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 import util
+from capabilities import CapabilitiesSummary, FORMAT_VERSION
 from enums import RESOURCE_TYPES
 from factory import Factory
 from init import App
 from resourceauth import ResourceAuth
+from sketch import QuantileSketch
 from wtforms.validators import Email, ValidationError
-from owslib.util import bind_url
 
 APP = App.get_app()
 DB = App.get_db()
@@ -52,29 +58,98 @@ LOGGER = logging.getLogger(__name__)
 
 
 # Complete handle of old runs deletion
-def flush_runs():
+def flush_runs(batch_size=None, pause_secs=None, progress=None):
+    """
+    Delete Runs older than GHC_RETENTION_DAYS in batches of set-based
+    DELETEs, each in its own transaction, pausing in between, such that
+    tables are never locked long. An interrupted flush is resumed by the
+    next one: deleted batches are committed.
+    :param batch_size: max Runs per DELETE, default GHC_FLUSH_BATCH_SIZE
+    :param pause_secs: pause between batches, default GHC_FLUSH_PAUSE_SECS
+    :param progress: optional function called after each batch with the
+        number of Runs deleted so far
+    :return: number of Runs deleted
+    """
     retention_days = int(APP.config['GHC_RETENTION_DAYS'])
+    if batch_size is None:
+        batch_size = int(APP.config['GHC_FLUSH_BATCH_SIZE'])
+    if pause_secs is None:
+        pause_secs = float(APP.config['GHC_FLUSH_PAUSE_SECS'])
+
+    # As stored: UTC without timezone. Older means > retention_days days.
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - \
+        timedelta(days=retention_days + 1)
     LOGGER.info('Flushing runs older than %d days' % retention_days)
-    all_runs = Run.query.all()
+
+    # Only report structures that existed before: newer ones may be
+    # referenced by Runs not committed yet
+    max_report_id = DB.session.query(
+        func.max(RunReport.identifier)).scalar()
+
     run_count = 0
-    for run in all_runs:
-        days_old = (datetime.now(timezone.utc) - run.checked_datetime).days
-        if days_old > retention_days:
-            run_count += 1
-            DB.session.delete(run)
-    db_commit()
+    last_id = 0
+    start = time.time()
+    while True:
+        # Batch is range of identifiers: walks the primary key index
+        # and keeps the DELETE statement small
+        old_runs = Run.query.filter(
+            Run.identifier > last_id, Run.checked_datetime < cutoff)
+        batch_last_id = old_runs.with_entities(Run.identifier)\
+            .order_by(Run.identifier).offset(batch_size - 1).limit(1)\
+            .scalar()
+        if batch_last_id is not None:
+            old_runs = old_runs.filter(Run.identifier <= batch_last_id)
+
+        deleted = old_runs.delete(synchronize_session=False)
+        db_commit()
+        run_count += deleted
+
+        if batch_last_id is None:
+            break
+
+        last_id = batch_last_id
+        LOGGER.info('Deleted %d Runs (%.0f Runs/s), continuing after Run %d'
+                    % (run_count, run_count / (time.time() - start), last_id))
+        if progress:
+            progress(run_count)
+        time.sleep(pause_secs)
+
     LOGGER.info('Deleted %d Runs' % run_count)
+    if progress:
+        progress(run_count)
+
+    # Hourly rollups go with the Runs, daily rollups are kept
+    RunRollup.query.filter(
+        RunRollup.period == 'hour', RunRollup.period_start < cutoff)\
+        .delete(synchronize_session=False)
+    db_commit()
+
+    # Report structures of no Run any more
+    if max_report_id is not None:
+        RunReport.query.filter(
+            RunReport.identifier <= max_report_id,
+            ~exists().where(Run.report_identifier == RunReport.identifier))\
+            .delete(synchronize_session=False)
+        db_commit()
 
     DB.session.remove()
+    return run_count
 
 
 class Run(DB.Model):
     """measurement of resource state"""
 
+    # Runs are mostly accessed per Resource ordered by time. In Postgres
+    # 11+ the migration adds success and response_time as covering
+    # (INCLUDE) columns for aggregates.
+    __table_args__ = (
+        DB.Index('ix_run_resource_identifier_checked_datetime',
+                 'resource_identifier', 'checked_datetime'),
+    )
+
     identifier = DB.Column(DB.Integer, primary_key=True, autoincrement=True)
     resource_identifier = DB.Column(DB.Integer,
-                                    DB.ForeignKey('resource.identifier'),
-                                    index=True)
+                                    DB.ForeignKey('resource.identifier'))
     resource = DB.relationship('Resource',
                                backref=DB.backref('runs', lazy='dynamic',
                                                   cascade="all,delete"))
@@ -83,8 +158,10 @@ class Run(DB.Model):
     response_time = DB.Column(DB.Float, nullable=False)
     message = DB.Column(DB.Text, default='OK')
 
-    # Make report 'deferred' as not to be included in all queries.
-    report = deferred(DB.Column(DB.Text, default={}))
+    REPORT_FORMAT_VERSION = 1
+    """
+    Version of compact report encoding, first byte of report_data.
+    """
 
     def __init__(self, resource, result,
                  checked_datetime=datetime.now(timezone.utc)):
@@ -113,17 +190,65 @@ class Run(DB.Model):
     def __hash__(self):
         return hash(f"{self.identifier}{self.checked_datetime}{self.resource}")
 
-    # JSON string object specifying report for the Run
+    # Report for the Run: structure stored once per content in RunReport
+    # plus JSON list of the timings of this Run, see RunReport. Runs
+    # stored before have a compact encoded report, see encode_report(),
+    # or a JSON string, until compacted.
+    # Make report 'deferred' as not to be included in all queries.
     # See http://docs.sqlalchemy.org/en/latest/orm/mapped_attributes.html
-    _report = DB.Column("report", DB.Text, default={})
+    report_identifier = deferred(
+        DB.Column(DB.Integer, DB.ForeignKey('run_report.identifier'),
+                  nullable=True, index=True), group='report')
+    run_report = DB.relationship('RunReport')
+    _report_timings = deferred(DB.Column("report_timings", DB.Text,
+                                         nullable=True), group='report')
+    _report = deferred(DB.Column("report", DB.Text, nullable=True),
+                       group='report')
+    _report_data = deferred(DB.Column("report_data", DB.LargeBinary,
+                                      nullable=True), group='report')
 
     @property
     def report(self):
-        return json.loads(self._report)
+        # Set but not flushed yet, or missing on SQLite (no foreign key)
+        # if flushed while this Run was added
+        run_report = self.run_report
+        if run_report is not None:
+            return RunReport.join_report(
+                RunReport.get_structure(run_report),
+                json.loads(self._report_timings))
+        if self._report_data is not None:
+            return Run.decode_report(self._report_data)
+        if self._report is not None:
+            return json.loads(self._report)
+        return None
 
     @report.setter
     def report(self, report):
-        self._report = json.dumps(report)
+        structure, timings = RunReport.split_report(report)
+        self.run_report = RunReport.get_or_create(structure)
+        self._report_timings = json.dumps(timings)
+        self._report_data = None
+        self._report = None
+
+    @staticmethod
+    def encode_report(report):
+        """
+        Encode report compact: format version byte and zlib compressed
+        JSON, often less than a tenth of the JSON string.
+        """
+        return bytes([Run.REPORT_FORMAT_VERSION]) + zlib.compress(
+            json.dumps(report).encode('utf-8'))
+
+    @staticmethod
+    def decode_report(data):
+        """
+        Decode report from `encode_report()` data.
+        """
+        # Postgres drivers may return memoryview
+        data = bytes(data)
+        if data[0] != Run.REPORT_FORMAT_VERSION:
+            raise ValueError('Unknown report format version %d' % data[0])
+        return json.loads(zlib.decompress(data[1:]).decode('utf-8'))
 
     def __repr__(self):
         return '<Run %r>' % (self.identifier)
@@ -137,6 +262,383 @@ class Run(DB.Model):
         }
 
 
+class RunReport(DB.Model):
+    """
+    Structure of Run reports: the report without the timings, stored
+    once per content and referenced from all Runs with that content.
+    Consecutive Runs of a healthy Resource mostly share one. Keyed by
+    hash of the content.
+    """
+
+    TIMING_KEYS = ['start_time', 'end_time', 'response_time']
+    """
+    Report keys with per Run values, stored in the Run.
+    """
+
+    STRUCTURE_CACHE = OrderedDict()
+    """
+    LRU cache of decoded structures keyed by hash.
+    """
+
+    STRUCTURE_CACHE_SIZE = 1024
+    """
+    Max number of structures in `STRUCTURE_CACHE`.
+    """
+
+    STRUCTURE_CACHE_LOCK = threading.Lock()
+    """
+    Guards `STRUCTURE_CACHE`: reports are read in concurrent web threads.
+    """
+
+    identifier = DB.Column(DB.Integer, primary_key=True, autoincrement=True)
+    # sha256 of the canonical JSON of the structure
+    hash = DB.Column(DB.Text, nullable=False, unique=True)
+    # Compact encoded structure, see Run.encode_report()
+    data = DB.Column(DB.LargeBinary, nullable=False)
+
+    def __init__(self, content_hash, structure):
+        self.hash = content_hash
+        self.data = Run.encode_report(structure)
+
+    @staticmethod
+    def split_report(report):
+        """
+        Split report into structure, with None for the timings, and
+        list of the timings, in order of sorted keys.
+        :return: tuple (structure, timings)
+        """
+        timings = []
+
+        def split(value):
+            if isinstance(value, dict):
+                structure = {}
+                for key in sorted(value):
+                    if key in RunReport.TIMING_KEYS:
+                        timings.append(value[key])
+                        structure[key] = None
+                    else:
+                        structure[key] = split(value[key])
+                return structure
+            if isinstance(value, list):
+                return [split(item) for item in value]
+            return value
+
+        return split(report), timings
+
+    @staticmethod
+    def join_report(structure, timings):
+        """
+        Join structure and timings from `split_report()` into a new report.
+        """
+        timings = iter(timings)
+
+        def join(value):
+            if isinstance(value, dict):
+                report = {}
+                for key in sorted(value):
+                    if key in RunReport.TIMING_KEYS:
+                        report[key] = next(timings)
+                    else:
+                        report[key] = join(value[key])
+                return report
+            if isinstance(value, list):
+                return [join(item) for item in value]
+            return value
+
+        return join(structure)
+
+    @staticmethod
+    def get_or_create(structure):
+        """
+        Get RunReport with structure, new if not stored yet. No two
+        Runs of a Resource are added at the same time (ResourceLock),
+        and structures include the Resource, so no duplicates are added.
+        """
+        content_hash = hashlib.sha256(json.dumps(
+            structure, sort_keys=True).encode('utf-8')).hexdigest()
+
+        # Also added in this session but not yet flushed
+        for obj in DB.session.new:
+            if isinstance(obj, RunReport) and obj.hash == content_hash:
+                return obj
+
+        with DB.session.no_autoflush:
+            run_report = RunReport.query.filter_by(hash=content_hash).first()
+        if run_report is None:
+            run_report = RunReport(content_hash, structure)
+            DB.session.add(run_report)
+        return run_report
+
+    @staticmethod
+    def get_structure(run_report):
+        """
+        Get decoded structure, cached.
+        """
+        cache = RunReport.STRUCTURE_CACHE
+        key = run_report.hash
+        with RunReport.STRUCTURE_CACHE_LOCK:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+        # Decoded outside the lock
+        structure = Run.decode_report(run_report.data)
+        with RunReport.STRUCTURE_CACHE_LOCK:
+            cache[key] = structure
+            if len(cache) > RunReport.STRUCTURE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return structure
+
+    def __repr__(self):
+        return '<RunReport %r %s>' % (self.identifier, self.hash)
+
+
+class RunRollup(DB.Model):
+    """
+    Aggregate of the Runs of a Resource in an hour or a day, maintained
+    on each Run such that statistics over long periods need not read all
+    Runs. Hourly rollups are flushed with the Runs, daily rollups kept.
+    """
+
+    __table_args__ = (
+        DB.UniqueConstraint('resource_identifier', 'period', 'period_start'),
+    )
+
+    PERIODS = ['hour', 'day']
+    """
+    Rollup periods.
+    """
+
+    identifier = DB.Column(DB.Integer, primary_key=True, autoincrement=True)
+    resource_identifier = DB.Column(DB.Integer,
+                                    DB.ForeignKey('resource.identifier'),
+                                    nullable=False)
+    resource = DB.relationship('Resource',
+                               backref=DB.backref('run_rollups',
+                                                  lazy='dynamic',
+                                                  cascade="all,delete"))
+    period = DB.Column(DB.Text, nullable=False)
+    # UTC without timezone, as Run.checked_datetime
+    period_start = DB.Column(DB.DateTime, nullable=False)
+    count = DB.Column(DB.Integer, nullable=False, default=0)
+    success_count = DB.Column(DB.Integer, nullable=False, default=0)
+    response_time_sum = DB.Column(DB.Float, nullable=False, default=0.0)
+    response_time_min = DB.Column(DB.Float, nullable=True)
+    response_time_max = DB.Column(DB.Float, nullable=True)
+
+    # JSON string of QuantileSketch of response times in period
+    _sketch = DB.Column("sketch", DB.Text, nullable=False)
+
+    def __init__(self, resource_identifier, period, period_start):
+        self.resource_identifier = resource_identifier
+        self.period = period
+        self.period_start = period_start
+        self.count = 0
+        self.success_count = 0
+        self.response_time_sum = 0.0
+        self.sketch = QuantileSketch(decay=1.0)
+
+    @property
+    def sketch(self):
+        """
+        QuantileSketch of response times, decoded once. Assign to update.
+        """
+        if getattr(self, '_sketch_json', None) is not self._sketch:
+            self._sketch_obj = QuantileSketch.from_json(self._sketch)
+            self._sketch_json = self._sketch
+        return self._sketch_obj
+
+    @sketch.setter
+    def sketch(self, sketch):
+        self._sketch = sketch.to_json()
+        self._sketch_obj = sketch
+        self._sketch_json = self._sketch
+
+    @property
+    def average_response_time(self):
+        return self.response_time_sum / self.count if self.count else 0
+
+    @property
+    def reliability(self):
+        return util.percentage(self.success_count, self.count)
+
+    def add(self, results):
+        """
+        Add Run results to aggregate.
+        :param results: list of (success, response_time) tuples
+        """
+        sketch = self.sketch
+        for success, response_time in results:
+            self.count += 1
+            if success:
+                self.success_count += 1
+            self.response_time_sum += response_time
+            if self.response_time_min is None \
+                    or response_time < self.response_time_min:
+                self.response_time_min = response_time
+            if self.response_time_max is None \
+                    or response_time > self.response_time_max:
+                self.response_time_max = response_time
+            sketch.add(response_time)
+        self.sketch = sketch
+
+    @staticmethod
+    def get_period_start(checked_datetime, period):
+        """
+        Start of hour or day of a datetime, as UTC without timezone.
+        """
+        if checked_datetime.tzinfo is not None:
+            checked_datetime = checked_datetime.astimezone(
+                timezone.utc).replace(tzinfo=None)
+        period_start = checked_datetime.replace(
+            minute=0, second=0, microsecond=0)
+        if period == 'day':
+            period_start = period_start.replace(hour=0)
+        return period_start
+
+    @staticmethod
+    def add_run(run):
+        """
+        Add new Run to the hourly and daily rollups of its Resource,
+        in the same transaction as the Run.
+        """
+        resource_identifier = run.resource.identifier
+        for period in RunRollup.PERIODS:
+            period_start = RunRollup.get_period_start(
+                run.checked_datetime, period)
+            rollup = RunRollup.query.filter_by(
+                resource_identifier=resource_identifier, period=period,
+                period_start=period_start).first()
+            if rollup is None:
+                rollup = RunRollup(resource_identifier, period, period_start)
+                DB.session.add(rollup)
+            rollup.add([(run.success, float(run.response_time))])
+
+    def __repr__(self):
+        return '<RunRollup %r %s %s>' % (
+            self.resource_identifier, self.period, self.period_start)
+
+
+def compact_reports(batch_size=None, pause_secs=None, progress=None):
+    """
+    Background migration of reports of Runs stored before, as JSON string
+    or compact encoded, to RunReport structure and timings, in batches
+    each in its own transaction, pausing in between. An interrupted
+    migration is resumed by the next one.
+    NB the database only returns freed space after VACUUM.
+    :param batch_size: max Runs per batch, default GHC_COMPACT_BATCH_SIZE
+    :param pause_secs: pause between batches, default GHC_FLUSH_PAUSE_SECS
+    :param progress: optional function called after each batch with the
+        number of Runs compacted so far
+    :return: number of Runs compacted
+    """
+    if batch_size is None:
+        batch_size = int(APP.config['GHC_COMPACT_BATCH_SIZE'])
+    if pause_secs is None:
+        pause_secs = float(APP.config['GHC_FLUSH_PAUSE_SECS'])
+
+    run_count = 0
+    last_id = 0
+    while True:
+        runs = Run.query.options(undefer_group('report')).filter(
+            Run.identifier > last_id, Run.report_identifier.is_(None),
+            or_(Run._report.isnot(None), Run._report_data.isnot(None)))\
+            .order_by(Run.identifier).limit(batch_size).all()
+        if not runs:
+            break
+
+        for run in runs:
+            # Stored anew
+            run.report = run.report
+        db_commit()
+        run_count += len(runs)
+        last_id = runs[-1].identifier
+
+        LOGGER.info('Compacted reports of %d Runs' % run_count)
+        if progress:
+            progress(run_count)
+        time.sleep(pause_secs)
+
+    return run_count
+
+
+def get_rollup_runs_counts(since=None):
+    """
+    Return total and successful number of Runs from daily rollups.
+    :param since: optional datetime from which Runs are counted
+    :return: tuple (total, success)
+    """
+    query = DB.session.query(
+        func.coalesce(func.sum(RunRollup.count), 0),
+        func.coalesce(func.sum(RunRollup.success_count), 0)).filter(
+        RunRollup.period == 'day')
+    if since is not None:
+        query = query.filter(RunRollup.period_start >=
+                             RunRollup.get_period_start(since, 'day'))
+    return tuple(query.one())
+
+
+def backfill_rollups(resource_identifier=None, progress=None):
+    """
+    (Re)build hourly and daily rollups from the Runs present, e.g.
+    after upgrading. Runs are streamed per Resource, one query and one
+    commit each: no commit while a (server-side) cursor is open.
+    NB rollups of Runs no longer present (flushed) are lost.
+    :param resource_identifier: optional, only for this Resource
+    :param progress: optional function called after each Resource
+        with the number of Runs processed so far
+    :return: number of Runs processed
+    """
+    rollups = RunRollup.query
+    resource_ids = DB.session.query(Run.resource_identifier).distinct()
+    if resource_identifier is not None:
+        rollups = rollups.filter_by(resource_identifier=resource_identifier)
+        resource_ids = resource_ids.filter_by(
+            resource_identifier=resource_identifier)
+    rollups.delete(synchronize_session=False)
+    resource_ids = sorted(row[0] for row in resource_ids)
+    db_commit()
+
+    run_count = 0
+    for resource_id in resource_ids:
+        runs = DB.session.query(
+            Run.checked_datetime, Run.success, Run.response_time).filter(
+            Run.resource_identifier == resource_id).order_by(
+            Run.checked_datetime)
+        current = {}
+        for checked_datetime, success, response_time in \
+                runs.yield_per(10000):
+            for period in RunRollup.PERIODS:
+                key = (resource_id, period,
+                       RunRollup.get_period_start(checked_datetime, period))
+                if key not in current:
+                    current[key] = []
+                current[key].append((success, response_time))
+
+        # All Runs of Resource read, cursor closed
+        run_count += save_rollups(current)
+        if progress:
+            progress(run_count)
+    return run_count
+
+
+def save_rollups(rollup_runs):
+    """
+    Store rollups, for backfill_rollups().
+    :param rollup_runs: dict of (resource, period, start) with Run values
+    :return: number of Runs in rollups
+    """
+    run_count = 0
+    for (resource_id, period, period_start), values in rollup_runs.items():
+        rollup = RunRollup(resource_id, period, period_start)
+        rollup.add(values)
+        DB.session.add(rollup)
+        if period == RunRollup.PERIODS[0]:
+            run_count += rollup.count
+    db_commit()
+    return run_count
+
+
 class ProbeVars(DB.Model):
     """
     Identifies and parameterizes single Probe class. Probe
@@ -157,6 +659,9 @@ class ProbeVars(DB.Model):
     # See http://docs.sqlalchemy.org/en/latest/orm/mapped_attributes.html
     _parameters = DB.Column("parameters", DB.Text, default={})
 
+    # JSON string of QuantileSketch of recent Probe response times
+    _timing_sketch = DB.Column("timing_sketch", DB.Text, nullable=True)
+
     def __init__(self, resource_obj, probe_class, parameters={}):
         self.resource = resource_obj
         self.probe_class = probe_class
@@ -164,11 +669,38 @@ class ProbeVars(DB.Model):
 
     @property
     def parameters(self):
-        return json.loads(self._parameters)
+        """
+        Parameters decoded once and cached until the JSON string changes,
+        by assignment or by reload from DB. Do not modify in place.
+        """
+        if getattr(self, '_parameters_json', None) is not self._parameters:
+            self._parameters_dict = json.loads(self._parameters)
+            self._parameters_json = self._parameters
+        return self._parameters_dict
 
     @parameters.setter
     def parameters(self, parameters):
         self._parameters = json.dumps(parameters)
+        self._parameters_json = None
+
+    @property
+    def response_times(self):
+        """
+        QuantileSketch of recent response times (secs), decoded once
+        and cached until the JSON string changes. Use
+        `add_response_time()` to add a response time.
+        """
+        if getattr(self, '_timing_sketch_json', None) is not \
+                self._timing_sketch or not hasattr(self, '_sketch'):
+            self._sketch = QuantileSketch.from_json(self._timing_sketch)
+            self._timing_sketch_json = self._timing_sketch
+        return self._sketch
+
+    def add_response_time(self, secs):
+        sketch = self.response_times
+        sketch.add(secs)
+        self._timing_sketch = sketch.to_json()
+        self._timing_sketch_json = self._timing_sketch
 
     @property
     def probe_instance(self):
@@ -176,11 +708,11 @@ class ProbeVars(DB.Model):
 
     @property
     def name(self):
-        return self.probe_instance.NAME
+        return Factory.create_class(self.probe_class).NAME
 
     @property
     def probe_parameters(self):
-        return self.probe_instance.REQUEST_PARAMETERS
+        return Factory.create_class(self.probe_class).REQUEST_PARAMETERS
 
     def __repr__(self):
         return '<ProbeVars %r>' % self.identifier
@@ -209,16 +741,94 @@ class CheckVars(DB.Model):
 
     @property
     def parameters(self):
-        return json.loads(self._parameters)
+        """
+        Parameters decoded once and cached until the JSON string changes,
+        by assignment or by reload from DB. Do not modify in place.
+        """
+        if getattr(self, '_parameters_json', None) is not self._parameters:
+            self._parameters_dict = json.loads(self._parameters)
+            self._parameters_json = self._parameters
+        return self._parameters_dict
 
     @parameters.setter
     def parameters(self, parameters):
         self._parameters = json.dumps(parameters)
+        self._parameters_json = None
 
     def __repr__(self):
         return '<CheckVars %r>' % self.identifier
 
 
+class ResourceCapabilities(DB.Model):
+    """
+    Capabilities summary for a Resource as stored by the runner,
+    such that e.g. Probe edit forms need not fetch the Capabilities.
+    """
+
+    __tablename__ = 'resource_capabilities'
+    # One summary per version, also with concurrent runners
+    __table_args__ = (
+        DB.UniqueConstraint('resource_identifier', 'version'),
+    )
+
+    identifier = DB.Column(DB.Integer, primary_key=True, autoincrement=True)
+    resource_identifier = DB.Column(DB.Integer,
+                                    DB.ForeignKey('resource.identifier'),
+                                    index=True)
+    resource = DB.relationship(
+        'Resource', backref=DB.backref('capabilities',
+                                       lazy='dynamic',
+                                       cascade="all, delete-orphan"))
+
+    # Probe class that obtained the summary, used to refresh it
+    probe_class = DB.Column(DB.Text, nullable=False)
+    # Version argument of Probe.get_metadata()
+    version = DB.Column(DB.Text, nullable=False)
+    # Resource URL at time of summary
+    url = DB.Column(DB.Text, nullable=False)
+    format_version = DB.Column(DB.Integer, nullable=False)
+    updated_datetime = DB.Column(DB.DateTime, nullable=False)
+
+    # JSON string object of CapabilitiesSummary.to_dict()
+    _summary = deferred(DB.Column("summary", DB.Text, nullable=False))
+
+    def __init__(self, resource, probe_class, version, summary):
+        self.resource = resource
+        self.probe_class = probe_class
+        self.version = version
+        self.summary = summary
+
+    @property
+    def summary(self):
+        return CapabilitiesSummary.from_dict(json.loads(self._summary))
+
+    @summary.setter
+    def summary(self, summary):
+        self._summary = json.dumps(summary.to_dict())
+        self.url = self.resource.url
+        self.format_version = FORMAT_VERSION
+        self.updated_datetime = datetime.now(timezone.utc)
+
+    def is_valid(self):
+        """
+        Is summary usable: in current format and for current URL.
+        """
+        return self.format_version == FORMAT_VERSION and \
+            self.url == self.resource.url
+
+    def is_fresh(self, max_age_secs):
+        """
+        Is summary valid and not older than `max_age_secs`.
+        """
+        updated = self.updated_datetime.replace(tzinfo=timezone.utc)
+        age = datetime.now(timezone.utc) - updated
+        return self.is_valid() and age.total_seconds() <= max_age_secs
+
+    def __repr__(self):
+        return '<ResourceCapabilities rsc_id=%r version=%r>' % \
+               (self.resource_identifier, self.version)
+
+
 class Tag(DB.Model):
     id = DB.Column(DB.Integer, primary_key=True)
     name = DB.Column(DB.String(100), unique=True, nullable=False)
@@ -405,6 +1015,22 @@ class Resource(DB.Model):
     run_frequency = DB.Column(DB.Integer, default=60)
     _auth = DB.Column('auth', DB.Text, nullable=True, default=None)
 
+    # Current state, denormalized from last Run: updated with each Run
+    # insert by update_state(), such that hot paths need not query Runs
+    last_run_identifier = DB.Column(DB.Integer, nullable=True)
+    last_success = DB.Column(DB.Boolean, nullable=True)
+    last_checked = DB.Column(DB.DateTime, nullable=True)
+    # Since when last_success did not change
+    state_since = DB.Column(DB.DateTime, nullable=True)
+    consecutive_failures = DB.Column(DB.Integer, nullable=False, default=0)
+
+    RUN_STATS_MAX_FILTER = 500
+    """
+    Max number of Resources in load_run_stats() and load_rollup_stats()
+    to filter Runs (rollups) on by identifier, for more those of all
+    Resources are aggregated.
+    """
+
     def __init__(self, owner, resource_type, title, url, tags, auth=None):
         self.resource_type = resource_type
         self.active = True
@@ -414,6 +1040,7 @@ class Resource(DB.Model):
         self.tags = tags
         self.auth = auth
         self.auth_obj = None
+        self.consecutive_failures = 0
         self.latitude, self.longitude = util.geocode(url)
 
     def __repr__(self):
@@ -428,6 +1055,8 @@ class Resource(DB.Model):
 
     @property
     def get_capabilities_url(self):
+        from owslib.util import bind_url
+
         if self.resource_type.startswith('OGC:') \
                 and self.resource_type not in \
                 ['OGC:STA', 'OGCFeat', 'ESRI:FS', 'OGC:3DTiles']:
@@ -443,7 +1072,9 @@ class Resource(DB.Model):
         if not hasattr(self, '_all_response_times'):
             result = [0]
             if self.run_count > 0:
-                result = [run.response_time for run in self.runs]
+                # Only the values, no Run objects
+                result = [response_time for response_time, in
+                          self.runs.with_entities(Run.response_time)]
 
             setattr(self, '_all_response_times', result)
 
@@ -460,56 +1091,155 @@ class Resource(DB.Model):
     @property
     def last_run(self):
         if not hasattr(self, '_last_run'):
-            _last_run = self.runs.order_by(Run.checked_datetime.desc()).first()
+            _last_run = None
+            if self.last_run_identifier is not None:
+                _last_run = Run.query.get(self.last_run_identifier)
             setattr(self, '_last_run', _last_run)
 
         return self._last_run
 
+    def update_state(self, run):
+        """
+        Update current state columns from new Run of this Resource,
+        in the transaction of the Run insert.
+        :param run: new Run, added to the session
+        """
+        # Assigns the Run identifier
+        DB.session.flush()
+
+        if run.success != self.last_success:
+            self.state_since = run.checked_datetime
+        if run.success:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures = (self.consecutive_failures or 0) + 1
+        self.last_run_identifier = run.identifier
+        self.last_success = run.success
+        self.last_checked = run.checked_datetime
+        setattr(self, '_last_run', run)
+
     @property
     def average_response_time(self):
         if not hasattr(self, '_average_response_time'):
-            result = 0
-            if self.run_count > 0:
-                query = [run.response_time for run in self.runs]
-                result = util.average(query)
-            setattr(self, '_average_response_time', result)
+            Resource.load_run_stats([self])
 
         return self._average_response_time
 
     @property
     def min_response_time(self):
         if not hasattr(self, '_min_response_time'):
-            result = 0
-            if self.run_count > 0:
-                query = [run.response_time for run in self.runs]
-                result = min(query)
-            setattr(self, '_min_response_time', result)
+            Resource.load_run_stats([self])
 
         return self._min_response_time
 
     @property
     def max_response_time(self):
         if not hasattr(self, '_max_response_time'):
-            result = 0
-            if self.run_count > 0:
-                query = [run.response_time for run in self.runs]
-                result = max(query)
-            setattr(self, '_max_response_time', result)
+            Resource.load_run_stats([self])
 
         return self._max_response_time
 
     @property
     def reliability(self):
         if not hasattr(self, '_reliability'):
-            result = 0
-            if self.run_count > 0:
-                total_runs = self.run_count
-                success_runs = self.runs.filter_by(success=True).count()
-                result = util.percentage(success_runs, total_runs)
-            setattr(self, '_reliability', result)
+            Resource.load_run_stats([self])
 
         return self._reliability
 
+    @staticmethod
+    def load_run_stats(resources):
+        """
+        Set Run statistics (run_count, reliability and min/average/max
+        response time) of Resources from one grouped aggregate query,
+        e.g. for a listing, instead of loading all Runs per Resource.
+        :param resources: list of Resources
+        """
+        resources = [resource for resource in resources
+                     if resource.identifier is not None]
+        if not resources:
+            return
+
+        query = Resource.run_stats_query()
+        if len(resources) <= Resource.RUN_STATS_MAX_FILTER:
+            query = query.filter(Run.resource_identifier.in_(
+                [resource.identifier for resource in resources]))
+        Resource.set_run_stats(resources, query)
+
+    @staticmethod
+    def load_rollup_stats(resources, since=None):
+        """
+        Set Run statistics of Resources like load_run_stats(), from
+        their daily rollups instead of their Runs.
+        :param resources: list of Resources
+        :param since: optional datetime from which Runs are counted
+        """
+        resources = [resource for resource in resources
+                     if resource.identifier is not None]
+        if not resources:
+            return
+
+        query = DB.session.query(
+            RunRollup.resource_identifier.label('resource_identifier'),
+            func.sum(RunRollup.count).label('run_count'),
+            func.sum(RunRollup.success_count).label('success_count'),
+            (func.sum(RunRollup.response_time_sum) /
+             func.sum(RunRollup.count)).label('average_response_time'),
+            func.min(RunRollup.response_time_min).label('min_response_time'),
+            func.max(RunRollup.response_time_max).label('max_response_time')
+        ).filter(RunRollup.period == 'day').group_by(
+            RunRollup.resource_identifier)
+        if since is not None:
+            query = query.filter(RunRollup.period_start >=
+                                 RunRollup.get_period_start(since, 'day'))
+        if len(resources) <= Resource.RUN_STATS_MAX_FILTER:
+            query = query.filter(RunRollup.resource_identifier.in_(
+                [resource.identifier for resource in resources]))
+        Resource.set_run_stats(resources, query)
+
+    @staticmethod
+    def set_run_stats(resources, query):
+        """
+        Set Run statistics of Resources, see load_run_stats().
+        :param resources: list of Resources
+        :param query: statistics grouped by Resource, with the columns
+            of run_stats_query()
+        """
+        stats = dict([(row.resource_identifier, row) for row in query])
+
+        for resource in resources:
+            row = stats.get(resource.identifier)
+            run_count = row.run_count if row else 0
+            setattr(resource, '_run_count', run_count)
+            setattr(resource, '_reliability', 0)
+            setattr(resource, '_average_response_time', 0)
+            setattr(resource, '_min_response_time', 0)
+            setattr(resource, '_max_response_time', 0)
+            if run_count > 0:
+                setattr(resource, '_reliability', util.percentage(
+                    int(row.success_count), run_count))
+                setattr(resource, '_average_response_time',
+                        float(row.average_response_time))
+                setattr(resource, '_min_response_time', row.min_response_time)
+                setattr(resource, '_max_response_time', row.max_response_time)
+
+    @staticmethod
+    def run_stats_query():
+        """
+        Query of Run statistics grouped by Resource, with columns
+        resource_identifier, run_count, success_count, average/min/max
+        _response_time and first_checked (datetime of first Run).
+        """
+        return DB.session.query(
+            Run.resource_identifier.label('resource_identifier'),
+            func.count(Run.identifier).label('run_count'),
+            func.sum(case([(Run.success, 1)], else_=0)).label(
+                'success_count'),
+            func.avg(Run.response_time).label('average_response_time'),
+            func.min(Run.response_time).label('min_response_time'),
+            func.max(Run.response_time).label('max_response_time'),
+            func.min(Run.checked_datetime).label('first_checked')
+        ).group_by(Run.resource_identifier)
+
     @property
     def tags2csv(self):
         return ','.join([t.name for t in self.tags])
@@ -643,6 +1373,40 @@ class Resource(DB.Model):
 
         return self.auth_obj.add_auth_header(headers_dict)
 
+    def get_capabilities_summary(self, version):
+        """
+        Get Capabilities summary as stored by the runner.
+        :param version: version argument of Probe.get_metadata()
+        :return: CapabilitiesSummary or None if none (valid) stored
+        """
+        stored = self.capabilities.filter_by(version=version).first()
+        if not stored or not stored.is_valid():
+            return None
+
+        return stored.summary
+
+    def set_capabilities_summary(self, probe_class, version, summary,
+                                 updated_datetime=None):
+        """
+        Store (insert or update) Capabilities summary. Caller commits.
+        :param probe_class: Probe class (string) obtaining summary
+        :param version: version argument of Probe.get_metadata()
+        :param summary: CapabilitiesSummary
+        :param updated_datetime: time summary was fetched, default now
+        :return: ResourceCapabilities
+        """
+        stored = self.capabilities.filter_by(version=version).first()
+        if stored:
+            stored.probe_class = probe_class
+            stored.summary = summary
+        else:
+            stored = ResourceCapabilities(self, probe_class, version, summary)
+            DB.session.add(stored)
+
+        if updated_datetime is not None:
+            stored.updated_datetime = updated_datetime
+        return stored
+
     def for_json(self):
         return {
             'identifier': self.identifier,
@@ -809,27 +1573,51 @@ def get_last_run():
 
 
 def get_last_run_per_resource():
-    """return last N Runs with results for each Resource"""
+    """
+    return last Run identifier and success for each Resource with Runs,
+    from the current state columns of Resource
+    """
+    return DB.session.query(
+        Resource.identifier.label('resource_identifier'),
+        Resource.last_run_identifier.label('identifier'),
+        Resource.last_success.label('success')).filter(
+        Resource.last_run_identifier.isnot(None)).all()
 
-    # We need an Innerjoin on same table
-    # example: https://stackoverflow.com/questions/2411559/
-    #    how-do-i-query-sql-for-a-latest-record-date-for-each-user
 
-    sql = """
-    select t.resource_identifier, t.identifier, t.success
-    from Run t
-    inner join (
-        select resource_identifier, max(identifier) as MaxId
-        from Run
-        group by resource_identifier
-    ) tm on t.resource_identifier = tm.resource_identifier
-    and t.identifier = tm.MaxId;
+def get_run_reports(run_identifiers):
     """
-
-    # Use raw query on SQLAlchemy, as the programmatic buildup
-    # would be overly complex, if even possible.
-    last_runs = DB.session.execute(sql)
-    return last_runs
+    return reports of Runs, loaded in chunks: per chunk one query for
+    the Runs and one for their report structures (RunReport)
+    :param run_identifiers: list of Run identifiers
+    :return: dict of Run identifier to report
+    """
+    reports = {}
+    chunk_size = Resource.RUN_STATS_MAX_FILTER
+    for start in range(0, len(run_identifiers), chunk_size):
+        runs = Run.query.options(
+            undefer_group('report'), selectinload(Run.run_report)).filter(
+            Run.identifier.in_(run_identifiers[start:start + chunk_size]))
+        for run in runs:
+            reports[run.identifier] = run.report
+    return reports
+
+
+def get_failing_resources(since=None, from_rollups=True):
+    """
+    return Resources of which the last Run failed, from the current
+    state columns of Resource, with their Run statistics
+    :param since: optional datetime from which Runs are counted in the
+        statistics from rollups
+    :param from_rollups: statistics from daily rollups, else from Runs
+    """
+    resources = Resource.query.filter(
+        Resource.last_success.is_(False)).order_by(
+        Resource.identifier).all()
+    if from_rollups:
+        Resource.load_rollup_stats(resources, since)
+    else:
+        Resource.load_run_stats(resources)
+    return resources
 
 
 def get_tag_counts():
@@ -988,6 +1776,14 @@ if __name__ == '__main__':
             print('NOTICE: models.py no longer here.')
             print('Use: python3 healthcheck.py or upcoming cli.py')
         elif sys.argv[1] == 'flush':
-            flush_runs()
+            flush_runs(progress=lambda count: print('Deleted %d Runs' % count))
+        elif sys.argv[1] == 'compact':
+            print('Compacting reports of Runs')
+            compact_reports(progress=lambda count: print(
+                'Compacted reports of %d Runs' % count))
+        elif sys.argv[1] == 'rollup':
+            print('Rebuilding hourly and daily Run rollups')
+            backfill_rollups(
+                progress=lambda count: print('Rolled up %d Runs' % count))
 
         DB.session.remove()
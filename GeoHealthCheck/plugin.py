@@ -2,6 +2,7 @@ from factory import Factory
 import logging
 import inspect
 from collections.abc import Mapping
+from types import MappingProxyType
 import copy
 from init import App
 
@@ -35,7 +36,21 @@ class Plugin(object):
 
     PARAM_DEFS = {}
     """
-     Plugin Parameter definitions.
+     Plugin Parameter definitions. Shared by all instances: use
+     `get_param_defs()` to read and `own_param_defs()` to modify.
+    """
+
+    PLUGIN_CLASSES = None
+    """
+    Registry of all configured Plugin classes: `list` of
+    (name, class) tuples in configuration order. Built on first use,
+    see `get_plugin_classes()` and `reload_plugins()`.
+    """
+
+    PLUGIN_INDEX = {}
+    """
+    Index of `get_plugins()` results keyed by baseclass and filters,
+    e.g. all Probes for a `RESOURCE_TYPE`. Filled on first lookup.
     """
 
     def __init__(self):
@@ -92,10 +107,22 @@ class Plugin(object):
 
     def get_param_defs(self):
         """
-        Get all PARAM_DEFS as dict.
+        Get all PARAM_DEFS as read-only view, without copying.
+        """
+
+        return MappingProxyType(self.PARAM_DEFS)
+
+    def own_param_defs(self):
+        """
+        Copy-on-write: give this instance its own copy of PARAM_DEFS,
+        e.g. before `Probe.expand_params()` sets ranges and defaults for a
+        Resource, leaving the class-level PARAM_DEFS untouched.
+        :return: PARAM_DEFS of this instance
         """
 
-        return self.get_plugin_vars()['PARAM_DEFS']
+        if 'PARAM_DEFS' not in self.__dict__:
+            self.PARAM_DEFS = Plugin.copy(self.PARAM_DEFS)
+        return self.PARAM_DEFS
 
     @staticmethod
     def copy(obj):
@@ -144,12 +171,31 @@ class Plugin(object):
         Plugins with class var values: (class var, value),
         e.g. `filters=[('RESOURCE_TYPE', 'OGC:*'),
         ('RESOURCE_TYPE', 'OGC:WMS')]`.
+        Results are indexed, so only the first lookup is expensive.
+        """
+
+        key = (baseclass, tuple(filters) if filters else None)
+        if key not in Plugin.PLUGIN_INDEX:
+            Plugin.PLUGIN_INDEX[key] = \
+                Plugin.find_plugins(baseclass, filters)
+
+        return list(Plugin.PLUGIN_INDEX[key])
+
+    @staticmethod
+    def find_plugins(baseclass, filters=None):
+        """
+        Find Plugins in registry, see `get_plugins()`.
         """
 
         result = []
         baseclass = Factory.create_class(baseclass)
+        for plugin_name, class_obj in Plugin.get_plugin_classes():
+            # Must be a class object inheriting from baseclass
+            # but not the baseclass itself
+            if baseclass not in inspect.getmro(class_obj) \
+                    or baseclass == class_obj:
+                continue
 
-        def add_result(plugin_name, class_obj):
             if not filters:
                 result.append(plugin_name)
             else:
@@ -159,6 +205,27 @@ class Plugin(object):
                         result.append(plugin_name)
                         break
 
+        return result
+
+    @staticmethod
+    def get_plugin_classes():
+        """
+        Get registry of all configured Plugin classes, build on first call.
+        :return: list of (name, class) tuples
+        """
+        if Plugin.PLUGIN_CLASSES is None:
+            Plugin.PLUGIN_CLASSES = Plugin.load_plugin_classes()
+
+        return Plugin.PLUGIN_CLASSES
+
+    @staticmethod
+    def load_plugin_classes():
+        """
+        Import all configured Plugin modules and classes.
+        :return: list of (name, class) tuples
+        """
+
+        result = []
         plugins = App.get_plugins()
         for plugin_name in plugins:
             try:
@@ -167,23 +234,29 @@ class Plugin(object):
                 module = Factory.create_module(plugin_name)
                 for name in dir(module):
                     class_obj = getattr(module, name)
-                    # Must be a class object inheriting from baseclass
-                    # but not the baseclass itself
-                    if inspect.isclass(class_obj) \
-                        and baseclass in inspect.getmro(class_obj) and \
-                            baseclass != class_obj:
-                        add_result('%s.%s' % (plugin_name, name), class_obj)
+                    if inspect.isclass(class_obj):
+                        result.append(('%s.%s' % (plugin_name, name),
+                                       class_obj))
             except Exception:
                 # Try for full classname
                 try:
                     class_obj = Factory.create_class(plugin_name)
-                    if baseclass in inspect.getmro(class_obj) \
-                            and baseclass != class_obj:
-                        add_result(plugin_name, class_obj)
+                    result.append((plugin_name, class_obj))
                 except Exception:
                     LOGGER.warn('cannot create obj class=%s' % plugin_name)
 
         return result
 
+    @staticmethod
+    def reload_plugins():
+        """
+        Clear Plugin registry and index, such that configured Plugins
+        are loaded again on next lookup, e.g. after changing
+        `App.get_plugins()`.
+        """
+        Plugin.PLUGIN_CLASSES = None
+        Plugin.PLUGIN_INDEX = {}
+        Factory.CLASS_CACHE = {}
+
     def __str__(self):
         return "%s" % str(self.__class__)
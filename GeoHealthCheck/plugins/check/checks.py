@@ -1,8 +1,14 @@
+import json
+import re
+import struct
 import sys
+from functools import lru_cache
 from owslib.etree import etree
 from GeoHealthCheck.util import CONFIG
 from GeoHealthCheck.plugin import Plugin
 from GeoHealthCheck.check import Check
+from GeoHealthCheck.capabilities import EXCEPTION_ROOTS, local_name, \
+    text as elem_text
 from html import escape
 
 
@@ -130,24 +136,219 @@ class HttpHasImageContentType(Check):
         self.set_result(result, msg)
 
 
+# JPEG Start Of Frame markers: all 0xC0-0xCF except DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+# JPEG markers without a length field: TEM, RSTn, SOI and EOI
+JPEG_NO_LENGTH_MARKERS = set([0x01] + list(range(0xD0, 0xDA)))
+
+
+def read_image_header(data):
+    """
+    Read image format and dimensions from the header of an image,
+    without decoding the image. Supports PNG, JPEG, GIF and WebP.
+    :param data: `bytes` with (a prefix of) the image
+    :return: tuple (format, width, height)
+    :raises ValueError: when not a supported image or header incomplete
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        # IHDR must be the first chunk
+        if data[12:16] != b'IHDR' or len(data) < 24:
+            raise ValueError('Invalid PNG header: no IHDR chunk')
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+
+    if data.startswith(b'\xff\xd8'):
+        offset = 2
+        while offset + 4 <= len(data):
+            if data[offset] != 0xFF:
+                raise ValueError(
+                    'Invalid JPEG header: no marker at offset %d' % offset)
+            marker = data[offset + 1]
+            if marker == 0xFF:
+                # Fill byte
+                offset += 1
+                continue
+            if marker in JPEG_NO_LENGTH_MARKERS:
+                offset += 2
+                continue
+            length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+            if marker in JPEG_SOF_MARKERS:
+                if offset + 9 > len(data):
+                    break
+                height, width = struct.unpack(
+                    '>HH', data[offset + 5:offset + 9])
+                return 'jpeg', width, height
+            offset += 2 + length
+        raise ValueError('Invalid JPEG header: no SOF marker in %d bytes'
+                         % len(data))
+
+    if data[:6] in [b'GIF87a', b'GIF89a']:
+        if len(data) < 10:
+            raise ValueError('Invalid GIF header')
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'gif', width, height
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', data[26:30])
+            return 'webp', width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L' and data[20:21] == b'\x2f':
+            bits = struct.unpack('<I', data[21:25])[0]
+            return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X' and len(data) >= 30:
+            width = int.from_bytes(data[24:27], 'little') + 1
+            height = int.from_bytes(data[27:30], 'little') + 1
+            return 'webp', width, height
+        raise ValueError('Invalid WebP header: chunk %s' % chunk)
+
+    raise ValueError('Not a PNG, JPEG, GIF or WebP image: %s'
+                     % escape(repr(data[:16])))
+
+
+class HttpHasImageSize(Check):
+    """
+    Checks if HTTP response is a valid image of the requested size,
+    e.g. a GetMap or GetTile image. Only the image header is parsed, from
+    the first bytes of the response: the image is not decoded.
+    """
+
+    NAME = 'Response is valid image of requested size'
+    DESCRIPTION = \
+        'HTTP response is PNG, JPEG, GIF or WebP image with requested ' \
+        'width and height'
+
+    PARAM_DEFS = {
+        'width': {
+            'type': 'string',
+            'description':
+                'Expected image width, default: width requested by Probe',
+            'default': None,
+            'required': False,
+            'range': None
+        },
+        'height': {
+            'type': 'string',
+            'description':
+                'Expected image height, default: height requested by Probe',
+            'default': None,
+            'required': False,
+            'range': None
+        }
+    }
+    """Param defs"""
+
+    HEADER_BYTES = 65536
+    """
+    Max bytes of response read for the image header. JPEG metadata
+    like EXIF may precede the frame header.
+    """
+
+    def __init__(self):
+        Check.__init__(self)
+
+    def get_expected(self):
+        requested = self.probe.get_image_size()
+        expected = []
+        for name, size in zip(['width', 'height'], requested):
+            value = self.get_param(name)
+            expected.append(int(value) if value else size)
+        return tuple(expected)
+
+    def perform(self):
+        try:
+            data = self.probe.response.content[:self.HEADER_BYTES]
+            image_format, width, height = read_image_header(data)
+            expected = self.get_expected()
+        except Exception:
+            self.set_result(False, str(sys.exc_info()[1]))
+            return
+
+        if expected[0] not in [None, width] or \
+                expected[1] not in [None, height]:
+            self.set_result(False, '%s image size %dx%d, expected %sx%s' % (
+                image_format, width, height,
+                expected[0] or '*', expected[1] or '*'))
+
+
 class XmlParse(Check):
     """
-    Checks if HTTP response is valid XML.
+    Checks if HTTP response is valid XML. The response is fed in chunks
+    to an incremental parser and elements are freed as soon as parsed,
+    so memory use does not grow with document size.
     """
 
     NAME = 'Valid XML response'
     DESCRIPTION = 'HTTP response contains valid XML'
 
+    CHUNK_SIZE = 65536
+    """
+    Bytes of response fed to the parser at a time.
+    """
+
+    FAIL_ON_OWS_EXCEPTION = False
+    """
+    Fail when the root element is an OWS Exception report.
+    """
+
     def __init__(self):
         Check.__init__(self)
 
     def perform(self):
+        parser = etree.XMLPullParser(
+            events=('start', 'end'), resolve_entities=False,
+            no_network=True, huge_tree=CONFIG['GHC_LARGE_XML'])
+        self.depth = 0
+        self.exception = None
         try:
-            etree.fromstring(
-                self.probe.response.content,
-                parser=etree.XMLParser(huge_tree=CONFIG['GHC_LARGE_XML']))
+            for chunk in self.probe.response.iter_content(self.CHUNK_SIZE):
+                parser.feed(chunk)
+                self.read_events(parser)
+            parser.close()
+            self.read_events(parser)
         except Exception:
             self.set_result(False, str(sys.exc_info()))
+            return
+
+        if self.exception is not None:
+            self.set_result(False, '%s: %s' % (
+                self.exception[0], ' '.join(self.exception[1:])))
+
+    def read_events(self, parser):
+        for event, elem in parser.read_events():
+            if event == 'start':
+                # Root element tells if document is an OWS Exception
+                if self.depth == 0 and self.FAIL_ON_OWS_EXCEPTION \
+                        and local_name(elem.tag) in EXCEPTION_ROOTS:
+                    self.exception = [local_name(elem.tag)]
+                self.depth += 1
+                continue
+
+            self.depth -= 1
+            if self.exception is not None and local_name(elem.tag) in \
+                    ['ServiceException', 'ExceptionText']:
+                self.exception.append(elem_text(elem) or '')
+
+            # Done with element: free it and its preceding siblings
+            elem.clear()
+            while self.depth > 0 and elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+class XmlParseNoOwsException(XmlParse):
+    """
+    Checks if HTTP response is valid XML and not an OWS Exception.
+    """
+
+    NAME = 'Valid XML response, no OWS Exception'
+    DESCRIPTION = \
+        'HTTP response contains valid XML that is not an OWS Exception'
+
+    FAIL_ON_OWS_EXCEPTION = True
+
+    def __init__(self):
+        XmlParse.__init__(self)
 
 
 class JsonParse(Check):
@@ -162,13 +363,168 @@ class JsonParse(Check):
         Check.__init__(self)
 
     def perform(self):
-        import json
         try:
-            json.loads(self.probe.response.content)
+            self.probe.response_cache.json
         except Exception:
             self.set_result(False, str(sys.exc_info()))
 
 
+class JsonSchemaValid(Check):
+    """
+    Checks if HTTP response is JSON valid against a JSON Schema.
+    Validators are compiled once per schema and cached.
+    """
+
+    NAME = 'JSON response valid against JSON Schema'
+    DESCRIPTION = 'HTTP response contains JSON valid against JSON Schema'
+
+    PARAM_DEFS = {
+        'schema': {
+            'type': 'string',
+            'description': 'The JSON Schema document (JSON text)',
+            'default': None,
+            'required': True,
+            'range': None
+        }
+    }
+    """Param defs"""
+
+    MAX_ERRORS = 3
+    """
+    Max validation errors reported in result message.
+    """
+
+    VALIDATOR_CACHE_SIZE = 64
+    """
+    Max number of compiled validators cached by `get_validator()`.
+    """
+
+    def __init__(self):
+        Check.__init__(self)
+
+    @staticmethod
+    @lru_cache(maxsize=VALIDATOR_CACHE_SIZE)
+    def get_validator(schema):
+        """
+        Get validator for JSON Schema text, compiled on first use. LRU
+        cached by schema text, thread-safe: Probes run in threads.
+        :param schema: JSON Schema as JSON text
+        :return: jsonschema Validator object
+        """
+        # Imported at first use as jsonschema is slow to import
+        from jsonschema.validators import validator_for
+
+        schema_doc = json.loads(schema)
+        validator_class = validator_for(schema_doc)
+        validator_class.check_schema(schema_doc)
+        return validator_class(schema_doc)
+
+    def perform(self):
+        try:
+            validator = self.get_validator(self.get_param('schema'))
+            doc = self.probe.response_cache.json
+            errors = list(validator.iter_errors(doc))
+        except Exception:
+            self.set_result(False, str(sys.exc_info()))
+            return
+
+        if errors:
+            msgs = ['%s at /%s' % (error.message,
+                                   '/'.join([str(p) for p in error.path]))
+                    for error in errors[:self.MAX_ERRORS]]
+            self.set_result(False, '%d JSON Schema error(s): %s' % (
+                len(errors), '; '.join(msgs)))
+
+
+class StringsMatcher(object):
+    """
+    Finds all occurrences of a list of strings (keywords) in a single scan
+    of a response body, using one combined regular expression. Scans the
+    body bytes when all strings can be encoded in the response encoding,
+    so the body need not be decoded. Otherwise, `encoding` is None and the
+    decoded text is scanned. Use `get_matcher()` to get a cached instance.
+    """
+
+    def __init__(self, strings, encoding=None):
+        # Empty string is always found
+        self.empty = '' in strings
+        strings = [string for string in set(strings) if string]
+        if encoding:
+            try:
+                patterns = [string.encode(encoding) for string in strings]
+            except UnicodeError:
+                encoding = None
+        if not encoding:
+            patterns = strings
+
+        self.encoding = encoding
+        self.patterns = dict(zip(patterns, strings))
+
+        # Longest first: at an offset the longest string is matched
+        patterns.sort(key=len, reverse=True)
+
+        # Strings also found where another string (they prefix) is found
+        self.prefixes = dict([
+            (pattern, [prefix for prefix in patterns
+                       if pattern.startswith(prefix)])
+            for pattern in patterns])
+
+        self.regex = None
+        if patterns:
+            separator = b'|' if encoding else '|'
+            self.regex = re.compile(
+                separator.join([re.escape(pattern) for pattern in patterns]))
+
+    def find(self, body):
+        """
+        Find all strings in body.
+        :param body: `bytes` when `encoding`, else `str`
+        :return: dict of found strings with list of their (byte) offsets
+        """
+        matches = {}
+        if self.empty:
+            matches[''] = [0]
+        if self.regex is None:
+            return matches
+
+        # Search again from next offset: find overlapping matches too
+        match = self.regex.search(body)
+        while match:
+            offset = match.start()
+            for pattern in self.prefixes[match.group()]:
+                matches.setdefault(self.patterns[pattern], []).append(offset)
+            match = self.regex.search(body, offset + 1)
+
+        return matches
+
+    @staticmethod
+    def get_encoding(response):
+        """
+        Encoding of response body when it can be scanned as bytes
+        (ASCII-compatible), else None. Also None when the response does
+        not specify it: the text is then decoded with the encoding
+        detected from the content, as `response.text` does.
+        """
+        encoding = response.encoding
+        if not encoding:
+            return None
+        try:
+            if 'a<'.encode(encoding) == b'a<':
+                return encoding
+        except LookupError:
+            pass
+        return None
+
+
+@lru_cache(maxsize=256)
+def get_matcher(strings, encoding):
+    """
+    Get StringsMatcher for tuple of strings, cached such that it is
+    compiled once for a CheckVars.
+    """
+    return StringsMatcher(strings, encoding)
+
+
 class ContainsStrings(Check):
     """
     Checks if HTTP response contains given strings (keywords).
@@ -194,19 +550,31 @@ class ContainsStrings(Check):
     def __init__(self):
         Check.__init__(self)
 
+    def find_strings(self):
+        """
+        Find all configured strings in response in a single scan.
+        :return: dict of found strings with list of their offsets
+        """
+        response = self.probe.response
+        matcher = get_matcher(tuple(self.get_param('strings')),
+                              StringsMatcher.get_encoding(response))
+        if matcher.encoding:
+            return matcher.find(response.content)
+        return matcher.find(self.probe.response_cache.text)
+
     def perform(self):
         result = True
         msg = 'OK'
-        for text in self.get_param('strings'):
-            try:
-                result = text in self.probe.response.text
-                if result is False:
+        try:
+            matches = self.find_strings()
+            for text in self.get_param('strings'):
+                if text not in matches:
+                    result = False
                     msg = '%s not in response text' % text
                     break
-            except Exception:
-                result = False
-                msg = str(sys.exc_info())
-                break
+        except Exception:
+            result = False
+            msg = str(sys.exc_info())
 
         self.set_result(result, msg)
 
@@ -241,19 +609,22 @@ class NotContainsStrings(ContainsStrings):
     def perform(self):
         result = True
         msg = 'OK'
-        for text in self.get_param('strings'):
-            try:
-                result = text not in self.probe.response.text
-                if result is False:
-                    if 'exception' in self.probe.response.text.lower():
-                        msg = self.probe.response.text
-                    else:
-                        msg = '%s in response text' % text
-                    break
-            except Exception:
+        try:
+            matches = self.find_strings()
+            if matches:
                 result = False
-                msg = str(sys.exc_info())
-                break
+                response_cache = self.probe.response_cache
+                if 'exception' in response_cache.text_lower:
+                    msg = response_cache.text
+                else:
+                    found = ['%s (offset %d, %d times)'
+                             % (text, matches[text][0], len(matches[text]))
+                             for text in self.get_param('strings')
+                             if text in matches]
+                    msg = '%s in response text' % ', '.join(found)
+        except Exception:
+            result = False
+            msg = str(sys.exc_info())
 
         self.set_result(result, msg)
 
@@ -272,3 +643,79 @@ class NotContainsOwsException(NotContainsStrings):
         }
     })
     """Param defs"""
+
+
+class ResponseTimeNotDegraded(Check):
+    """
+    Checks if the time of the Probe request checked is not degraded
+    compared to its recent history: fails when slower than a factor times
+    a percentile (e.g. p95) of recent response times. Percentiles are
+    estimated from a `QuantileSketch` maintained per Probe, so no Run
+    history is read.
+    """
+
+    NAME = 'Response time not degraded'
+    DESCRIPTION = \
+        'Response time not above factor times percentile of recent ' \
+        'response times'
+
+    PARAM_DEFS = {
+        'percentile': {
+            'type': 'string',
+            'description': 'Percentile of recent response times',
+            'default': '95',
+            'required': True,
+            'range': ['50', '90', '95', '99']
+        },
+        'factor': {
+            'type': 'string',
+            'description': 'Max factor of response time over percentile',
+            'default': '2.0',
+            'required': True,
+            'range': None
+        },
+        'min_samples': {
+            'type': 'string',
+            'description':
+                'Min number of recent response times before checking',
+            'default': '10',
+            'required': True,
+            'range': None
+        }
+    }
+    """Param defs"""
+
+    def __init__(self):
+        Check.__init__(self)
+
+    def get_param(self, param_name):
+        """
+        Parameter value, or its default when not set.
+        """
+        value = Check.get_param(self, param_name)
+        if value in [None, '']:
+            value = self.PARAM_DEFS[param_name]['default']
+        return value
+
+    def perform(self):
+        # Time of the request checked: Probes like WmsGetMapV1All run
+        # Checks per request, before their result is stopped
+        response_time = self.probe.response_time
+        if response_time is None:
+            self.set_result(True, 'OK, no response time')
+            return
+
+        sketch = self.probe.result.probe_vars.response_times
+        min_samples = int(self.get_param('min_samples'))
+        if sketch.samples < min_samples:
+            self.set_result(True, 'OK, %d of %d response times in history'
+                            % (sketch.samples, min_samples))
+            return
+
+        percentile = self.get_param('percentile')
+        factor = float(self.get_param('factor'))
+        percentile_secs = sketch.quantile(int(percentile) / 100.0)
+        if response_time > factor * percentile_secs:
+            self.set_result(False, 'Response time %.3f s > %s x p%s %.3f s'
+                            % (response_time, factor, percentile,
+                               percentile_secs))
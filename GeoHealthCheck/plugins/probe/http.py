@@ -17,7 +17,9 @@ class HttpGet(Probe):
         },
         'GeoHealthCheck.plugins.check.checks.ContainsStrings': {},
         'GeoHealthCheck.plugins.check.checks.NotContainsStrings': {},
-        'GeoHealthCheck.plugins.check.checks.HttpHasContentType': {}
+        'GeoHealthCheck.plugins.check.checks.HttpHasContentType': {},
+        'GeoHealthCheck.plugins.check.checks.JsonSchemaValid': {},
+        'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded': {}
     }
     """Checks avail"""
 
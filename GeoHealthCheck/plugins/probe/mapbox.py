@@ -1,6 +1,5 @@
 from GeoHealthCheck.probe import Probe
 import math
-from pyproj import CRS, Transformer
 
 
 class TileJSON(Probe):
@@ -62,6 +61,8 @@ class TileJSON(Probe):
             return
 
         # Convert bound coordinates to WebMercator
+        # Imported at first use as pyproj is slow to import
+        from pyproj import CRS, Transformer
         transformer = Transformer.from_crs(CRS('EPSG:4326'),
                                            CRS('EPSG:3857'),
                                            always_xy=False)
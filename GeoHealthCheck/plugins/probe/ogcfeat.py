@@ -1,6 +1,3 @@
-from owslib.ogcapi.features import Features
-from openapi_spec_validator import openapi_v3_spec_validator
-
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.result import Result, push_result
 
@@ -39,6 +36,7 @@ class OGCFeatCaps(Probe):
             },
             'default': True
         },
+        'GeoHealthCheck.plugins.check.checks.JsonSchemaValid': {},
     }
     """Validate OGC API Features (OAFeat) endpoint landing page"""
 
@@ -96,6 +94,8 @@ class OGCFeatDrilldown(Probe):
         See https://github.com/geopython/OWSLib/blob/
         master/tests/doctests/wfs3_GeoServerCapabilities.txt
         """
+        from owslib.ogcapi.features import Features
+
         oa_feat = None
         collections = None
 
@@ -285,6 +285,8 @@ class OGCFeatOpenAPIValidator(Probe):
         Uses https://github.com/p1c2u/openapi-spec-validator on
         the specfile (dict) returned from the OpenAPI endpoint.
         """
+        from owslib.ogcapi.features import Features
+        from openapi_spec_validator import openapi_v3_spec_validator
 
         # Step 1 basic sanity check
         result = Result(True, 'OpenAPI Sanity Check')
@@ -72,6 +72,7 @@ class StaGetEntities(Probe):
         },
         'GeoHealthCheck.plugins.check.checks.JsonParse': {
             'default': True
-        }
+        },
+        'GeoHealthCheck.plugins.check.checks.JsonSchemaValid': {}
     }
     """Check for STA Get entity Collection"""
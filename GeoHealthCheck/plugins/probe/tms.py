@@ -1,6 +1,5 @@
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.plugin import Plugin
-from owslib.tms import TileMapService
 
 
 class TmsCaps(Probe):
@@ -47,6 +46,9 @@ class TmsGetTile(Probe):
                   should match last string of layer."""
     RESOURCE_TYPE = 'OSGeo:TMS'
 
+    METADATA_VERSION = '1.0.0'
+    """Version of TileMapService summarised by get_metadata()"""
+
     REQUEST_METHOD = 'GET'
 
     # e.g. http://geodata.nationaalgeoregister.nl/tms/1.0.0/
@@ -95,23 +97,44 @@ class TmsGetTile(Probe):
     CHECKS_AVAIL = {
         'GeoHealthCheck.plugins.check.checks.HttpHasImageContentType': {
             'default': True
-        }
+        },
+        'GeoHealthCheck.plugins.check.checks.HttpHasImageSize': {},
+        'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded': {}
     }
     """Check for TMS GetTile"""
 
+    TILE_SIZE = 256
+    """
+    Tile width and height: the TMS default. The TileMap documents, which
+    may specify another size, are not requested.
+    """
+
     def __init__(self):
         Probe.__init__(self)
         self.layer_count = 0
 
+    def get_image_size(self):
+        """
+        Tile size, overridden from base class.
+        """
+        return self.TILE_SIZE, self.TILE_SIZE
+
     def get_metadata(self, resource, version='1.0.0'):
         """
-        Get metadata, specific per Resource type.
+        Get metadata, specific per Resource type: TileMapService
+        summary, with the tile format extension of each TileMap (Layer)
+        from its TileMap document in `formats`.
         :param resource:
         :param version:
         :return: Metadata object
         """
-        return TileMapService(resource.url, version=version,
-                              headers=self.get_request_headers())
+        tms = self.get_capabilities_summary(resource.url, 'TMS')
+        for layer in tms.contents.values():
+            tilemap = self.get_capabilities_summary(layer.name,
+                                                    'TMS:TileMap')
+            layer.formats = tilemap.formats
+
+        return tms
 
     # Overridden: expand param-ranges from WMS metadata
     def expand_params(self, resource):
@@ -130,8 +153,8 @@ class TmsGetTile(Probe):
             self.PARAM_DEFS['layer']['range'] = layer_list
 
             # Make a set of all extensions
-            extensions = set([layer.extension
-                              for layer_name, layer in layers.items()])
+            extensions = set([extension for layer in layers.values()
+                              for extension in layer.formats])
             self.PARAM_DEFS['extension']['range'] = list(extensions)
         except Exception as err:
             raise err
@@ -193,7 +216,8 @@ class TmsGetTileAll(TmsGetTile):
         for layer_name in self.layers.keys():
             # Layer name is last part of full URL
             self._parameters['layer'] = layer_name.split('1.0.0/')[-1]
-            self._parameters['extension'] = self.layers[layer_name].extension
+            self._parameters['extension'] = \
+                self.layers[layer_name].formats[0]
 
             # Let the templated parent perform
             Probe.perform_request(self)
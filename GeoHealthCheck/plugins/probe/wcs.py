@@ -1,5 +1,5 @@
 from GeoHealthCheck.probe import Probe
-from owslib.wcs import WebCoverageService
+from GeoHealthCheck.capabilities import capabilities_url
 
 
 class WcsGetCoverage(Probe):
@@ -14,6 +14,9 @@ class WcsGetCoverage(Probe):
     """
     RESOURCE_TYPE = 'OGC:WCS'
 
+    METADATA_VERSION = '2.0.1'
+    """Version of Capabilities summarised by get_metadata()"""
+
     REQUEST_METHOD = 'GET'
     REQUEST_TEMPLATE = '?SERVICE=WCS&VERSION=2.0.1' + \
                        '&REQUEST=GetCoverage&COVERAGEID={layers}' + \
@@ -94,7 +97,25 @@ class WcsGetCoverage(Probe):
         :param version:
         :return: Metadata object
         """
-        return WebCoverageService(resource.url, version=version)
+        wcs = self.get_capabilities_summary(
+            capabilities_url(resource.url, 'WCS', version), 'WCS')
+
+        # Bounding boxes only via DescribeCoverage: only needed
+        # for first Coverage
+        for coverage_id in wcs.contents:
+            description = self.get_capabilities_summary(
+                capabilities_url(resource.url, 'WCS', version,
+                                 request='DescribeCoverage',
+                                 coverageId=coverage_id),
+                'WCS:DescribeCoverage')
+            coverage = description.contents.get(coverage_id)
+            if coverage:
+                wcs.contents[coverage_id].bbox = coverage.bbox
+                wcs.contents[coverage_id].crs_options = \
+                    coverage.crs_options
+            break
+
+        return wcs
 
     # Overridden: expand param-ranges from WCS metadata
     def expand_params(self, resource):
@@ -115,16 +136,16 @@ class WcsGetCoverage(Probe):
                 break
 
             # Image Format
-            self.PARAM_DEFS['format']['range'] = layer_entry.supportedFormats
+            self.PARAM_DEFS['format']['range'] = layer_entry.formats
 
-            # SRS
-            bbox = layer_entry.boundingboxes
-            subsetting_crs = bbox[0]['nativeSrs']
+            # SRS: bbox list: 0-3 is bbox, 4 is SRS
+            bbox = layer_entry.bbox
+            subsetting_crs = bbox[4]
             self.PARAM_DEFS['subsetting_crs']['default'] = subsetting_crs
 
             # BBOX
-            self.log('bbox: %s' % str(bbox[0]['bbox']))
-            self.PARAM_DEFS['subset']['default'] = bbox[0]['bbox']
+            self.log('bbox: %s' % str(bbox[:4]))
+            self.PARAM_DEFS['subset']['default'] = bbox[:4]
 
         except Exception as err:
             raise err
@@ -1,7 +1,7 @@
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.plugin import Plugin
 from GeoHealthCheck.util import transform_bbox
-from owslib.wfs import WebFeatureService
+from GeoHealthCheck.capabilities import capabilities_url
 
 
 class WfsGetFeatureBbox(Probe):
@@ -15,6 +15,9 @@ class WfsGetFeatureBbox(Probe):
         """
     RESOURCE_TYPE = 'OGC:WFS'
 
+    METADATA_VERSION = '1.1.0'
+    """Version of Capabilities summarised by get_metadata()"""
+
     REQUEST_METHOD = 'POST'
     REQUEST_HEADERS = {
         'content-type': 'text/xml;charset=UTF-8'
@@ -102,6 +105,8 @@ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
         'GeoHealthCheck.plugins.check.checks.XmlParse': {
             'default': True
         },
+        'GeoHealthCheck.plugins.check.checks.XmlParseNoOwsException': {},
+        'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded': {},
         'GeoHealthCheck.plugins.check.checks.NotContainsOwsException': {
             'default': True
         },
@@ -135,9 +140,8 @@ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
         :param version:
         :return: Metadata object
         """
-        return WebFeatureService(resource.url,
-                                 version=version,
-                                 headers=self.get_request_headers())
+        return self.get_capabilities_summary(
+            capabilities_url(resource.url, 'WFS', version), 'WFS')
 
     # Overridden: expand param-ranges from WFS metadata
     def expand_params(self, resource):
@@ -160,13 +164,7 @@ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
             # In some cases default NS is used: no FT NSs
             nsmap = None
             if len(ft_namespaces) > 0:
-                try:
-                    # issue #243 this depends if lxml etree present
-                    # and used by OWSLib ! Otherwise fall-back.
-                    nsmap = wfs._capabilities.nsmap
-                except Exception:
-                    # Fall-back
-                    pass
+                nsmap = wfs.nsmap
 
             if not nsmap:
                 # Just build dummy NS map, to satisfy REQUEST_TEMPLATE
@@ -193,14 +191,15 @@ xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
             feature_type_entry = feature_types[feature_type_names[0]]
 
             # SRS
-            crs_list = feature_type_entry.crsOptions
-            srs_range = ['EPSG:%s' % crs.code for crs in crs_list]
+            from owslib.crs import Crs
+            crs_list = feature_type_entry.crs_options
+            srs_range = ['EPSG:%s' % Crs(crs).code for crs in crs_list]
             self.PARAM_DEFS['srs']['range'] = srs_range
             default_srs = srs_range[0]
             self.PARAM_DEFS['srs']['default'] = default_srs
 
             # bbox as list: 0-3 is bbox llx, lly, ulx, uly
-            bbox = feature_type_entry.boundingBoxWGS84
+            bbox = feature_type_entry.bbox_wgs84
 
             # It looks like the first SRS is the default
             # if it is not EPSG:4326 we need to transform bbox
@@ -1,6 +1,6 @@
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.plugin import Plugin
-from owslib.wms import WebMapService
+from GeoHealthCheck.capabilities import capabilities_url
 
 
 class WmsGetMapV1(Probe):
@@ -16,6 +16,9 @@ class WmsGetMapV1(Probe):
     """
     RESOURCE_TYPE = 'OGC:WMS'
 
+    METADATA_VERSION = '1.1.1'
+    """Version of Capabilities summarised by get_metadata()"""
+
     REQUEST_METHOD = 'GET'
     REQUEST_TEMPLATE = '?SERVICE=WMS&VERSION=1.1.1&' + \
                        'REQUEST=GetMap&LAYERS={layers}&SRS={srs}&' + \
@@ -90,7 +93,9 @@ class WmsGetMapV1(Probe):
         },
         'GeoHealthCheck.plugins.check.checks.HttpHasImageContentType': {
             'default': True
-        }
+        },
+        'GeoHealthCheck.plugins.check.checks.HttpHasImageSize': {},
+        'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded': {}
     }
     """
     Checks for WMS GetMap Response available.
@@ -109,8 +114,8 @@ class WmsGetMapV1(Probe):
         :param version:
         :return: Metadata object
         """
-        return WebMapService(resource.url, version=version,
-                             headers=self.get_request_headers())
+        return self.get_capabilities_summary(
+            capabilities_url(resource.url, 'WMS', version), 'WMS')
 
     # Overridden: expand param-ranges from WMS metadata
     def expand_params(self, resource):
@@ -126,11 +131,7 @@ class WmsGetMapV1(Probe):
             self.PARAM_DEFS['layers']['range'] = list(layers.keys())
 
             # Image Format
-            for oper in wms.operations:
-                if oper.name == 'GetMap':
-                    self.PARAM_DEFS['format']['range'] = \
-                        oper.formatOptions
-                    break
+            self.PARAM_DEFS['format']['range'] = wms.formats
 
             # Take random layer to determine generic attrs
             for layer_name in layers:
@@ -138,11 +139,11 @@ class WmsGetMapV1(Probe):
                 break
 
             # SRS
-            srs_range = layer_entry.crsOptions
+            srs_range = layer_entry.crs_options
             self.PARAM_DEFS['srs']['range'] = srs_range
 
             # bbox list: 0-3 is bbox, 4 is SRS
-            bbox = layer_entry.boundingBox
+            bbox = layer_entry.bbox
             bbox_srs = bbox[4]
             self.PARAM_DEFS['srs']['default'] = bbox_srs
             # if it is not EPSG:4326 we need to transform bbox
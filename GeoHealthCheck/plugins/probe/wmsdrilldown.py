@@ -2,7 +2,6 @@ import random
 
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.result import Result
-from owslib.wms import WebMapService
 
 
 class WmsDrilldown(Probe):
@@ -40,6 +39,8 @@ class WmsDrilldown(Probe):
         See https://github.com/geopython/OWSLib/blob/
         master/tests/doctests/wms_GeoServerCapabilities.txt
         """
+        from owslib.wms import WebMapService
+
         wms = None
 
         # 1. Test capabilities doc, parses
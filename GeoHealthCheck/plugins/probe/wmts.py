@@ -1,8 +1,6 @@
 from GeoHealthCheck.probe import Probe
 from GeoHealthCheck.plugin import Plugin
-from owslib.wmts import WebMapTileService
-from pyproj import CRS, Transformer
-from pyproj.crs import coordinate_system
+from GeoHealthCheck.capabilities import capabilities_url
 import math
 import requests
 from random import choice, shuffle
@@ -21,6 +19,9 @@ class WmtsGetTile(Probe):
 
     RESOURCE_TYPE = 'OGC:WMTS'
 
+    METADATA_VERSION = '1.0.0'
+    """Version of Capabilities summarised by get_metadata()"""
+
     REQUEST_METHOD = 'GET'
     REQUEST_TEMPLATE = {
         'KVP':
@@ -97,7 +98,9 @@ class WmtsGetTile(Probe):
         },
         'GeoHealthCheck.plugins.check.checks.HttpHasImageContentType': {
             'default': True
-        }
+        },
+        'GeoHealthCheck.plugins.check.checks.HttpHasImageSize': {},
+        'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded': {}
     }
     """
     Checks for WMTS GetTile Response available.
@@ -108,6 +111,13 @@ class WmtsGetTile(Probe):
     def __init__(self):
         Probe.__init__(self)
         self.layer_count = 0
+        self.tile_size = (None, None)
+
+    def get_image_size(self):
+        """
+        Tile size of TileMatrix requested, overridden from base class.
+        """
+        return self.tile_size
 
     def get_metadata(self, resource, version='1.0.0'):
         """
@@ -116,26 +126,29 @@ class WmtsGetTile(Probe):
         :param version:
         :return: Metadata object
         """
-        url = Plugin.copy(resource.url)
+        encodings = self.test_kvp_rest(resource.url)
 
-        # If endpoint can only be accessed through REST, owslib cannot
-        # get metadata, as GetCapabilities request is done through KVP.
+        # If endpoint can only be accessed through REST,
+        # GetCapabilities request through KVP fails.
         # Added '/1.0.0/WMTSCapabilities.xml' to omit this problem.
-        if not self.check_capabilities(url +
-                                       '?service=WMTS&version=1.0.0' +
-                                       '&request=GetCapabilities'):
-            url = url + '/1.0.0/WMTSCapabilities.xml'
-
-        return WebMapTileService(url, version=version,
-                                 headers=self.get_request_headers())
+        if 'KVP' in encodings:
+            url = capabilities_url(resource.url, 'WMTS', version)
+        elif resource.url.endswith('WMTSCapabilities.xml'):
+            url = resource.url
+        else:
+            url = resource.url + '/1.0.0/WMTSCapabilities.xml'
+
+        wmts = self.get_capabilities_summary(url, 'WMTS')
+        # Kept with the summary: Probe edit forms need not test again
+        wmts.encodings = encodings
+        return wmts
 
     def expand_params(self, resource):
         # Use WMTS Capabilities doc to get metadata for
         # PARAM_DEFS ranges/defaults
         try:
-            self.PARAM_DEFS['kvprest']['range'] = self.test_kvp_rest()
-
             wmts = self.get_metadata_cached(resource, version='1.0.0')
+            self.PARAM_DEFS['kvprest']['range'] = wmts.encodings
 
             layers = wmts.contents
             self.PARAM_DEFS['layers']['range'] = list(layers.keys())
@@ -144,7 +157,7 @@ class WmtsGetTile(Probe):
                 layer_object = layers[layer]
                 break
 
-            bbox84 = layer_object.boundingBoxWGS84
+            bbox84 = layer_object.bbox_wgs84
             center_coord_84 = [(bbox84[0] + bbox84[2]) / 2,
                                (bbox84[1] + bbox84[3]) / 2]
 
@@ -154,14 +167,16 @@ class WmtsGetTile(Probe):
         except Exception as err:
             raise err
 
-    def test_kvp_rest(self):
+    def test_kvp_rest(self, url=None):
         """
         Make requests on some variations of the url to test
         if KVP and/or REST is possible.
+        :param url: endpoint URL, default of the Resource
+        :return: list of 'KVP' and/or 'REST'
         """
 
         encodings = []
-        url = self._resource.url
+        url = url or self._resource.url
 
         # If url ends with wmtscapabilities.xml it is REST only
         if url.endswith('WMTSCapabilities.xml'):
@@ -184,11 +199,15 @@ class WmtsGetTile(Probe):
         """ Check for exception in GetCapabilities response"""
 
         try:
-            response = Probe.perform_get_request(self, url)
+            # Streamed: not a response time of the Probe
+            response = Probe.perform_get_request(self, url, stream=True)
+            try:
+                return (response.status_code == 200 and
+                        '<ServiceException' not in response.text)
+            finally:
+                response.close()
         except Exception:
             return False
-        return (response.status_code == 200 and
-                '<ServiceException' not in response.text)
 
     def before_request(self):
         """ Before request to service, overridden from base class"""
@@ -209,6 +228,9 @@ class WmtsGetTile(Probe):
     def perform_request(self):
         """ Perform actual request to service, overridden from base class"""
 
+        # Imported at first use as pyproj is slow to import
+        from pyproj import CRS, Transformer
+
         if not self.layers:
             self.result.set(False, 'Found no WMTS Layers')
             return
@@ -217,7 +239,7 @@ class WmtsGetTile(Probe):
 
         results_failed_total = []
 
-        self.parameters_copy = Plugin.copy(self._parameters)
+        self.parameters_copy = dict(self._parameters)
 
         for layer in self.layers:
             self.parameters_copy['layers'] = [layer]
@@ -229,7 +251,7 @@ class WmtsGetTile(Probe):
                 self.parameters_copy['format'] = format
 
             elif self._parameters['kvprest'] == 'REST':
-                format_list = Plugin.copy(layer_object.formats)
+                format_list = list(layer_object.formats)
                 shuffle(format_list)
 
                 format_success = False
@@ -249,9 +271,9 @@ class WmtsGetTile(Probe):
                     self.result.set(False, msg)
                     return
 
-            tilematrixsets = layer_object.tilematrixsetlinks
+            tilematrixsets = layer_object.tilematrixsets
             if self._parameters['tilematrixset'] == 'sample':
-                tilematrixsets = [choice(list(tilematrixsets.keys()))]
+                tilematrixsets = [choice(tilematrixsets)]
 
             for set in tilematrixsets:
                 self.parameters_copy['tilematrixset'] = set
@@ -276,9 +298,11 @@ class WmtsGetTile(Probe):
                 for zoom in tilematrices:
                     self.parameters_copy['tilematrix'] = zoom
 
+                    tilematrix = tilematrixset_object.tilematrix[zoom]
+                    self.tile_size = (tilematrix.tilewidth,
+                                      tilematrix.tileheight)
                     tilecol, tilerow = self.calculate_center_tile(
-                        center_coord,
-                        tilematrixset_object.tilematrix[zoom], set_crs)
+                        center_coord, tilematrix, set_crs)
                     self.parameters_copy['longitude_4326'] = tilecol
                     self.parameters_copy['latitude_4326'] = tilerow
 
@@ -324,7 +348,7 @@ class WmtsGetTile(Probe):
                 self.REQUEST_TEMPLATE = '&' + self.REQUEST_TEMPLATE[1:]
 
             if self._parameters:
-                request_parms = Plugin.copy(self.parameters_copy)
+                request_parms = dict(self.parameters_copy)
                 param_defs = self.get_param_defs()
 
                 # Expand string list array to comma separated string
@@ -367,6 +391,8 @@ class WmtsGetTile(Probe):
         Determine center tile row and column indexes based on
         topleft coordinate, scale, center coordinate and tilewidth/height
         """
+        from pyproj.crs import coordinate_system
+
         scale = tilematrix.scaledenominator
         topleftcorner = list(tilematrix.topleftcorner)
         center_coord = list(center_coord)
@@ -425,8 +451,6 @@ class WmtsGetTileAll(WmtsGetTile):
         # Use WMTS Capabilities doc to get metadata for
         # PARAM_DEFS ranges/defaults
         try:
-            self.PARAM_DEFS['kvprest']['range'] = self.test_kvp_rest()
-
             self.PARAM_DEFS['layers'] = {
                 'type': 'stringlist',
                 'description': 'All WMTS layers',
@@ -434,6 +458,7 @@ class WmtsGetTileAll(WmtsGetTile):
             }
 
             wmts = self.get_metadata_cached(resource, version='1.0.0')
+            self.PARAM_DEFS['kvprest']['range'] = wmts.encodings
 
             layers = wmts.contents
             self.PARAM_DEFS['layers']['range'] = list(layers.keys())
@@ -442,7 +467,7 @@ class WmtsGetTileAll(WmtsGetTile):
                 layer_object = layers[layer]
                 break
 
-            bbox84 = layer_object.boundingBoxWGS84
+            bbox84 = layer_object.bbox_wgs84
             center_coord_84 = [(bbox84[0] + bbox84[2]) / 2,
                                (bbox84[1] + bbox84[3]) / 2]
 
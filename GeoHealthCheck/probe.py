@@ -1,9 +1,14 @@
+import json
 import logging
 import sys
+import threading
+import time
 
 from datetime import datetime, timezone
+from lxml import etree
 import requests
 
+from capabilities import CapabilitiesSummary, summarise
 from factory import Factory
 from init import App
 from plugin import Plugin
@@ -14,6 +19,110 @@ from GeoHealthCheck import __version__
 LOGGER = logging.getLogger(__name__)
 
 
+class DetachedResource(object):
+    """
+    Plain snapshot of the Resource attributes a Probe needs to fetch
+    metadata, safe to use outside the thread/DB session of the Resource.
+    """
+
+    def __init__(self, resource):
+        self.identifier = resource.identifier
+        self.url = resource.url
+        self.resource_type = resource.resource_type
+        self.auth_headers = resource.add_auth_header({})
+
+    def add_auth_header(self, headers_dict):
+        headers_dict.update(self.auth_headers)
+        return headers_dict
+
+
+class ResponseCache(object):
+    """
+    Artefacts derived from a single Probe response: decoded and lowercased
+    text, parsed JSON and XML tree. Each is created at first use and then
+    shared by all Checks on that response. Errors are cached as well and
+    raised again on each use.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.artefacts = {}
+
+    def get(self, name, create):
+        if name not in self.artefacts:
+            try:
+                self.artefacts[name] = (create(), None)
+            except Exception as err:
+                self.artefacts[name] = (None, err)
+
+        artefact, err = self.artefacts[name]
+        if err is not None:
+            raise err
+        return artefact
+
+    @property
+    def text(self):
+        return self.get('text', lambda: self.response.text)
+
+    @property
+    def text_lower(self):
+        return self.get('text_lower', lambda: self.text.lower())
+
+    @property
+    def json(self):
+        return self.get('json', lambda: json.loads(self.response.content))
+
+    @property
+    def xml(self):
+        return self.get('xml', lambda: etree.fromstring(
+            self.response.content, parser=etree.XMLParser(
+                resolve_entities=False, no_network=True,
+                huge_tree=App.get_config()['GHC_LARGE_XML'])))
+
+
+class ProbePipeline(object):
+    """
+    Compiled setup to run a Probe for a ProbeVars: the resolved Probe
+    and Check classes with their decoded parameters. Built once and reused
+    for each run until the ProbeVars or its CheckVars change, see
+    `Probe.get_pipeline()`. Holds no DB objects, as these do not outlive
+    their DB session.
+    """
+
+    __slots__ = ('signature', 'probe_class', 'parameters', 'checks')
+
+    def __init__(self, probe_vars, signature):
+        self.signature = signature
+        self.probe_class = Factory.create_class(probe_vars.probe_class)
+        self.parameters = probe_vars.parameters
+
+        # (Check class string, class or None, parameters) in order of
+        # probe_vars.check_vars
+        self.checks = []
+        for check_vars in probe_vars.check_vars:
+            check_class = None
+            try:
+                check_class = Factory.create_class(check_vars.check_class)
+            except Exception:
+                LOGGER.error("Cannot create Check class: %s %s"
+                             % (check_vars.check_class, str(sys.exc_info())))
+
+            self.checks.append((check_vars.check_class, check_class,
+                                check_vars.parameters))
+
+    @staticmethod
+    def get_signature(probe_vars):
+        """
+        Signature of ProbeVars: changes when its class or parameters,
+        or those of its CheckVars, change. Compares raw (JSON) parameters
+        so these need not be decoded.
+        """
+        return (probe_vars.probe_class, probe_vars._parameters,
+                tuple((check_vars.identifier, check_vars.check_class,
+                       check_vars._parameters)
+                      for check_vars in probe_vars.check_vars))
+
+
 class Probe(Plugin):
     """
      Base class for specific implementations to run a Probe with Checks.
@@ -81,6 +190,13 @@ class Probe(Plugin):
     should be added to Probe on creation.
     """
 
+    METADATA_VERSION = None
+    """
+    Version argument of `get_metadata()` when it returns a Capabilities
+    summary: the runner then keeps one stored for the Resources of this
+    Probe, for Probe edit forms. None if no summary.
+    """
+
     METADATA_CACHE = {}
     """
     Cache for metadata, like capabilities documents or OWSLib Service
@@ -88,10 +204,69 @@ class Probe(Plugin):
     endpoints with 50+ Layers.
     """
 
+    METADATA_CACHE_LOCK = threading.Lock()
+    """
+    Guards `METADATA_CACHE` bookkeeping: the per-key fetch locks and
+    the set of keys being refreshed in the background.
+    """
+
+    METADATA_FETCH_LOCKS = {}
+    """
+    Per cache key lock, such that only a single fetch ("single-flight")
+    of the same metadata runs at a time, other callers wait for its result.
+    """
+
+    METADATA_REFRESHING = set()
+    """
+    Cache keys for which a background refresh is running.
+    """
+
+    PIPELINE_CACHE = {}
+    """
+    ProbePipeline objects by ProbeVars identifier.
+    """
+
     def __init__(self):
         Plugin.__init__(self)
         self._resource = None
+        self._pipeline = None
         self._session = create_requests_retry_session()
+        self.response = None
+
+        # Secs taken by each request, see `perform_get_request()`
+        self.response_times = []
+
+        # Use Capabilities summary stored by runner for the Resource
+        # in `get_metadata_cached()`, e.g. for Probe edit forms.
+        self.use_stored_metadata = False
+
+    @property
+    def response(self):
+        return self._response
+
+    @response.setter
+    def response(self, response):
+        self._response = response
+        self._response_cache = None
+
+    @property
+    def response_time(self):
+        """
+        Secs taken by the last request, i.e. the request being checked
+        by Checks, None if no request completed.
+        """
+        if not self.response_times:
+            return None
+        return self.response_times[-1]
+
+    @property
+    def response_cache(self):
+        """
+        ResponseCache for current response, see `ResponseCache`.
+        """
+        if self._response_cache is None:
+            self._response_cache = ResponseCache(self._response)
+        return self._response_cache
 
     #
     # Lifecycle : optionally expand params from Resource metadata
@@ -99,6 +274,8 @@ class Probe(Plugin):
         """
         Called after creation. Use to expand PARAM_DEFS, e.g. from Resource
         metadata like WMS Capabilities. See e.g. WmsGetMapV1 class.
+        Callers first call `own_param_defs()` such that the class-level
+        PARAM_DEFS are not modified.
         :param resource:
         :return: None
         """
@@ -116,40 +293,139 @@ class Probe(Plugin):
     def get_metadata_cached(self, resource, version='any'):
         """
         Get metadata, specific per Resource type, get from cache
-        if cached.
+        if cached. If `use_stored_metadata` is set, metadata as stored
+        by the runner in the DB is used and stored when not yet present.
         :param resource:
         :param version:
         :return: Metadata object
         """
+        if not self.use_stored_metadata:
+            return self.get_metadata_shared(resource, version)
+
+        metadata = resource.get_capabilities_summary(version)
+        if metadata:
+            return metadata
 
-        key = '%s_%s_%s' % (resource.url, resource.resource_type,
-                            version)
-
-        metadata = None
-        if key in Probe.METADATA_CACHE:
-            entry = Probe.METADATA_CACHE[key]
-            delta = datetime.now(timezone.utc) - entry['time']
-            metadata = entry['metadata']
-
-            # Don't keep cache forever, refresh every N mins
-            if delta.seconds > App.get_config()['GHC_METADATA_CACHE_SECS']:
-                entry = Probe.METADATA_CACHE.pop(key)
-                del entry
-                metadata = None
-
-        if not metadata:
-            # Get actual metadata, Resource-type specifc
-            metadata = self.get_metadata(resource, version)
-            if metadata and App.get_config()['GHC_METADATA_CACHE_SECS'] > 0:
-                # Store entry with time, for expiry later
-                entry = {
-                    "metadata": metadata,
-                    "time": datetime.now(timezone.utc)
-                }
-                Probe.METADATA_CACHE[key] = entry
+        metadata = self.get_metadata_shared(resource, version)
+        if isinstance(metadata, CapabilitiesSummary):
+            resource.set_capabilities_summary(
+                '%s.%s' % (self.__module__, self.get_class_name()),
+                version, metadata)
 
         return metadata
 
+    def get_metadata_shared(self, resource, version='any'):
+        """
+        Get metadata, specific per Resource type, from in-memory cache
+        shared by all Probes. Concurrent callers for the same metadata
+        share a single fetch. An expired entry is still served for at most
+        `GHC_METADATA_CACHE_STALE_SECS` while it is refreshed in the
+        background.
+        :param resource:
+        :param version:
+        :return: Metadata object
+        """
+
+        config = App.get_config()
+        cache_secs = config['GHC_METADATA_CACHE_SECS']
+        if cache_secs <= 0:
+            # Caching disabled
+            return self.get_metadata(resource, version)
+
+        stale_secs = config['GHC_METADATA_CACHE_STALE_SECS']
+        key = Probe.get_metadata_cache_key(resource, version)
+
+        entry = Probe.METADATA_CACHE.get(key)
+        if entry:
+            age = Probe.get_metadata_age(entry)
+            if age <= cache_secs:
+                return entry['metadata']
+
+            if age <= cache_secs + stale_secs:
+                # Expired, but serve while refreshing in the background
+                self.refresh_metadata(key, resource, version)
+                return entry['metadata']
+
+        # Nothing (usable) cached: single-flight fetch, others wait
+        with Probe.get_metadata_fetch_lock(key):
+            # May have been fetched while we were waiting
+            entry = Probe.METADATA_CACHE.get(key)
+            if entry and Probe.get_metadata_age(entry) <= cache_secs:
+                return entry['metadata']
+
+            return self.fetch_metadata(key, resource, version)
+
+    def fetch_metadata(self, key, resource, version):
+        """
+        Get actual metadata, Resource-type specific, and store in cache.
+        Callers should hold the fetch lock for `key`.
+        :param key: cache key
+        :param resource:
+        :param version:
+        :return: Metadata object
+        """
+        metadata = self.get_metadata(resource, version)
+        if metadata:
+            # Store entry with time, for expiry later
+            Probe.METADATA_CACHE[key] = {
+                'metadata': metadata,
+                'time': datetime.now(timezone.utc)
+            }
+
+        return metadata
+
+    def refresh_metadata(self, key, resource, version):
+        """
+        Refresh expired metadata in a background thread, at most one
+        refresh per cache key at a time. The refresh runs in a fresh Probe
+        instance against a detached copy of the Resource, as neither
+        the HTTP session nor the DB session can be shared among threads.
+        :param key: cache key
+        :param resource:
+        :param version:
+        :return: None
+        """
+        with Probe.METADATA_CACHE_LOCK:
+            if key in Probe.METADATA_REFRESHING:
+                return
+            Probe.METADATA_REFRESHING.add(key)
+
+        probe = self.__class__()
+        if self._resource:
+            probe._resource = DetachedResource(self._resource)
+        resource = DetachedResource(resource)
+
+        def refresh():
+            try:
+                with Probe.get_metadata_fetch_lock(key):
+                    probe.fetch_metadata(key, resource, version)
+            except Exception as err:
+                LOGGER.warning('Cannot refresh metadata for %s err=%s'
+                               % (key, str(err)))
+            finally:
+                with Probe.METADATA_CACHE_LOCK:
+                    Probe.METADATA_REFRESHING.discard(key)
+
+        threading.Thread(target=refresh, name='metadata-refresh',
+                         daemon=True).start()
+
+    @staticmethod
+    def get_metadata_cache_key(resource, version):
+        return '%s_%s_%s' % (resource.url, resource.resource_type, version)
+
+    @staticmethod
+    def get_metadata_age(entry):
+        """
+        Age of cache entry in seconds.
+        """
+        return (datetime.now(timezone.utc) - entry['time']).total_seconds()
+
+    @staticmethod
+    def get_metadata_fetch_lock(key):
+        with Probe.METADATA_CACHE_LOCK:
+            return Probe.METADATA_FETCH_LOCKS.setdefault(
+                key, threading.Lock())
+
     # Lifecycle
     def init(self, resource, probe_vars):
         """
@@ -163,10 +439,15 @@ class Probe(Plugin):
         self._resource = resource
 
         self._probe_vars = probe_vars
-        self._parameters = probe_vars.parameters
+        if not self._pipeline:
+            self._pipeline = Probe.get_pipeline(probe_vars)
+
+        # Copy: some Probes set parameters per request
+        self._parameters = dict(self._pipeline.parameters)
         self._check_vars = probe_vars.check_vars
 
         self.response = None
+        self.response_times = []
 
         # Create ProbeResult object that gathers all results for single Probe
         self.result = ProbeResult(self, self._probe_vars)
@@ -191,18 +472,21 @@ class Probe(Plugin):
         for check_class in checks_avail:
             check_avail = checks_avail[check_class]
             check = Factory.create_obj(check_class)
-            check_vars = Plugin.copy(check.get_plugin_vars())
+            check_vars = check.get_plugin_vars()
 
             # Check if Probe class overrides Check Params
-            # mainly "value" entries.
+            # mainly "value" entries. Copy-on-write: only the
+            # overridden Params are copied.
             if 'set_params' in check_avail:
                 set_params = check_avail['set_params']
+                param_defs = dict(check_vars['PARAM_DEFS'])
                 for set_param in set_params:
-                    if set_param in check_vars['PARAM_DEFS']:
-                        param_orig = check_vars['PARAM_DEFS'][set_param]
+                    if set_param in param_defs:
+                        param_orig = param_defs[set_param]
                         param_override = set_params[set_param]
                         param_def = Plugin.merge(param_orig, param_override)
-                        check_vars['PARAM_DEFS'][set_param] = param_def
+                        param_defs[set_param] = param_def
+                check_vars['PARAM_DEFS'] = param_defs
 
             checks_avail[check_class] = check_vars
         return checks_avail
@@ -220,13 +504,14 @@ class Probe(Plugin):
         return checks_avail_default
 
     def get_checks_info(self):
-        return Plugin.copy(Plugin.get_plugin_vars(self))['CHECKS_AVAIL']
+        # Shallow copy: callers replace entries, never modify them
+        return dict(self.CHECKS_AVAIL)
 
     def get_plugin_vars(self):
-        probe_vars = Plugin.copy(Plugin.get_plugin_vars(self))
+        probe_vars = Plugin.get_plugin_vars(self)
 
         probe_vars['CHECKS_AVAIL'] = \
-            self.expand_check_vars(probe_vars['CHECKS_AVAIL'])
+            self.expand_check_vars(self.get_checks_info())
         return probe_vars
 
     def log(self, text):
@@ -240,14 +525,24 @@ class Probe(Plugin):
         """ After running actual request to service"""
         pass
 
+    def get_image_size(self):
+        """
+        Width and height of image requested, e.g. for GetMap or GetTile
+        Checks. By default the 'width' and 'height' parameters.
+        :return: tuple of width and height, None when unknown
+        """
+        sizes = []
+        for name in ['width', 'height']:
+            value = self.get_param(name)
+            sizes.append(int(value) if value else None)
+        return tuple(sizes)
+
     def get_request_headers(self):
         if not self._resource:
             return Probe.STANDARD_REQUEST_HEADERS
 
-        headers = Plugin.copy(self.REQUEST_HEADERS)
-
         # Add standard headers like User-Agent
-        headers.update(Probe.STANDARD_REQUEST_HEADERS)
+        headers = dict(self.REQUEST_HEADERS, **Probe.STANDARD_REQUEST_HEADERS)
 
         # May add optional Auth header(s)
         return self._resource.add_auth_header(headers)
@@ -266,7 +561,8 @@ class Probe(Plugin):
                 self.REQUEST_TEMPLATE = '&' + self.REQUEST_TEMPLATE[1:]
 
             if self._parameters:
-                request_parms = Plugin.copy(self._parameters)
+                # Shallow copy: only top-level values are replaced
+                request_parms = dict(self._parameters)
                 param_defs = self.get_param_defs()
 
                 # Expand string list array to comma separated string
@@ -309,22 +605,50 @@ class Probe(Plugin):
             if self.response.status_code / 100 in [4, 5]:
                 self.log('Error response: %s' % (str(self.response.text)))
 
-    def perform_get_request(self, url):
-        """ Perform actual HTTP GET request to service"""
-        return self._session.get(
+    def perform_get_request(self, url, stream=False):
+        """
+        Perform actual HTTP GET request to service. Unless streamed
+        (e.g. for Capabilities) its time is added to `response_times`.
+        """
+        start_time = time.monotonic()
+        response = self._session.get(
             url,
             timeout=App.get_config()['GHC_PROBE_HTTP_TIMEOUT_SECS'],
             verify=App.get_config()['GHC_VERIFY_SSL'],
-            headers=self.get_request_headers())
+            headers=self.get_request_headers(),
+            stream=stream)
+        if not stream:
+            self.response_times.append(time.monotonic() - start_time)
+        return response
+
+    def get_capabilities_summary(self, url, doc_type):
+        """
+        Get OWS document like Capabilities and summarise it while
+        streaming the response, see capabilities.summarise().
+        :param url: full request URL
+        :param doc_type: document type, e.g. 'WMS'
+        :return: CapabilitiesSummary
+        """
+        response = self.perform_get_request(url, stream=True)
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return summarise(response.raw, doc_type,
+                             huge_tree=App.get_config()['GHC_LARGE_XML'])
+        finally:
+            response.close()
 
     def perform_post_request(self, url_base, request_string):
         """ Perform actual HTTP POST request to service"""
-        return self._session.post(
+        start_time = time.monotonic()
+        response = self._session.post(
             url_base,
             timeout=App.get_config()['GHC_PROBE_HTTP_TIMEOUT_SECS'],
             verify=App.get_config()['GHC_VERIFY_SSL'],
             data=request_string,
             headers=self.get_request_headers())
+        self.response_times.append(time.monotonic() - start_time)
+        return response
 
     def run_request(self):
         """ Run actual request to service"""
@@ -358,12 +682,11 @@ class Probe(Plugin):
         # Config also determines which actual checks are performed
         # from possible Checks in Probe. Checks are performed
         # by Check instances.
-        for check_var in self._check_vars:
+        checks = zip(self._check_vars, self._pipeline.checks)
+        for check_var, (check_class, check_class_obj, parameters) in checks:
             check = None
-            check_class = ''
             try:
-                check_class = check_var.check_class
-                check = Factory.create_obj(check_class)
+                check = check_class_obj()
             except Exception:
                 LOGGER.error("Cannot create Check class: %s %s"
                              % (check_class, str(sys.exc_info())))
@@ -372,7 +695,7 @@ class Probe(Plugin):
                 continue
 
             try:
-                check.init(self, check_var)
+                check.init(self, check_var, dict(parameters))
                 check.perform()
             except Exception:
                 msg = "Check Err: %s" % str(sys.exc_info())
@@ -399,8 +722,10 @@ class Probe(Plugin):
         """
         probe = None
         try:
-            # Create Probe instance from module.class string
-            probe = Factory.create_obj(probe_vars.probe_class)
+            # Create Probe instance from (cached) compiled pipeline
+            pipeline = Probe.get_pipeline(probe_vars)
+            probe = pipeline.probe_class()
+            probe._pipeline = pipeline
         except Exception:
             LOGGER.error("Cannot create Probe class: %s %s"
                          % (probe_vars.probe_class, str(sys.exc_info())))
@@ -413,6 +738,7 @@ class Probe(Plugin):
 
         # Perform request
         probe.run_request()
+        request_success = probe.result.success
 
         # Perform the Probe's checks
         probe.run_checks()
@@ -420,8 +746,33 @@ class Probe(Plugin):
         # Determine result
         probe.calc_result()
 
+        # Response time history for Checks: times of the requests
+        # checked, only when the Probe's requests completed
+        if request_success:
+            for secs in probe.response_times:
+                probe_vars.add_response_time(secs)
+
         # Lifecycle
         probe.exit()
 
         # Return result
         return probe.result
+
+    @staticmethod
+    def get_pipeline(probe_vars):
+        """
+        Get compiled ProbePipeline for ProbeVars, from cache if
+        still valid for its current signature.
+        :param probe_vars: ProbeVars object
+        :return: ProbePipeline
+        """
+        signature = ProbePipeline.get_signature(probe_vars)
+        pipeline = Probe.PIPELINE_CACHE.get(probe_vars.identifier)
+        if pipeline and pipeline.signature == signature:
+            return pipeline
+
+        pipeline = ProbePipeline(probe_vars, signature)
+        if probe_vars.identifier is not None:
+            Probe.PIPELINE_CACHE[probe_vars.identifier] = pipeline
+
+        return pipeline
@@ -45,6 +45,12 @@ class Result(object):
         self.response_time_secs = delta.seconds
         self.response_time_str = '%s.%s' % (delta.seconds, delta.microseconds)
 
+    def get_duration(self):
+        """
+        Time between start() and stop() in (fractional) secs.
+        """
+        return (self.end_time - self.start_time).total_seconds()
+
     def __str__(self):
         if self.message:
             self.message = self.message
@@ -121,11 +127,14 @@ class CheckResult(Result):
      Holds result data from a single Check.
     """
 
-    def __init__(self, check, check_vars, success=True, message="OK"):
+    def __init__(self, check, check_vars, success=True, message="OK",
+                 parameters=None):
         Result.__init__(self, success, message)
         self.check = check
         self.check_vars = check_vars
-        self.parameters = check_vars.parameters
+        if parameters is None:
+            parameters = check_vars.parameters
+        self.parameters = parameters
 
     def get_report(self):
         report = {
@@ -33,7 +33,7 @@ import os
 import random
 import string
 from datetime import datetime, timedelta
-from models import Resource, ResourceLock, flush_runs
+from models import Resource, ResourceLock, compact_reports, flush_runs
 from healthcheck import run_resource
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError
@@ -187,6 +187,8 @@ def start_schedule():
 
     # Start maintenance jobs
     scheduler.add_job(flush_runs, 'interval', minutes=150)
+    # Once at start: compact reports of Runs stored before
+    scheduler.add_job(compact_reports)
     scheduler.add_job(check_schedule, 'interval', minutes=5)
 
 
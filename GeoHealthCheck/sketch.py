@@ -0,0 +1,126 @@
+import json
+import math
+
+
+class QuantileSketch(object):
+    """
+    Streaming quantile sketch of (response time) values: counts values
+    in logarithmic buckets, such that any quantile is estimated within
+    `RELATIVE_ACCURACY` from a bounded number of buckets, without keeping
+    the values. Older values fade out: on each added value all counts
+    decay by `decay`, so quantiles follow roughly the last
+    1 / (1 - `decay`) values (a rolling window). With `decay` 1 all values
+    count, e.g. for the fixed periods of `RunRollup`: such sketches can be
+    merged.
+    """
+
+    RELATIVE_ACCURACY = 0.02
+    """
+    Max relative error of estimated quantiles.
+    """
+
+    DECAY = 0.99
+    """
+    Default weight of counts retained on each added value.
+    """
+
+    MIN_VALUE = 0.001
+    """
+    Smallest value distinguished, smaller values are counted as this.
+    """
+
+    MIN_WEIGHT = 0.001
+    """
+    Buckets with a lower (decayed) count are dropped.
+    """
+
+    FORMAT_VERSION = 1
+    """
+    Version of JSON format, see `to_json()`.
+    """
+
+    def __init__(self, buckets=None, samples=0, decay=None):
+        self.decay = self.DECAY if decay is None else decay
+        gamma = (1 + self.RELATIVE_ACCURACY) / (1 - self.RELATIVE_ACCURACY)
+        self.log_gamma = math.log(gamma)
+
+        # Bucket index i counts values in (gamma^(i-1), gamma^i]
+        self.buckets = buckets or {}
+        self.samples = samples
+
+    def add(self, value):
+        """
+        Add value and decay counts of earlier values.
+        """
+        if self.decay < 1:
+            for index in list(self.buckets):
+                weight = self.buckets[index] * self.decay
+                if weight < self.MIN_WEIGHT:
+                    del self.buckets[index]
+                else:
+                    self.buckets[index] = weight
+
+        index = int(math.ceil(
+            math.log(max(value, self.MIN_VALUE)) / self.log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0.0) + 1.0
+        self.samples += 1
+
+    def merge(self, other):
+        """
+        Add counts of other sketch, e.g. to get quantiles over periods.
+        """
+        for index, weight in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0.0) + weight
+        self.samples += other.samples
+
+    def quantile(self, q):
+        """
+        Estimate quantile, e.g. 0.95 for p95.
+        :param q: quantile in range [0, 1]
+        :return: estimated value or None when no values added
+        """
+        if not self.buckets:
+            return None
+
+        rank = q * sum(self.buckets.values())
+        count = 0.0
+        for index in sorted(self.buckets):
+            count += self.buckets[index]
+            if count >= rank:
+                break
+
+        # Value in middle of bucket: at most RELATIVE_ACCURACY off
+        return 2 * math.exp(index * self.log_gamma) / \
+            (1 + math.exp(self.log_gamma))
+
+    def to_json(self):
+        return json.dumps({
+            'format_version': self.FORMAT_VERSION,
+            'samples': self.samples,
+            'decay': self.decay,
+            'buckets': dict([(str(index), round(weight, 6))
+                             for index, weight in self.buckets.items()])
+        }, sort_keys=True)
+
+    @staticmethod
+    def from_json(text):
+        """
+        Create QuantileSketch from `to_json()` text. An empty sketch is
+        created if text is empty or of another format version.
+        """
+        if not text:
+            return QuantileSketch()
+
+        sketch_dict = json.loads(text)
+        if sketch_dict.get('format_version') != \
+                QuantileSketch.FORMAT_VERSION:
+            return QuantileSketch()
+
+        buckets = dict([(int(index), weight)
+                        for index, weight in sketch_dict['buckets'].items()])
+        return QuantileSketch(buckets, sketch_dict['samples'],
+                              sketch_dict.get('decay'))
+
+    def __repr__(self):
+        return '<QuantileSketch samples=%d p50=%s p95=%s>' % (
+            self.samples, self.quantile(0.5), self.quantile(0.95))
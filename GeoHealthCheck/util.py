@@ -32,6 +32,7 @@ import logging
 import os
 import smtplib
 import base64
+from datetime import datetime
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
@@ -66,6 +67,22 @@ def format_checked_datetime(run, default='-'):
     return run.checked_datetime.strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
+def parse_datetime(value):
+    """
+    parse UTC datetime as formatted by format_checked_datetime, or a date
+    :return: datetime without timezone, as Run.checked_datetime
+    :raises ValueError: when not a datetime or date
+    """
+    for datetime_format in ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S',
+                            '%Y-%m-%d']:
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            pass
+
+    raise ValueError('Invalid datetime: %s' % value)
+
+
 def format_run_status(run, default='-'):
     """common formatting success boolean field"""
     if not run:
@@ -28,9 +28,13 @@
 # =================================================================
 
 import logging
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 import models
 import util
-from sqlalchemy import text
+from sqlalchemy import and_, case, func, or_, text
+from sqlalchemy.orm import aliased, joinedload, undefer_group
 from plugin import Plugin
 from factory import Factory
 from init import App
@@ -39,12 +43,36 @@ APP = App.get_app()
 LOGGER = logging.getLogger(__name__)
 
 
-def list_resources(resource_type=None, query=None, tag=None):
-    """return all resources"""
+# Resource in a listing, with its Run statistics: a row, no ORM object
+ListedResource = namedtuple('ListedResource', [
+    'identifier', 'resource_type', 'title', 'url', 'latitude', 'longitude',
+    'owner_identifier', 'tags', 'run_count', 'reliability',
+    'min_response_time', 'average_response_time', 'max_response_time',
+    'first_run', 'last_run'
+])
 
-    reliability_values = []
-    first_run = None
-    last_run = None
+# Run of a ListedResource: only the columns known in the listing
+ListedRun = namedtuple('ListedRun', [
+    'identifier', 'checked_datetime', 'success'
+])
+
+RESOURCES_SORT = ['identifier', 'title', 'resource_type', 'url',
+                  'last_checked', 'reliability', 'average_response_time']
+
+# Runs fetched per round trip when streaming history exports
+HISTORY_BATCH_SIZE = 1000
+
+
+def list_resources(resource_type=None, query=None, tag=None, sort=None,
+                   order=None, page=None, per_page=None):
+    """
+    return resources with optional filter, sorted and paginated, with
+    their Run statistics from one query
+    :param sort: one of RESOURCES_SORT, default identifier
+    :param order: 'asc' (default) or 'desc'
+    :param page: page number, from 1, with per_page
+    :param per_page: max resources per page, default all
+    """
 
     response = {
         'total': 0,
@@ -58,7 +86,12 @@ def list_resources(resource_type=None, query=None, tag=None):
         },
         'first_run': None,
         'last_run': None,
-        'reliability': 0
+        'reliability': 0,
+        'sort': sort if sort in RESOURCES_SORT else 'identifier',
+        'order': 'desc' if order == 'desc' else 'asc',
+        'page': None,
+        'pages': None,
+        'per_page': None
     }
 
     filters = ()
@@ -74,32 +107,92 @@ def list_resources(resource_type=None, query=None, tag=None):
         tag_filter = (models.Resource.tags.any(models.Tag.name.in_([tag])),)
         filters = filters + tag_filter
 
-    response['resources'] = models.Resource.query.filter(*filters).all()
-
-    response['total'] = len(response['resources'])
-    response['success']['percentage'] = 0
-    response['fail']['percentage'] = 0
-    response['reliability'] = 0
-    for resource in response['resources']:
-        if resource.run_count > 0:
-            # View should work even without Runs
-            if first_run is None or resource.first_run < first_run:
-                first_run = resource.first_run
-            if last_run is None or resource.last_run < last_run:
-                last_run = resource.last_run
-            response['first_run'] = first_run
-            response['last_run'] = last_run
-            if resource.last_run.success:
-                response['success']['number'] += 1
-            else:
-                response['fail']['number'] += 1
-
-            reliability_values.append(resource.reliability)
-
+    Resource = models.Resource
+    stats = Resource.run_stats_query().subquery()
+    reliability = case(
+        [(stats.c.run_count > 0,
+          stats.c.success_count * 100.0 / stats.c.run_count)])
+
+    # Totals over all matching Resources
+    summary = models.DB.session.query(
+        func.count(Resource.identifier),
+        func.sum(case([(Resource.last_success.is_(True), 1)], else_=0)),
+        func.sum(case([(Resource.last_success.is_(False), 1)], else_=0)),
+        func.avg(reliability),
+        func.max(Resource.last_run_identifier)).outerjoin(
+        stats, stats.c.resource_identifier == Resource.identifier).filter(
+        *filters).one()
+    response['total'] = summary[0]
+    response['success']['number'] = int(summary[1] or 0)
+    response['fail']['number'] = int(summary[2] or 0)
     response['success']['percentage'] = int(round(util.percentage(
         response['success']['number'], response['total'])))
     response['fail']['percentage'] = 100 - response['success']['percentage']
-    response['reliability'] = round(util.average(reliability_values), 1)
+    response['reliability'] = round(float(summary[3] or 0), 1)
+    if summary[4] is not None:
+        # View should work even without Runs
+        response['first_run'] = models.Run.query.join(
+            models.Run.resource).filter(*filters).order_by(
+            models.Run.identifier).first()
+        response['last_run'] = models.Run.query.get(summary[4])
+
+    # Resources with statistics, one row each
+    sort_columns = {
+        'identifier': Resource.identifier,
+        'title': Resource.title,
+        'resource_type': Resource.resource_type,
+        'url': Resource.url,
+        'last_checked': Resource.last_checked,
+        'reliability': func.coalesce(reliability, 0),
+        'average_response_time': func.coalesce(
+            stats.c.average_response_time, 0)
+    }
+    sort_column = sort_columns[response['sort']]
+    if response['order'] == 'desc':
+        sort_column = sort_column.desc()
+    rows = models.DB.session.query(
+        Resource.identifier, Resource.resource_type, Resource.title,
+        Resource.url, Resource.latitude, Resource.longitude,
+        Resource.owner_identifier, Resource.last_run_identifier,
+        Resource.last_checked, Resource.last_success, stats).outerjoin(
+        stats, stats.c.resource_identifier == Resource.identifier).filter(
+        *filters).order_by(sort_column, Resource.identifier)
+    if per_page is not None and per_page > 0:
+        response['per_page'] = per_page
+        response['page'] = max(page or 1, 1)
+        response['pages'] = max(
+            int(math.ceil(response['total'] / float(per_page))), 1)
+        rows = rows.offset((response['page'] - 1) * per_page).limit(per_page)
+
+    # Tags of all matching Resources. Aliased, as not to correlate with
+    # the tag filter.
+    tags = {}
+    resource_tags = models.resource_tags.alias()
+    tag_alias = aliased(models.Tag)
+    for resource_identifier, tag_obj in models.DB.session.query(
+            resource_tags.c.resource_identifier, tag_alias).join(
+            tag_alias, tag_alias.id == resource_tags.c.tag_id).join(
+            Resource, Resource.identifier ==
+            resource_tags.c.resource_identifier).filter(*filters):
+        tags.setdefault(resource_identifier, []).append(tag_obj)
+
+    response['resources'] = []
+    for row in rows:
+        run_count = row.run_count or 0
+        first_run = last_run = None
+        if row.last_run_identifier is not None:
+            last_run = ListedRun(row.last_run_identifier, row.last_checked,
+                                 row.last_success)
+        if run_count > 0:
+            first_run = ListedRun(None, row.first_checked, None)
+        response['resources'].append(ListedResource(
+            row.identifier, row.resource_type, row.title, row.url,
+            row.latitude, row.longitude, row.owner_identifier,
+            tags.get(row.identifier, []), run_count,
+            util.percentage(int(row.success_count or 0), run_count),
+            row.min_response_time or 0,
+            float(row.average_response_time or 0),
+            row.max_response_time or 0, first_run, last_run))
 
     return response
 
@@ -116,10 +209,70 @@ def get_run_by_id(identifier):
         identifier=identifier).first_or_404()
 
 
-def get_run_by_resource_id(identifier):
-    """return one Run by identifier"""
-    return models.Run.query.filter_by(
-        resource_identifier=identifier)
+def get_run_by_resource_id(identifier, after_id=None, limit=None,
+                           from_datetime=None, to_datetime=None,
+                           with_report=True):
+    """
+    return page of Runs of Resource in time order, keyset paginated:
+    the next page starts after the last Run of this page
+    :param after_id: identifier of last Run of previous page
+    :param limit: max number of Runs, default and max from config
+    :param from_datetime: Runs checked at or after, optional
+    :param to_datetime: Runs checked before, optional
+    :param with_report: load reports of Runs
+    :return: tuple of list of Runs and identifier of last Run when
+             more Runs follow, else None
+    """
+
+    Run = models.Run
+    max_limit = int(APP.config['GHC_API_RUNS_MAX_LIMIT'])
+    if limit is None or limit < 1:
+        limit = int(APP.config['GHC_API_RUNS_LIMIT'])
+    limit = min(limit, max_limit)
+
+    runs = Run.query.filter(Run.resource_identifier == identifier)
+    if from_datetime is not None:
+        runs = runs.filter(Run.checked_datetime >= from_datetime)
+    if to_datetime is not None:
+        runs = runs.filter(Run.checked_datetime < to_datetime)
+    if after_id is not None:
+        # Keyset on (checked_datetime, identifier), as the index on
+        # (resource_identifier, checked_datetime): no OFFSET scans
+        after_datetime = models.DB.session.query(
+            Run.checked_datetime).filter(Run.identifier == after_id).scalar()
+        if after_datetime is None:
+            # Flushed meanwhile: all later Runs have higher identifiers
+            runs = runs.filter(Run.identifier > after_id)
+        else:
+            runs = runs.filter(or_(
+                Run.checked_datetime > after_datetime,
+                and_(Run.checked_datetime == after_datetime,
+                     Run.identifier > after_id)))
+    if with_report:
+        runs = runs.options(undefer_group('report'),
+                            joinedload(Run.run_report))
+
+    # One more to tell if a next page follows
+    runs = runs.order_by(Run.checked_datetime, Run.identifier).limit(
+        limit + 1).all()
+    if len(runs) > limit:
+        return runs[:limit], runs[limit - 1].identifier
+    return runs, None
+
+
+def get_run_history(identifier):
+    """
+    return Runs of Resource in time order as rows of checked_datetime,
+    response_time and success, fetched in batches from a server-side
+    cursor (where the DB supports it) such that memory use is constant
+    """
+
+    Run = models.Run
+    return models.DB.session.query(
+        Run.checked_datetime, Run.response_time, Run.success).filter(
+        Run.resource_identifier == identifier).order_by(
+        Run.checked_datetime).execution_options(
+        stream_results=True).yield_per(HISTORY_BATCH_SIZE)
 
 
 def get_resource_types_counts():
@@ -135,22 +288,21 @@ def get_resource_types_counts():
 def get_health_summary():
     """return summary of all runs"""
 
-    # For overall reliability
-    total_runs = models.get_runs_count()
-    failed_runs = models.get_runs_status_count(False)
-    success_runs = total_runs - failed_runs
+    # For overall reliability: from daily rollups, not all Runs
+    since = datetime.now(timezone.utc) - \
+        timedelta(days=int(APP.config['GHC_RETENTION_DAYS']))
+    total_runs, success_runs = models.get_rollup_runs_counts(since)
 
-    # Resources status derived from last N runs
-    total_resources = models.get_resources_count()
-    last_runs = models.get_last_run_per_resource()
-    failed = 0
-    failed_resources = []
-    for run in last_runs:
-        if not run.success:
-            failed_resources.append(
-                get_resource_by_id(run.resource_identifier))
-            failed += 1
+    # No rollups in the window, e.g. not built after upgrading: from Runs
+    from_rollups = total_runs > 0
+    if not from_rollups:
+        total_runs = models.get_runs_count()
+        success_runs = models.get_runs_status_count(True)
 
+    # Resources status from their current state, maintained per Run
+    total_resources = models.get_resources_count()
+    failed_resources = models.get_failing_resources(since, from_rollups)
+    failed = len(failed_resources)
     success = total_resources - failed
 
     failed_percentage = int(round(
@@ -230,6 +382,9 @@ def get_probes_avail(resource_type=None, resource=None):
             if resource:
                 try:
                     probe._resource = resource
+                    # Expand from Capabilities stored by the runner
+                    probe.use_stored_metadata = True
+                    probe.own_param_defs()
                     probe.expand_params(resource)
                 except Exception as err:
                     msg = 'Cannot expand plugin vars for %s err=%s' \
@@ -238,4 +393,8 @@ def get_probes_avail(resource_type=None, resource=None):
 
             result[probe_class] = probe.get_plugin_vars()
 
+    if resource:
+        # Capabilities summaries not yet stored
+        models.db_commit()
+
     return result
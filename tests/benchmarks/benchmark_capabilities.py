@@ -0,0 +1,101 @@
+# =================================================================
+#
+# Benchmark: Capabilities summariser vs full OWSLib Service object.
+#
+# Measures parsing time and memory retained (as cached) for a WMS
+# Capabilities document with many Layers.
+#
+# Usage: python3 benchmark_capabilities.py [layer_count] [repeat]
+#
+# =================================================================
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+from owslib.wms import WebMapService  # noqa: E402
+from capabilities import summarise  # noqa: E402
+
+LAYER = """
+  <Layer queryable="1">
+   <Name>layer_%(index)d</Name>
+   <Title>Layer %(index)d</Title>
+   <Abstract>Abstract of Layer %(index)d, just some text.</Abstract>
+   <KeywordList><Keyword>test</Keyword><Keyword>layer</Keyword></KeywordList>
+   <SRS>EPSG:4326</SRS><SRS>EPSG:3857</SRS><SRS>EPSG:28992</SRS>
+   <LatLonBoundingBox minx="3.2" miny="50.7" maxx="7.2" maxy="53.6"/>
+   <BoundingBox SRS="EPSG:28992" minx="0" miny="300000"
+                maxx="280000" maxy="625000"/>
+   <Style><Name>default</Name><Title>Default</Title>
+    <LegendURL width="20" height="20"><Format>image/png</Format>
+     <OnlineResource xmlns:xlink="http://www.w3.org/1999/xlink"
+      xlink:href="http://example.com/legend?layer=layer_%(index)d"/>
+    </LegendURL>
+   </Style>
+  </Layer>"""
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<WMT_MS_Capabilities version="1.1.1">
+ <Service><Name>OGC:WMS</Name><Title>Benchmark</Title></Service>
+ <Capability>
+  <Request>
+   <GetCapabilities><Format>application/vnd.ogc.wms_xml</Format>
+   </GetCapabilities>
+   <GetMap><Format>image/png</Format><Format>image/jpeg</Format></GetMap>
+  </Request>
+  <Exception><Format>application/vnd.ogc.se_xml</Format></Exception>
+  <Layer>
+   <Title>Root</Title>
+   <SRS>EPSG:4258</SRS>%s
+  </Layer>
+ </Capability>
+</WMT_MS_Capabilities>"""
+
+
+def create_capabilities(layer_count):
+    layers = ''.join([LAYER % {'index': index}
+                      for index in range(layer_count)])
+    return (CAPABILITIES % layers).encode('utf-8')
+
+
+def measure(name, parse, doc, repeat):
+    # Time
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parse(doc)
+    secs = (time.perf_counter() - start) / repeat
+
+    # Memory retained by result, i.e. what a cache entry would hold
+    gc.collect()
+    tracemalloc.start()
+    result = parse(doc)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print('%-12s parse=%8.1f ms  retained=%8.1f KB  peak=%8.1f KB'
+          % (name, secs * 1000, retained / 1024.0, peak / 1024.0))
+
+
+def main(layer_count=1000, repeat=5):
+    doc = create_capabilities(layer_count)
+    print('WMS Capabilities with %d Layers: %d KB'
+          % (layer_count, len(doc) // 1024))
+
+    measure('owslib', lambda d: WebMapService(
+        'http://example.com/wms', version='1.1.1', xml=d), doc, repeat)
+    measure('summarise', lambda d: summarise(
+        io.BytesIO(d), 'WMS'), doc, repeat)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
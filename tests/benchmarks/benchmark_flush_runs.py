@@ -0,0 +1,108 @@
+# =================================================================
+#
+# Benchmark: flushing Runs older than GHC_RETENTION_DAYS, per-row ORM
+# deletes in one transaction vs batched set-based DELETEs.
+#
+# Fills a synthetic run table in a temporary SQLite DB, with Runs spread
+# evenly over 2 * GHC_RETENTION_DAYS, so half of them are flushed.
+# "rows" is the former implementation: load all Runs, delete one by one,
+# single commit. As it does not scale, it runs on legacy_rows Runs only.
+# "batched" is the current models.flush_runs(), on rows Runs, without
+# pauses. The longest batch is the longest transaction (table lock).
+#
+# Usage: python3 benchmark_flush_runs.py [rows] [batch_size] [legacy_rows]
+#
+# =================================================================
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+# Own DB: configure before the app is created on first import
+TMP_DIR = tempfile.mkdtemp()
+SETTINGS_FILE = os.path.join(TMP_DIR, 'settings.py')
+with open(SETTINGS_FILE, 'w') as settings:
+    settings.write("SQLALCHEMY_DATABASE_URI = 'sqlite:///%s'\n"
+                   % os.path.join(TMP_DIR, 'runs.db'))
+os.environ['GHC_SETTINGS'] = SETTINGS_FILE
+
+from init import App  # noqa: E402
+from models import DB, Run, db_commit, flush_runs  # noqa: E402
+
+INSERT_CHUNK = 100000
+REPORT = '{"success": true, "message": "OK", "probes": []}'
+
+
+def fill_runs(rows):
+    DB.drop_all()
+    DB.create_all()
+    days = 2 * int(App.get_config()['GHC_RETENTION_DAYS'])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    step = timedelta(days=days) / rows
+    start = time.perf_counter()
+    with DB.engine.begin() as connection:
+        for offset in range(0, rows, INSERT_CHUNK):
+            connection.execute(Run.__table__.insert(), [{
+                'resource_identifier': index % 100 + 1,
+                'checked_datetime': now - (rows - index) * step,
+                'success': index % 10 != 0,
+                'response_time': 0.5,
+                'message': 'OK',
+                'report': REPORT
+            } for index in range(offset, min(offset + INSERT_CHUNK, rows))])
+    print('filled %d Runs in %.1f s' % (rows, time.perf_counter() - start))
+
+
+def flush_runs_rows():
+    # As before: per-row ORM deletes, single transaction
+    retention_days = int(App.get_config()['GHC_RETENTION_DAYS'])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    run_count = 0
+    for run in Run.query.all():
+        if (now - run.checked_datetime).days > retention_days:
+            run_count += 1
+            DB.session.delete(run)
+    db_commit()
+    DB.session.remove()
+    return run_count
+
+
+def measure(name, flush, rows):
+    batch_times = []
+    last = [time.perf_counter()]
+
+    def progress(count):
+        now = time.perf_counter()
+        batch_times.append(now - last[0])
+        last[0] = now
+
+    start = time.perf_counter()
+    count = flush(progress)
+    secs = time.perf_counter() - start
+    longest = max(batch_times) if batch_times else secs
+    print('%-8s %9d Runs %9d deleted %8.1f s %10.0f Runs/s  '
+          'longest transaction=%.2f s'
+          % (name, rows, count, secs, count / secs, longest))
+
+
+def main(rows=10000000, batch_size=10000, legacy_rows=100000):
+    fill_runs(legacy_rows)
+    measure('rows', lambda progress: flush_runs_rows(), legacy_rows)
+
+    fill_runs(rows)
+    measure('batched', lambda progress: flush_runs(
+        batch_size, 0, progress), rows)
+
+    shutil.rmtree(TMP_DIR)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,123 @@
+# =================================================================
+#
+# Benchmark: CSV history export of one Resource (/resource/<id>/history/csv)
+# built in memory from Run objects, as before, vs streamed in batches
+# of rows, as now.
+#
+# Fills a synthetic run table in a temporary SQLite DB with Runs of one
+# Resource. Prints total time, time to the first chunk of the response
+# and peak Python memory (tracemalloc) of each.
+#
+# Usage: python3 benchmark_history_export.py [rows]
+#
+# =================================================================
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+# Own DB: configure before the app is created on first import
+TMP_DIR = tempfile.mkdtemp()
+SETTINGS_FILE = os.path.join(TMP_DIR, 'settings.py')
+with open(SETTINGS_FILE, 'w') as settings:
+    settings.write("SQLALCHEMY_DATABASE_URI = 'sqlite:///%s'\n"
+                   "GHC_RUNNER_IN_WEBAPP = False\n"
+                   % os.path.join(TMP_DIR, 'runs.db'))
+os.environ['GHC_SETTINGS'] = SETTINGS_FILE
+
+from models import DB, Resource, Run, User  # noqa: E402
+from app import APP  # noqa: E402
+from util import format_checked_datetime, format_run_status  # noqa: E402
+
+INSERT_CHUNK = 100000
+REPORT = '{"success": true, "message": "OK", "probes": []}'
+
+
+def fill_runs(rows):
+    DB.drop_all()
+    DB.create_all()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with DB.engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [{
+            'username': 'admin', 'password': 'x',
+            'email': 'admin@example.com', 'role': 'admin'}])
+        connection.execute(Resource.__table__.insert(), [{
+            'identifier': 1, 'owner_identifier': 'admin',
+            'resource_type': 'OGC:WMS', 'active': True,
+            'title': 'Resource 1', 'url': 'https://example.com/1',
+            'consecutive_failures': 0}])
+        for offset in range(0, rows, INSERT_CHUNK):
+            connection.execute(Run.__table__.insert(), [{
+                'resource_identifier': 1,
+                'checked_datetime': now - timedelta(minutes=rows - index),
+                'success': index % 10 != 0,
+                'response_time': 0.5 + index % 7 / 10.0,
+                'message': 'OK',
+                'report': REPORT
+            } for index in range(offset, min(offset + INSERT_CHUNK, rows))])
+
+
+def export_in_memory():
+    # As before: all Run objects, whole output in a StringIO
+    resource = Resource.query.get(1)
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['owner', 'resource_type', 'checked_datetime', 'title',
+                     'url', 'response_time', 'status'])
+    for run in resource.runs:
+        writer.writerow([
+            resource.owner.username, resource.resource_type,
+            format_checked_datetime(run), resource.title, resource.url,
+            round(run.response_time, 2), format_run_status(run)])
+    yield output.getvalue()
+
+
+def export_streamed():
+    response = APP.test_client().get('/resource/1/history/csv',
+                                     buffered=False)
+    for chunk in response.response:
+        yield chunk
+    response.close()
+
+
+def measure(name, export):
+    DB.session.remove()
+    tracemalloc.start()
+    start = time.perf_counter()
+    first_chunk = None
+    size = 0
+    with APP.test_request_context():
+        for chunk in export():
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            size += len(chunk)
+    secs = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-10s %8.2f s  first chunk %8.3f s  peak %8.1f MB  %d bytes'
+          % (name, secs, first_chunk, peak / 1024.0 / 1024.0, size))
+
+
+def main(rows=500000):
+    fill_runs(rows)
+    print('%d Runs of one Resource' % rows)
+    measure('in memory', export_in_memory)
+    measure('streamed', export_streamed)
+
+    DB.drop_all()
+    shutil.rmtree(TMP_DIR)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
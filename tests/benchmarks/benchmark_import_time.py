@@ -0,0 +1,83 @@
+# =================================================================
+#
+# Benchmark: import (startup) time of GeoHealthCheck entry points.
+#
+# Runs `python -X importtime` in a fresh interpreter for each entry point
+# (runner, CLI, webapp and all Plugins) and reports the best of N
+# cumulative import times, plus the time spent importing heavy
+# dependencies like OWSLib and pyproj, which should only be imported at
+# first use. For CI: exits with 1 when an entry point exceeds max_ms.
+#
+# Usage: python3 benchmark_import_time.py [repeat] [max_ms]
+#
+# =================================================================
+import os
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+ENTRY_POINTS = [
+    ('healthcheck', 'import healthcheck'),
+    ('models', 'import models'),
+    ('app', 'import app'),
+    ('plugins', 'from plugin import Plugin; Plugin.get_plugin_classes()')
+]
+
+HEAVY_PACKAGES = ['owslib', 'pyproj', 'openapi_spec_validator', 'jsonschema']
+
+
+def parse_importtime(output):
+    """
+    Parse `-X importtime` output into list of (depth, name, cumulative us).
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((depth, name.strip(), int(cumulative)))
+    return imports
+
+
+def measure_once(statement):
+    # Not checked: e.g. the webapp needs an initialized DB to start,
+    # but its imports are timed before that
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=GHC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True).stderr
+    imports = parse_importtime(output)
+
+    # Top-level imports only, nested ones are included in cumulative time
+    total = sum([us for depth, name, us in imports if depth == 0])
+    heavy = {}
+    for depth, name, us in imports:
+        package = name.split('.')[0]
+        if package in HEAVY_PACKAGES:
+            heavy[package] = max(heavy.get(package, 0), us)
+
+    return total, heavy
+
+
+def main(repeat=5, max_ms=None):
+    print('%-12s %10s   %s' % ('entry point', 'import ms', 'heavy imports'))
+    exceeded = []
+    for name, statement in ENTRY_POINTS:
+        results = [measure_once(statement) for _ in range(repeat)]
+        total, heavy = min(results, key=lambda result: result[0])
+        heavy = ', '.join(['%s=%.1f ms' % (package, us / 1000.0)
+                           for package, us in sorted(heavy.items())])
+        print('%-12s %10.1f   %s' % (name, total / 1000.0, heavy or '-'))
+        if max_ms and total / 1000.0 > max_ms:
+            exceeded.append(name)
+
+    if exceeded:
+        print('Import time exceeds %d ms: %s' % (max_ms, ', '.join(exceeded)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,98 @@
+# =================================================================
+#
+# Benchmark: allocations for request headers and parameters of a Probe
+# request, deep copies vs read-only / copy-on-write Plugin vars.
+#
+# "copy" is the former implementation: deep copies of REQUEST_HEADERS,
+# parameters and all Plugin vars (incl. expanded CHECKS_AVAIL) for
+# PARAM_DEFS on every request. "view" is the current Probe code.
+#
+# Usage: python3 benchmark_plugin_vars.py [repeat]
+#
+# =================================================================
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+from factory import Factory  # noqa: E402
+from plugin import Plugin  # noqa: E402
+from probe import Probe  # noqa: E402
+
+PROBE_CLASS = 'GeoHealthCheck.plugins.probe.wfs.WfsGetFeatureBbox'
+PARAMETERS = {
+    'type_name': 'bag:pand',
+    'type_ns_prefix': 'bag',
+    'type_ns_uri': 'http://bag.geonovum.nl',
+    'srs': 'EPSG:28992',
+    'bbox': ['180635', '455870', '180961', '456050']
+}
+
+
+class Resource(object):
+    url = 'https://example.com/wfs'
+
+    def add_auth_header(self, headers_dict):
+        return headers_dict
+
+
+def copy_request_vars(probe):
+    # As before: deep copies on each request
+    headers = copy.deepcopy(probe.REQUEST_HEADERS)
+    headers.update(Probe.STANDARD_REQUEST_HEADERS)
+    request_parms = copy.deepcopy(probe._parameters)
+    probe_vars = copy.deepcopy(Plugin.get_plugin_vars(probe))
+    checks_avail = probe_vars['CHECKS_AVAIL']
+    for check_class in checks_avail:
+        check = Factory.create_obj(check_class)
+        checks_avail[check_class] = copy.deepcopy(check.get_plugin_vars())
+    return headers, request_parms, probe_vars['PARAM_DEFS']
+
+
+def view_request_vars(probe):
+    headers = probe.get_request_headers()
+    request_parms = dict(probe._parameters)
+    return headers, request_parms, probe.get_param_defs()
+
+
+def measure(name, request_vars, probe, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        request_vars(probe)
+    secs = (time.perf_counter() - start) / repeat
+
+    # Allocations per request: keep results of many requests alive,
+    # such that object free lists do not hide allocations
+    count = 1000
+    tracemalloc.start()
+    results = [request_vars(probe) for _ in range(count)]
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del results
+    stats = snapshot.statistics('filename')
+    size = sum([stat.size for stat in stats]) / count
+    blocks = sum([stat.count for stat in stats]) / count
+
+    print('%-5s %7.1f us  allocated=%8.0f bytes in %6.1f blocks per request'
+          % (name, secs * 1000000, size, blocks))
+
+
+def main(repeat=10000):
+    probe = Factory.create_obj(PROBE_CLASS)
+    probe._resource = Resource()
+    probe._parameters = PARAMETERS
+    print('%s, %d requests' % (PROBE_CLASS, repeat))
+
+    measure('copy', copy_request_vars, probe, repeat)
+    measure('view', view_request_vars, probe, repeat)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,165 @@
+# =================================================================
+#
+# Benchmark: Run access patterns (Runs of a Resource ordered by time,
+# aggregates per Resource) with the former single column index on
+# run.resource_identifier vs the composite (resource_identifier,
+# checked_datetime) index, covering success and response_time in
+# Postgres 11+.
+#
+# Fills a synthetic run table with Runs of all Resources interleaved
+# in time, as the runner does. Prints the query plan and the average
+# latency of each query over sampled Resources.
+#
+# Runs on a temporary SQLite DB, or on Postgres when GHC_BENCHMARK_DB_URI
+# is set, e.g. postgresql://user:pw@localhost/ghc_benchmark
+# NB all tables in that (scratch!) database are dropped.
+#
+# Usage: python3 benchmark_run_queries.py [rows] [resources] [samples]
+#
+# =================================================================
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+# Own DB: configure before the app is created on first import
+TMP_DIR = tempfile.mkdtemp()
+DB_URI = os.environ.get('GHC_BENCHMARK_DB_URI',
+                        'sqlite:///%s' % os.path.join(TMP_DIR, 'runs.db'))
+SETTINGS_FILE = os.path.join(TMP_DIR, 'settings.py')
+with open(SETTINGS_FILE, 'w') as settings:
+    settings.write("SQLALCHEMY_DATABASE_URI = '%s'\n" % DB_URI)
+os.environ['GHC_SETTINGS'] = SETTINGS_FILE
+
+from sqlalchemy import text  # noqa: E402
+from models import DB, Resource, Run  # noqa: E402
+
+INSERT_CHUNK = 100000
+REPORT = '{"success": true, "message": "OK", "probes": []}'
+INDEX_NAME = 'ix_run_resource_identifier_checked_datetime'
+COLUMNS = 'identifier, checked_datetime, success, response_time, message'
+
+QUERIES = [
+    # Resource.first_run
+    ('first_run', 'SELECT %s FROM run WHERE resource_identifier = :rid '
+                  'ORDER BY checked_datetime ASC LIMIT 1' % COLUMNS),
+    # Formerly Resource.last_run
+    ('last_run', 'SELECT %s FROM run WHERE resource_identifier = :rid '
+                 'ORDER BY checked_datetime DESC LIMIT 1' % COLUMNS),
+    # Resource.runs_to_json(), history export
+    ('history', 'SELECT %s FROM run WHERE resource_identifier = :rid '
+                'ORDER BY checked_datetime' % COLUMNS),
+    # Runs of last day
+    ('last_day', 'SELECT %s FROM run WHERE resource_identifier = :rid '
+                 'AND checked_datetime >= :since '
+                 'ORDER BY checked_datetime' % COLUMNS),
+    # Resource.load_run_stats() for one Resource
+    ('stats', 'SELECT count(identifier), '
+              'sum(CASE WHEN success THEN 1 ELSE 0 END), '
+              'avg(response_time), min(response_time), max(response_time) '
+              'FROM run WHERE resource_identifier = :rid')
+]
+
+
+def fill_runs(rows, resources):
+    DB.drop_all()
+    DB.create_all()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    step = timedelta(days=7) / rows
+    start = time.perf_counter()
+    with DB.engine.begin() as connection:
+        connection.execute(Resource.__table__.insert(), [{
+            'identifier': index + 1,
+            'resource_type': 'OGC:WMS',
+            'active': True,
+            'title': 'Resource %d' % (index + 1),
+            'url': 'https://example.com/%d' % (index + 1),
+            'consecutive_failures': 0
+        } for index in range(resources)])
+        for offset in range(0, rows, INSERT_CHUNK):
+            connection.execute(Run.__table__.insert(), [{
+                'resource_identifier': index % resources + 1,
+                'checked_datetime': now - (rows - index) * step,
+                'success': index % 10 != 0,
+                'response_time': 0.5 + index % 7 / 10.0,
+                'message': 'OK',
+                'report': REPORT
+            } for index in range(offset, min(offset + INSERT_CHUNK, rows))])
+    print('filled %d Runs of %d Resources in %.1f s on %s'
+          % (rows, resources, time.perf_counter() - start,
+             DB.engine.dialect.name))
+    return now
+
+
+def set_index(composite):
+    with DB.engine.begin() as connection:
+        connection.execute(text('DROP INDEX IF EXISTS %s' % INDEX_NAME))
+        connection.execute(text('DROP INDEX IF EXISTS '
+                                'ix_run_resource_identifier'))
+        if not composite:
+            # As before
+            connection.execute(text('CREATE INDEX ix_run_resource_identifier'
+                                    ' ON run (resource_identifier)'))
+        elif connection.dialect.name == 'postgresql' and \
+                connection.dialect.server_version_info >= (11,):
+            # As migration b7f2c4e9a013
+            connection.execute(text(
+                'CREATE INDEX %s ON run (resource_identifier, '
+                'checked_datetime) INCLUDE (success, response_time)'
+                % INDEX_NAME))
+        else:
+            connection.execute(text(
+                'CREATE INDEX %s ON run (resource_identifier, '
+                'checked_datetime)' % INDEX_NAME))
+        connection.execute(text('ANALYZE run'))
+
+
+def explain(connection, sql, params):
+    if connection.dialect.name == 'postgresql':
+        rows = connection.execute(text('EXPLAIN ' + sql), params)
+        return [row[0].strip() for row in rows]
+
+    rows = connection.execute(text('EXPLAIN QUERY PLAN ' + sql), params)
+    return [row[-1] for row in rows]
+
+
+def measure(name, resource_ids, now):
+    params = {'rid': resource_ids[0], 'since': now - timedelta(days=1)}
+    with DB.engine.connect() as connection:
+        for query_name, sql in QUERIES:
+            start = time.perf_counter()
+            for resource_id in resource_ids:
+                params['rid'] = resource_id
+                connection.execute(text(sql), params).fetchall()
+            msecs = 1000 * (time.perf_counter() - start) / len(resource_ids)
+            print('%-10s %-9s %9.2f ms  plan: %s'
+                  % (name, query_name, msecs,
+                     ' | '.join(explain(connection, sql, params)[:2])))
+
+
+def main(rows=1000000, resources=200, samples=50):
+    now = fill_runs(rows, resources)
+    resource_ids = random.Random(1).sample(
+        range(1, resources + 1), min(samples, resources))
+
+    set_index(False)
+    measure('single', resource_ids, now)
+
+    set_index(True)
+    measure('composite', resource_ids, now)
+
+    DB.drop_all()
+    shutil.rmtree(TMP_DIR)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,97 @@
+# =================================================================
+#
+# Benchmark: Probe run setup cost, cold vs compiled ProbePipeline.
+#
+# Measures the setup done by Probe.run() before any request is made:
+# resolve and instantiate the Probe class, decode parameters, resolve
+# and initialize all Checks. "cold" clears the class and pipeline caches
+# on each run, i.e. the cost of resolving class strings every run.
+#
+# Usage: python3 benchmark_run_setup.py [check_count] [repeat]
+#
+# =================================================================
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GHC_DIR = os.path.join(BENCHMARK_DIR, '..', '..', 'GeoHealthCheck')
+
+# Needed to find classes and plugins
+sys.path.append(GHC_DIR)
+
+from factory import Factory  # noqa: E402
+from models import ProbeVars, CheckVars  # noqa: E402
+from probe import Probe  # noqa: E402
+
+PROBE_CLASS = 'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1'
+PROBE_PARAMETERS = {
+    'layers': ['roads'],
+    'srs': 'EPSG:4326',
+    'bbox': ['-180', '-90', '180', '90'],
+    'width': '256',
+    'height': '256',
+    'format': 'image/png',
+    'styles': None,
+    'exceptions': 'application/vnd.ogc.se_xml'
+}
+CHECK_CLASSES = [
+    'GeoHealthCheck.plugins.check.checks.HttpStatusNoError',
+    'GeoHealthCheck.plugins.check.checks.NotContainsOwsException',
+    'GeoHealthCheck.plugins.check.checks.HttpHasImageContentType',
+    'GeoHealthCheck.plugins.check.checks.NotContainsStrings'
+]
+
+
+def create_probe_vars(check_count):
+    # Transient, no DB needed
+    probe_vars = ProbeVars(None, PROBE_CLASS, PROBE_PARAMETERS)
+    probe_vars.identifier = 1
+    for index in range(check_count):
+        check_vars = CheckVars(
+            probe_vars, CHECK_CLASSES[index % len(CHECK_CLASSES)],
+            {'strings': ['Exception %d' % i for i in range(20)]})
+        check_vars.identifier = index + 1
+
+    return probe_vars
+
+
+def setup_run(probe_vars):
+    # As Probe.run() and Probe.run_checks() without the request
+    pipeline = Probe.get_pipeline(probe_vars)
+    probe = pipeline.probe_class()
+    probe._pipeline = pipeline
+    probe.init(None, probe_vars)
+    checks = zip(probe_vars.check_vars, pipeline.checks)
+    for check_vars, (check_class, check_class_obj, parameters) in checks:
+        check = check_class_obj()
+        check.init(probe, check_vars, dict(parameters))
+
+
+def clear_caches():
+    Factory.CLASS_CACHE = {}
+    Probe.PIPELINE_CACHE = {}
+
+
+def measure(name, probe_vars, repeat, cold):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        setup_run(probe_vars)
+    secs = (time.perf_counter() - start) / repeat
+
+    print('%-8s setup=%8.1f us per run' % (name, secs * 1000000))
+
+
+def main(check_count=4, repeat=10000):
+    probe_vars = create_probe_vars(check_count)
+    print('Probe with %d Checks, %d runs' % (check_count, repeat))
+
+    measure('cold', probe_vars, repeat, cold=True)
+    clear_caches()
+    measure('compiled', probe_vars, repeat, cold=False)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -28,16 +28,244 @@
 #
 # =================================================================
 import unittest
+import io
 import os
+import threading
+import time
+import requests
+import struct
+from datetime import timedelta
+from lxml import etree
+from sqlalchemy.exc import IntegrityError
+from owslib.wcs import WebCoverageService
+from owslib.wfs import WebFeatureService
+from owslib.wms import WebMapService
+from owslib.wmts import WebMapTileService
+from owslib.tms import TileMap, TileMapService
 
-from models import DB, load_data, Resource
+from init import App
+
+from models import (DB, load_data, Resource, ProbeVars, CheckVars,
+                    ResourceCapabilities)
 from views import get_probes_avail
 from plugin import Plugin
 from probe import Probe
+from result import ProbeResult
 from factory import Factory
+from capabilities import summarise
+from healthcheck import refresh_capabilities
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
+OWS_URL = 'http://example.com/ows'
+
+WMS_CAPABILITIES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<WMT_MS_Capabilities version="1.1.1">
+ <Capability>
+  <Request>
+   <GetCapabilities><Format>application/vnd.ogc.wms_xml</Format>
+   </GetCapabilities>
+   <GetMap><Format>image/png</Format><Format>image/jpeg</Format></GetMap>
+  </Request>
+  <Exception><Format>application/vnd.ogc.se_xml</Format></Exception>
+  <Layer>
+   <Title>Root</Title>
+   <SRS>EPSG:4326</SRS><SRS>EPSG:3857 EPSG:28992</SRS>
+   <LatLonBoundingBox minx="3" miny="50" maxx="8" maxy="54"/>
+   <BoundingBox SRS="EPSG:4326" minx="3" miny="50" maxx="8" maxy="54"/>
+   <Layer>
+    <Name>roads</Name><SRS>EPSG:4258</SRS>
+   </Layer>
+   <Layer>
+    <Name>rivers</Name>
+    <BoundingBox SRS="EPSG:28992" minx="0" miny="3" maxx="2" maxy="6"/>
+    <Layer><Name>canals</Name></Layer>
+   </Layer>
+  </Layer>
+ </Capability>
+</WMT_MS_Capabilities>"""
+
+WMTS_CAPABILITIES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Capabilities xmlns="http://www.opengis.net/wmts/1.0"
+ xmlns:ows="http://www.opengis.net/ows/1.1" version="1.0.0">
+ <ows:ServiceIdentification>
+  <ows:Title>Tiles</ows:Title><ows:ServiceType>OGC WMTS</ows:ServiceType>
+  <ows:ServiceTypeVersion>1.0.0</ows:ServiceTypeVersion>
+ </ows:ServiceIdentification>
+ <Contents>
+  <Layer>
+   <ows:Title>Top</ows:Title>
+   <ows:WGS84BoundingBox>
+    <ows:LowerCorner>3 50</ows:LowerCorner>
+    <ows:UpperCorner>8 54</ows:UpperCorner>
+   </ows:WGS84BoundingBox>
+   <ows:Identifier>top</ows:Identifier>
+   <Style isDefault="true"><ows:Identifier>default</ows:Identifier></Style>
+   <Format>image/png</Format>
+   <TileMatrixSetLink><TileMatrixSet>WGS84</TileMatrixSet>
+   </TileMatrixSetLink>
+  </Layer>
+  <TileMatrixSet>
+   <ows:Identifier>WGS84</ows:Identifier>
+   <ows:SupportedCRS>urn:ogc:def:crs:EPSG::4326</ows:SupportedCRS>
+   <TileMatrix>
+    <ows:Identifier>0</ows:Identifier>
+    <ScaleDenominator>279541132.0143589</ScaleDenominator>
+    <TopLeftCorner>90 -180</TopLeftCorner>
+    <TileWidth>512</TileWidth><TileHeight>256</TileHeight>
+    <MatrixWidth>1</MatrixWidth><MatrixHeight>1</MatrixHeight>
+   </TileMatrix>
+  </TileMatrixSet>
+ </Contents>
+</Capabilities>"""
+
+WMS130_CAPABILITIES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities xmlns="http://www.opengis.net/wms" version="1.3.0">
+ <Service><Name>WMS</Name><Title>Maps</Title></Service>
+ <Capability>
+  <Request>
+   <GetCapabilities><Format>text/xml</Format></GetCapabilities>
+   <GetMap><Format>image/png</Format></GetMap>
+  </Request>
+  <Exception><Format>XML</Format></Exception>
+  <Layer>
+   <Title>Root</Title>
+   <CRS>EPSG:4326</CRS><CRS>EPSG:3857</CRS>
+   <EX_GeographicBoundingBox>
+    <westBoundLongitude>3</westBoundLongitude>
+    <eastBoundLongitude>8</eastBoundLongitude>
+    <southBoundLatitude>50</southBoundLatitude>
+    <northBoundLatitude>54</northBoundLatitude>
+   </EX_GeographicBoundingBox>
+   <BoundingBox CRS="EPSG:4326" minx="50" miny="3" maxx="54" maxy="8"/>
+   <Layer>
+    <Name>roads</Name><Title>Roads</Title>
+   </Layer>
+   <Layer>
+    <Name>rivers</Name><Title>Rivers</Title><CRS>EPSG:28992</CRS>
+    <EX_GeographicBoundingBox>
+     <westBoundLongitude>4</westBoundLongitude>
+     <eastBoundLongitude>5</eastBoundLongitude>
+     <southBoundLatitude>51</southBoundLatitude>
+     <northBoundLatitude>52</northBoundLatitude>
+    </EX_GeographicBoundingBox>
+   </Layer>
+  </Layer>
+ </Capability>
+</WMS_Capabilities>"""
+
+WFS_CAPABILITIES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wfs:WFS_Capabilities xmlns:wfs="http://www.opengis.net/wfs"
+ xmlns:ows="http://www.opengis.net/ows" xmlns:app="http://example.com/app"
+ version="1.1.0">
+ <ows:ServiceIdentification>
+  <ows:Title>Features</ows:Title><ows:ServiceType>WFS</ows:ServiceType>
+  <ows:ServiceTypeVersion>1.1.0</ows:ServiceTypeVersion>
+ </ows:ServiceIdentification>
+ <ows:OperationsMetadata>
+  <ows:Operation name="GetFeature">
+   <ows:Parameter name="outputFormat">
+    <ows:Value>text/xml; subtype=gml/3.1.1</ows:Value>
+    <ows:Value>application/json</ows:Value>
+   </ows:Parameter>
+  </ows:Operation>
+ </ows:OperationsMetadata>
+ <wfs:FeatureTypeList>
+  <wfs:FeatureType>
+   <wfs:Name>app:roads</wfs:Name><wfs:Title>Roads</wfs:Title>
+   <wfs:DefaultSRS>urn:ogc:def:crs:EPSG::28992</wfs:DefaultSRS>
+   <wfs:OtherSRS>urn:ogc:def:crs:EPSG::4326</wfs:OtherSRS>
+   <ows:WGS84BoundingBox>
+    <ows:LowerCorner>3 50</ows:LowerCorner>
+    <ows:UpperCorner>8 54</ows:UpperCorner>
+   </ows:WGS84BoundingBox>
+  </wfs:FeatureType>
+  <wfs:FeatureType>
+   <wfs:Name>app:rivers</wfs:Name><wfs:Title>Rivers</wfs:Title>
+   <wfs:DefaultSRS>urn:ogc:def:crs:EPSG::4326</wfs:DefaultSRS>
+   <ows:WGS84BoundingBox>
+    <ows:LowerCorner>4 51</ows:LowerCorner>
+    <ows:UpperCorner>5 52</ows:UpperCorner>
+   </ows:WGS84BoundingBox>
+  </wfs:FeatureType>
+ </wfs:FeatureTypeList>
+</wfs:WFS_Capabilities>"""
+
+WCS_CAPABILITIES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wcs:Capabilities xmlns:wcs="http://www.opengis.net/wcs/2.0"
+ xmlns:ows="http://www.opengis.net/ows/2.0" version="2.0.1">
+ <ows:ServiceIdentification>
+  <ows:Title>Coverages</ows:Title><ows:ServiceType>OGC WCS</ows:ServiceType>
+  <ows:ServiceTypeVersion>2.0.1</ows:ServiceTypeVersion>
+ </ows:ServiceIdentification>
+ <ows:ServiceProvider><ows:ProviderName>GHC</ows:ProviderName>
+ </ows:ServiceProvider>
+ <ows:OperationsMetadata>
+  <ows:Operation name="GetCoverage"/>
+ </ows:OperationsMetadata>
+ <wcs:ServiceMetadata>
+  <wcs:formatSupported>image/tiff</wcs:formatSupported>
+  <wcs:formatSupported>image/png</wcs:formatSupported>
+ </wcs:ServiceMetadata>
+ <wcs:Contents>
+  <wcs:CoverageSummary>
+   <wcs:CoverageId>dem</wcs:CoverageId>
+   <wcs:CoverageSubtype>RectifiedGridCoverage</wcs:CoverageSubtype>
+  </wcs:CoverageSummary>
+  <wcs:CoverageSummary>
+   <wcs:CoverageId>landuse</wcs:CoverageId>
+   <wcs:CoverageSubtype>RectifiedGridCoverage</wcs:CoverageSubtype>
+  </wcs:CoverageSummary>
+ </wcs:Contents>
+</wcs:Capabilities>"""
+
+WCS_DESCRIBE_COVERAGE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<wcs:CoverageDescriptions xmlns:wcs="http://www.opengis.net/wcs/2.0"
+ xmlns:gml="http://www.opengis.net/gml/3.2">
+ <wcs:CoverageDescription gml:id="dem">
+  <gml:boundedBy>
+   <gml:Envelope srsName="http://www.opengis.net/def/crs/EPSG/0/28992"
+    axisLabels="x y" srsDimension="2">
+    <gml:lowerCorner>0 300000</gml:lowerCorner>
+    <gml:upperCorner>280000 625000</gml:upperCorner>
+   </gml:Envelope>
+  </gml:boundedBy>
+  <wcs:CoverageId>dem</wcs:CoverageId>
+ </wcs:CoverageDescription>
+</wcs:CoverageDescriptions>"""
+
+TMS_CAPABILITIES = b"""<TileMapService version="1.0.0"
+ services="http://example.com/tms/">
+ <Title>Tiles</Title><Abstract>Tiles</Abstract>
+ <TileMaps>
+  <TileMap title="Top" srs="EPSG:3857" profile="global-mercator"
+   href="http://example.com/tms/1.0.0/top"/>
+  <TileMap title="Aerial" srs="EPSG:28992" profile="none"
+   href="http://example.com/tms/1.0.0/aerial"/>
+ </TileMaps>
+</TileMapService>"""
+
+TMS_TILEMAP = b"""<TileMap version="1.0.0"
+ tilemapservice="http://example.com/tms/1.0.0/">
+ <Title>Top</Title><Abstract>Top</Abstract><SRS>EPSG:3857</SRS>
+ <BoundingBox minx="-20037508" miny="-20037508" maxx="20037508"
+  maxy="20037508"/>
+ <Origin x="-20037508" y="-20037508"/>
+ <TileFormat width="256" height="256" mime-type="image/jpeg"
+  extension="jpeg"/>
+ <TileSets profile="global-mercator">
+  <TileSet href="http://example.com/tms/1.0.0/top/0"
+   units-per-pixel="156543.03" order="0"/>
+ </TileSets>
+</TileMap>"""
+
+OWS_EXCEPTION = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1">
+ <ows:Exception exceptionCode="InvalidParameterValue">
+  <ows:ExceptionText>Unknown service</ows:ExceptionText>
+ </ows:Exception>
+</ows:ExceptionReport>"""
+
 
 class GeoHealthCheckTest(unittest.TestCase):
     def setUp(self):
@@ -105,6 +333,27 @@ class GeoHealthCheckTest(unittest.TestCase):
             class_vars = Factory.get_class_vars(plugin)
             self.assertIn(class_vars['RESOURCE_TYPE'], ['OGC:WMS', 'OGC:*'])
 
+    def testPluginRegistry(self):
+        filters = [('RESOURCE_TYPE', 'OGC:WMS'), ('RESOURCE_TYPE', '*:*')]
+        plugins = Plugin.get_plugins('GeoHealthCheck.probe.Probe', filters)
+        self.assertIn('GeoHealthCheck.plugins.probe.wms.WmsGetMapV1',
+                      plugins)
+        self.assertNotIn('GeoHealthCheck.plugins.probe.wfs.WfsGetFeatureBbox',
+                         plugins)
+
+        # Indexed: same result without loading Plugins again
+        key = ('GeoHealthCheck.probe.Probe', tuple(filters))
+        self.assertEqual(Plugin.PLUGIN_INDEX[key], plugins)
+        self.assertEqual(
+            Plugin.get_plugins('GeoHealthCheck.probe.Probe', filters),
+            plugins)
+
+        Plugin.reload_plugins()
+        self.assertIsNone(Plugin.PLUGIN_CLASSES)
+        self.assertEqual(
+            Plugin.get_plugins('GeoHealthCheck.probe.Probe', filters),
+            plugins)
+
     def testPluginParamDefs(self):
         plugin_obj = Factory.create_obj(
             'GeoHealthCheck.plugins.probe.owsgetcaps.WmsGetCaps')
@@ -125,6 +374,35 @@ class GeoHealthCheckTest(unittest.TestCase):
         plugin_vars = probe_obj.get_plugin_vars()
         self.assertIsNotNone(plugin_vars)
 
+    def testPluginVarsViews(self):
+        probe_obj = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1')
+
+        # Read-only, not copied
+        param_defs = probe_obj.get_param_defs()
+        self.assertIs(param_defs['layers'], probe_obj.PARAM_DEFS['layers'])
+        with self.assertRaises(TypeError):
+            param_defs['layers'] = {}
+
+        # Copy-on-write
+        param_defs = probe_obj.own_param_defs()
+        param_defs['layers']['range'] = ['roads']
+        self.assertIs(probe_obj.own_param_defs(), param_defs)
+        self.assertIsNone(type(probe_obj).PARAM_DEFS['layers']['range'])
+        self.assertEqual(
+            probe_obj.get_plugin_vars()['PARAM_DEFS']['layers']['range'],
+            ['roads'])
+
+        # Only Check Params overridden by Probe are copied
+        probe_obj = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.owsgetcaps.WmsGetCaps')
+        check_class = 'GeoHealthCheck.plugins.check.checks.ContainsStrings'
+        checks_avail = probe_obj.get_plugin_vars()['CHECKS_AVAIL']
+        check_param_defs = checks_avail[check_class]['PARAM_DEFS']
+        class_param_defs = Factory.create_class(check_class).PARAM_DEFS
+        self.assertEqual(check_param_defs['strings']['value'], ['Title>'])
+        self.assertNotIn('value', class_param_defs['strings'])
+
     def testPluginChecks(self):
         plugin_obj = Factory.create_obj(
             'GeoHealthCheck.plugins.check.checks.NotContainsStrings')
@@ -154,6 +432,382 @@ class GeoHealthCheckTest(unittest.TestCase):
             parameters['strings']['value'][0], 'ExceptionReport>',
             'PARAM_DEFS.strings[0] should be ExceptionReport>')
 
+    def testProbePipeline(self):
+        resource = Resource.query.first()
+        probe_vars = resource.probe_vars[0]
+
+        # Compiled once, then reused for each run
+        pipeline = Probe.get_pipeline(probe_vars)
+        self.assertIs(Probe.get_pipeline(probe_vars), pipeline)
+        self.assertIs(pipeline.probe_class,
+                      Factory.create_class(probe_vars.probe_class))
+        self.assertEqual(pipeline.parameters, probe_vars.parameters)
+        self.assertEqual(len(pipeline.checks), len(probe_vars.check_vars))
+        for check_vars, check in zip(probe_vars.check_vars,
+                                     pipeline.checks):
+            check_class, check_class_obj, parameters = check
+            self.assertEqual(check_class, check_vars.check_class)
+            self.assertIs(check_class_obj,
+                          Factory.create_class(check_vars.check_class))
+            self.assertEqual(parameters, check_vars.parameters)
+
+        # Compiled again when ProbeVars or CheckVars change
+        parameters = dict(probe_vars.parameters)
+        parameters['changed'] = True
+        probe_vars.parameters = parameters
+        changed = Probe.get_pipeline(probe_vars)
+        self.assertIsNot(changed, pipeline)
+        self.assertTrue(changed.parameters['changed'])
+
+        if probe_vars.check_vars:
+            check_vars = probe_vars.check_vars[0]
+            parameters = dict(check_vars.parameters)
+            parameters['changed'] = True
+            check_vars.parameters = parameters
+            self.assertIsNot(Probe.get_pipeline(probe_vars), changed)
+
+    def testVarsParameters(self):
+        probe_vars = Resource.query.first().probe_vars[0]
+
+        # Decoded once
+        parameters = probe_vars.parameters
+        self.assertIs(probe_vars.parameters, parameters)
+
+        # Decoded again when set or changed in DB
+        probe_vars.parameters = dict(parameters, changed=True)
+        self.assertTrue(probe_vars.parameters['changed'])
+        self.db.session.commit()
+        self.db.session.execute(
+            "UPDATE probe_vars SET parameters = '{\"reloaded\": 1}'")
+        self.db.session.expire(probe_vars)
+        self.assertEqual(probe_vars.parameters, {'reloaded': 1})
+
+        check_vars = CheckVars(probe_vars, 'checks.Check', {'strings': []})
+        parameters = check_vars.parameters
+        self.assertIs(check_vars.parameters, parameters)
+        check_vars.parameters = {'strings': ['a']}
+        self.assertEqual(check_vars.parameters, {'strings': ['a']})
+
+    def testXmlParseCheck(self):
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.http.HttpGet')
+        probe_vars = ProbeVars(
+            None, 'GeoHealthCheck.plugins.probe.http.HttpGet')
+
+        def perform(check_class, content):
+            probe.response = requests.Response()
+            probe.response._content = content
+            probe.response._content_consumed = True
+            check = Factory.create_obj(check_class)
+            check.CHUNK_SIZE = 64
+            check.init(probe, CheckVars(probe_vars, check_class))
+            check.perform()
+            return check._result
+
+        check_class = 'GeoHealthCheck.plugins.check.checks.XmlParse'
+        result = perform(check_class, WMS_CAPABILITIES)
+        self.assertTrue(result.success)
+        result = perform(check_class, WMS_CAPABILITIES[:-10])
+        self.assertFalse(result.success)
+        result = perform(check_class, OWS_EXCEPTION)
+        self.assertTrue(result.success)
+
+        check_class = \
+            'GeoHealthCheck.plugins.check.checks.XmlParseNoOwsException'
+        result = perform(check_class, WMS_CAPABILITIES)
+        self.assertTrue(result.success)
+        result = perform(check_class, OWS_EXCEPTION)
+        self.assertFalse(result.success)
+        self.assertEqual(result.message, 'ExceptionReport: Unknown service')
+
+    def testStringsMatcher(self):
+        from GeoHealthCheck.plugins.check.checks import StringsMatcher
+
+        body = 'ServiceExceptionReport> Überschrift ExceptionReport>'
+        strings = ['ExceptionReport>', 'ServiceExceptionReport>',
+                   'Service', 'Überschrift', 'missing']
+
+        # Over bytes: offsets in bytes, also of overlapping strings
+        matcher = StringsMatcher(strings, 'utf-8')
+        self.assertEqual(matcher.encoding, 'utf-8')
+        matches = matcher.find(body.encode('utf-8'))
+        self.assertEqual(matches, {
+            'ServiceExceptionReport>': [0],
+            'Service': [0],
+            'ExceptionReport>': [7, 37],
+            'Überschrift': [24]})
+
+        # Strings not in encoding: over text
+        matcher = StringsMatcher(strings, 'ascii')
+        self.assertIsNone(matcher.encoding)
+        matches = matcher.find(body)
+        self.assertEqual(matches['ExceptionReport>'], [7, 36])
+
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.http.HttpGet')
+        probe_vars = ProbeVars(
+            None, 'GeoHealthCheck.plugins.probe.http.HttpGet')
+
+        def perform(check_class, strings):
+            probe.response = requests.Response()
+            probe.response._content = body.encode('utf-16')
+            probe.response.encoding = 'utf-16'
+            check = Factory.create_obj(check_class)
+            check.init(probe, CheckVars(probe_vars, check_class,
+                                        {'strings': strings}))
+            check.perform()
+            return check._result
+
+        check_class = 'GeoHealthCheck.plugins.check.checks.ContainsStrings'
+        self.assertTrue(perform(check_class, strings[:4]).success)
+        result = perform(check_class, strings)
+        self.assertFalse(result.success)
+        self.assertEqual(result.message, 'missing not in response text')
+
+        check_class = \
+            'GeoHealthCheck.plugins.check.checks.NotContainsStrings'
+        self.assertTrue(perform(check_class, ['missing']).success)
+        result = perform(check_class, ['Überschrift', 'missing'])
+        self.assertFalse(result.success)
+
+        # Exception: report response text
+        self.assertEqual(result.message, body)
+
+        # No encoding specified: text decoded with detected encoding
+        probe.response = requests.Response()
+        probe.response._content = body.encode('utf-16')
+        self.assertIsNone(StringsMatcher.get_encoding(probe.response))
+        check = Factory.create_obj(check_class)
+        check.init(probe, CheckVars(probe_vars, check_class,
+                                    {'strings': ['Überschrift']}))
+        check.perform()
+        self.assertFalse(check._result.success)
+
+    def testResponseCache(self):
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.http.HttpGet')
+        response = requests.Response()
+        response._content = b'{"Exception": ["Unknown layer"]}'
+        response.encoding = 'utf-8'
+        probe.response = response
+
+        # Created once per response
+        cache = probe.response_cache
+        self.assertIs(probe.response_cache, cache)
+        self.assertIs(cache.text, cache.text)
+        self.assertEqual(cache.text_lower, '{"exception": ["unknown layer"]}')
+        self.assertEqual(cache.json, {'Exception': ['Unknown layer']})
+        self.assertIs(cache.json, cache.json)
+        with self.assertRaises(Exception):
+            cache.xml
+        self.assertIn('xml', cache.artefacts)
+
+        # New response, new cache
+        probe.response = requests.Response()
+        self.assertIsNot(probe.response_cache, cache)
+
+    def testImageHeader(self):
+        from GeoHealthCheck.plugins.check.checks import read_image_header
+
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\x0dIHDR' + \
+            struct.pack('>II', 256, 128) + b'\x08\x06\x00\x00\x00'
+        # APP0 segment before the SOF0 frame header
+        jpeg = b'\xff\xd8' + b'\xff\xe0\x00\x10JFIF' + b'\x00' * 10 + \
+            b'\xff\xc0\x00\x11\x08' + struct.pack('>HH', 200, 300)
+        webp_lossy = b'RIFF\x00\x00\x00\x00WEBPVP8 \x00\x00\x00\x00' + \
+            b'\x00\x00\x00\x9d\x01\x2a' + struct.pack('<HH', 64, 32)
+        webp_lossless = b'RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00' + \
+            b'\x2f' + struct.pack('<I', 63 | (31 << 14))
+        webp_extended = b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + \
+            (511).to_bytes(3, 'little') + (255).to_bytes(3, 'little')
+        gif = b'GIF89a' + struct.pack('<HH', 16, 8)
+
+        self.assertEqual(read_image_header(png), ('png', 256, 128))
+        self.assertEqual(read_image_header(jpeg), ('jpeg', 300, 200))
+        self.assertEqual(read_image_header(webp_lossy), ('webp', 64, 32))
+        self.assertEqual(read_image_header(webp_lossless), ('webp', 64, 32))
+        self.assertEqual(read_image_header(webp_extended), ('webp', 512, 256))
+        self.assertEqual(read_image_header(gif), ('gif', 16, 8))
+        for data in [b'', b'<ServiceExceptionReport/>', png[:20], jpeg[:-4]]:
+            with self.assertRaises(ValueError):
+                read_image_header(data)
+
+        # Expected size from Check params or else from Probe request
+        check_class = 'GeoHealthCheck.plugins.check.checks.HttpHasImageSize'
+        probe_class = 'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1'
+        probe = Factory.create_obj(probe_class)
+        probe_vars = ProbeVars(None, probe_class)
+
+        def perform(content, params):
+            probe._parameters = {'width': '256', 'height': '128'}
+            probe.response = requests.Response()
+            probe.response._content = content
+            probe.response._content_consumed = True
+            check = Factory.create_obj(check_class)
+            check.init(probe, CheckVars(probe_vars, check_class, params))
+            check.perform()
+            return check._result
+
+        self.assertTrue(perform(png, {}).success)
+        self.assertTrue(perform(png, {'width': '256'}).success)
+        result = perform(png, {'height': '256'})
+        self.assertFalse(result.success)
+        self.assertEqual(result.message,
+                         'png image size 256x128, expected 256x256')
+        self.assertFalse(perform(jpeg, {}).success)
+        self.assertFalse(perform(b'<ServiceExceptionReport/>', {}).success)
+
+        # WMTS: tile size of the TileMatrix requested
+        probe_class = 'GeoHealthCheck.plugins.probe.wmts.WmtsGetTile'
+        probe = Factory.create_obj(probe_class)
+        probe._parameters = {
+            'layers': ['top'], 'kvprest': 'KVP', 'tilematrixset': 'all',
+            'tilematrix': 'all', 'latitude_4326': 52,
+            'longitude_4326': 5}
+        probe.result = ProbeResult(probe, None)
+        probe.wmts = summarise(io.BytesIO(WMTS_CAPABILITIES), 'WMTS')
+        probe.layers = probe._parameters['layers']
+        sizes = []
+        probe.actual_request = lambda: None
+        probe.run_checks = lambda: sizes.append(probe.get_image_size())
+        probe.perform_request()
+        self.assertEqual(sizes, [(512, 256)])
+
+        # TMS: default tile size
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.tms.TmsGetTile')
+        self.assertEqual(probe.get_image_size(), (256, 256))
+
+    def testJsonSchemaValid(self):
+        from GeoHealthCheck.plugins.check.checks import JsonSchemaValid
+
+        schema = """{
+            "type": "object",
+            "required": ["id", "links"],
+            "properties": {
+                "id": {"type": "string"},
+                "links": {"type": "array", "items": {"type": "object"}}
+            }
+        }"""
+        check_class = 'GeoHealthCheck.plugins.check.checks.JsonSchemaValid'
+        probe_vars = ProbeVars(
+            None, 'GeoHealthCheck.plugins.probe.http.HttpGet')
+        check_vars = CheckVars(probe_vars, check_class, {'schema': schema})
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.http.HttpGet')
+
+        def perform(content):
+            probe.response = requests.Response()
+            probe.response._content = content
+            check = Factory.create_obj(check_class)
+            check.init(probe, check_vars)
+            check.perform()
+            return check._result
+
+        JsonSchemaValid.get_validator.cache_clear()
+        self.assertTrue(perform(b'{"id": "roads", "links": []}').success)
+        result = perform(b'{"id": 1, "links": ["self"]}')
+        self.assertFalse(result.success)
+        self.assertIn('2 JSON Schema error(s)', result.message)
+        self.assertIn("'self' is not of type 'object' at /links/0",
+                      result.message)
+        self.assertFalse(perform(b'<html/>').success)
+
+        # Compiled once for all responses
+        self.assertEqual(
+            JsonSchemaValid.get_validator.cache_info().currsize, 1)
+        validator = JsonSchemaValid.get_validator(schema)
+        self.assertIs(JsonSchemaValid.get_validator(schema), validator)
+
+        # Least recently used validator dropped
+        for size in range(JsonSchemaValid.VALIDATOR_CACHE_SIZE):
+            JsonSchemaValid.get_validator('{"minLength": %d}' % size)
+        self.assertIsNot(JsonSchemaValid.get_validator(schema), validator)
+
+        # Invalid schema
+        check_vars = CheckVars(probe_vars, check_class,
+                               {'schema': '{"type": 1}'})
+        self.assertFalse(perform(b'{}').success)
+
+    def testResponseTimeNotDegraded(self):
+        from sketch import QuantileSketch
+
+        # Quantiles within relative accuracy, older values fade out
+        sketch = QuantileSketch()
+        self.assertIsNone(sketch.quantile(0.5))
+        for secs in [5.0] * 50 + [0.1 * (i % 10 + 1) for i in range(500)]:
+            sketch.add(secs)
+        self.assertEqual(sketch.samples, 550)
+        self.assertAlmostEqual(sketch.quantile(0.5), 0.6, delta=0.012)
+        self.assertAlmostEqual(sketch.quantile(0.95), 1.0, delta=0.021)
+        self.assertLess(len(sketch.buckets), 20)
+        p50 = sketch.quantile(0.5)
+        sketch = QuantileSketch.from_json(sketch.to_json())
+        self.assertAlmostEqual(sketch.quantile(0.5), p50)
+
+        # Maintained per ProbeVars
+        probe_vars = ProbeVars(
+            None, 'GeoHealthCheck.plugins.probe.http.HttpGet')
+        self.assertEqual(probe_vars.response_times.samples, 0)
+        for _ in range(10):
+            probe_vars.add_response_time(0.2)
+        self.assertIsNotNone(probe_vars._timing_sketch)
+        self.assertIs(probe_vars.response_times, probe_vars.response_times)
+
+        check_class = \
+            'GeoHealthCheck.plugins.check.checks.ResponseTimeNotDegraded'
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.http.HttpGet')
+
+        def perform(secs, params):
+            probe.result = ProbeResult(probe, probe_vars)
+            probe.response_times = [secs]
+            check = Factory.create_obj(check_class)
+            check.init(probe, CheckVars(probe_vars, check_class, params))
+            check.perform()
+            return check._result
+
+        self.assertTrue(perform(0.3, {}).success)
+        result = perform(0.5, {})
+        self.assertFalse(result.success)
+        self.assertIn('0.500 s > 2.0 x p95', result.message)
+        self.assertTrue(perform(0.5, {'factor': '3'}).success)
+
+        # Not enough history
+        result = perform(0.5, {'min_samples': '20'})
+        self.assertTrue(result.success)
+        self.assertEqual(result.message, 'OK, 10 of 20 response times in '
+                                         'history')
+
+        # Run by Probe per request, before its result is stopped
+        resource = Resource.query.filter_by(resource_type='OGC:WMS').first()
+        probe_class = 'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1All'
+        probe_vars = ProbeVars(resource, probe_class)
+        for _ in range(10):
+            probe_vars.add_response_time(0.01)
+        CheckVars(probe_vars, check_class)
+
+        class Session(object):
+            def get(self, url, **kwargs):
+                if 'LAYERS=slow' in url:
+                    time.sleep(0.1)
+                response = requests.Response()
+                response.status_code = 200
+                response._content = b''
+                return response
+
+        probe = Factory.create_obj(probe_class)
+        probe.init(resource, probe_vars)
+        probe._session = Session()
+        probe.before_request = lambda: setattr(probe, 'layers',
+                                               ['fast', 'slow'])
+        probe.run_request()
+        self.assertEqual(len(probe.response_times), 2)
+        self.assertEqual([result.message for result in
+                          probe.result.results_failed],
+                         ['layer slow: Response time %.3f s > 2.0 x p95 '
+                          '0.010 s' % probe.response_times[1]])
+
     def testProbeViews(self):
         # All Probes available
         probes = get_probes_avail()
@@ -228,6 +882,354 @@ class GeoHealthCheckTest(unittest.TestCase):
             entry = Probe.METADATA_CACHE[key]
             self.assertIsNotNone(entry)
 
+    def testProbeMetadataSingleFlight(self):
+        # Concurrent fetches of same metadata share one fetch,
+        # expired metadata is served while refreshed in background
+        class CountingProbe(Probe):
+            fetch_count = 0
+
+            def get_metadata(self, resource, version='any'):
+                time.sleep(0.2)
+                CountingProbe.fetch_count += 1
+                return 'md%d' % CountingProbe.fetch_count
+
+        resource = Resource.query.first()
+        version = 'single-flight'
+        key = Probe.get_metadata_cache_key(resource, version)
+        Probe.METADATA_CACHE.pop(key, None)
+
+        results = []
+
+        def fetch():
+            results.append(CountingProbe().get_metadata_cached(
+                resource, version=version))
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(CountingProbe.fetch_count, 1)
+        self.assertEqual(results, ['md1'] * 5)
+
+        # Expire entry: stale entry served, single background refresh
+        cache_secs = App.get_config()['GHC_METADATA_CACHE_SECS']
+        Probe.METADATA_CACHE[key]['time'] -= timedelta(
+            seconds=cache_secs + 1)
+        probe = CountingProbe()
+        self.assertEqual(probe.get_metadata_cached(resource, version), 'md1')
+        self.assertEqual(probe.get_metadata_cached(resource, version), 'md1')
+        while key in Probe.METADATA_REFRESHING:
+            time.sleep(0.05)
+
+        self.assertEqual(CountingProbe.fetch_count, 2)
+        self.assertEqual(probe.get_metadata_cached(resource, version), 'md2')
+        Probe.METADATA_CACHE.pop(key, None)
+
+    def testCapabilitiesSummary(self):
+        wms = summarise(io.BytesIO(WMS_CAPABILITIES), 'WMS')
+        self.assertEqual(wms.version, '1.1.1')
+        self.assertEqual(wms.formats, ['image/png', 'image/jpeg'])
+        self.assertEqual(wms.exceptions, ['application/vnd.ogc.se_xml'])
+
+        # Only named Layers, in document order
+        self.assertEqual(list(wms.contents.keys()),
+                         ['roads', 'rivers', 'canals'])
+
+        # CRS and bboxes inherited from parent Layers
+        roads = wms.contents['roads']
+        self.assertEqual(roads.crs_options,
+                         ['EPSG:4326', 'EPSG:3857', 'EPSG:28992',
+                          'EPSG:4258'])
+        self.assertEqual(roads.bbox, (3.0, 50.0, 8.0, 54.0, 'EPSG:4326'))
+        canals = wms.contents['canals']
+        self.assertEqual(canals.crs_options,
+                         ['EPSG:4326', 'EPSG:3857', 'EPSG:28992'])
+        self.assertEqual(canals.bbox, (0.0, 3.0, 2.0, 6.0, 'EPSG:28992'))
+        self.assertEqual(canals.bbox_wgs84, (3.0, 50.0, 8.0, 54.0))
+
+        with self.assertRaises(Exception) as context:
+            summarise(io.BytesIO(OWS_EXCEPTION), 'WMS')
+        self.assertIn('Unknown service', str(context.exception))
+
+    def testCapabilitiesSummaryWms130(self):
+        wms = summarise(io.BytesIO(WMS130_CAPABILITIES), 'WMS')
+        owslib_wms = WebMapService(OWS_URL, version='1.3.0',
+                                   xml=WMS130_CAPABILITIES)
+        self.assertEqual(wms.version, '1.3.0')
+        self.assertEqual(wms.formats, owslib_wms.getOperationByName(
+            'GetMap').formatOptions)
+        self.assertEqual(list(wms.contents.keys()),
+                         list(owslib_wms.contents.keys()))
+        for name, layer in owslib_wms.contents.items():
+            # WGS84 bbox from EX_GeographicBoundingBox, own or inherited
+            self.assertEqual(wms.contents[name].bbox_wgs84,
+                             layer.boundingBoxWGS84)
+            self.assertEqual(sorted(wms.contents[name].crs_options),
+                             sorted(layer.crsOptions))
+
+    def testCapabilitiesSummaryWfs(self):
+        wfs = summarise(io.BytesIO(WFS_CAPABILITIES), 'WFS')
+        owslib_wfs = WebFeatureService(OWS_URL, version='1.1.0',
+                                       xml=WFS_CAPABILITIES)
+        self.assertEqual(wfs.version, '1.1.0')
+        self.assertEqual(wfs.formats, owslib_wfs.getOperationByName(
+            'GetFeature').parameters['outputFormat']['values'])
+        self.assertEqual(wfs.nsmap['app'], 'http://example.com/app')
+        self.assertEqual(list(wfs.contents.keys()),
+                         list(owslib_wfs.contents.keys()))
+        for name, feature_type in owslib_wfs.contents.items():
+            self.assertEqual(wfs.contents[name].crs_options,
+                             [crs.id for crs in feature_type.crsOptions])
+            self.assertEqual(wfs.contents[name].bbox_wgs84,
+                             feature_type.boundingBoxWGS84)
+
+        # Empty SRS elements skipped
+        empty_srs = WFS_CAPABILITIES.replace(
+            b'</wfs:DefaultSRS>', b'</wfs:DefaultSRS><wfs:OtherSRS/>'
+            b'<wfs:OtherSRS> </wfs:OtherSRS>')
+        wfs = summarise(io.BytesIO(empty_srs), 'WFS')
+        self.assertEqual(wfs.contents['app:roads'].crs_options,
+                         ['urn:ogc:def:crs:EPSG::28992',
+                          'urn:ogc:def:crs:EPSG::4326'])
+        self.assertEqual(wfs.contents['app:rivers'].crs_options,
+                         ['urn:ogc:def:crs:EPSG::4326'])
+
+    def testCapabilitiesSummaryWmts(self):
+        wmts = summarise(io.BytesIO(WMTS_CAPABILITIES), 'WMTS')
+        owslib_wmts = WebMapTileService(OWS_URL, xml=WMTS_CAPABILITIES)
+        self.assertEqual(wmts.version, '1.0.0')
+        self.assertEqual(list(wmts.contents.keys()),
+                         list(owslib_wmts.contents.keys()))
+        for name, layer in owslib_wmts.contents.items():
+            self.assertEqual(wmts.contents[name].bbox_wgs84,
+                             layer.boundingBoxWGS84)
+            self.assertEqual(wmts.contents[name].formats, layer.formats)
+            self.assertEqual(wmts.contents[name].tilematrixsets,
+                             list(layer.tilematrixsetlinks.keys()))
+
+        self.assertEqual(list(wmts.tilematrixsets.keys()),
+                         list(owslib_wmts.tilematrixsets.keys()))
+        for identifier, tilematrixset in owslib_wmts.tilematrixsets.items():
+            summary = wmts.tilematrixsets[identifier]
+            self.assertEqual(summary.crs, tilematrixset.crs)
+            self.assertEqual(list(summary.tilematrix.keys()),
+                             list(tilematrixset.tilematrix.keys()))
+            for tilematrix in tilematrixset.tilematrix.values():
+                tilematrix_summary = summary.tilematrix[tilematrix.identifier]
+                for name in tilematrix_summary.__slots__:
+                    self.assertEqual(getattr(tilematrix_summary, name),
+                                     getattr(tilematrix, name))
+
+    def testCapabilitiesSummaryTms(self):
+        tms = summarise(io.BytesIO(TMS_CAPABILITIES), 'TMS')
+        owslib_tms = TileMapService(OWS_URL, xml=TMS_CAPABILITIES.decode())
+        self.assertEqual(list(tms.contents.keys()),
+                         list(owslib_tms.contents.keys()))
+        for name, tilemap in owslib_tms.contents.items():
+            self.assertEqual(tms.contents[name].crs_options, [tilemap.srs])
+
+        tilemap = summarise(io.BytesIO(TMS_TILEMAP), 'TMS:TileMap')
+        owslib_tilemap = TileMap(xml=TMS_TILEMAP.decode())
+        self.assertEqual(tilemap.formats, [owslib_tilemap.extension])
+
+    def testCapabilitiesSummaryWcs(self):
+        wcs = summarise(io.BytesIO(WCS_CAPABILITIES), 'WCS')
+        owslib_wcs = WebCoverageService(OWS_URL, version='2.0.1',
+                                        xml=WCS_CAPABILITIES)
+        self.assertEqual(wcs.version, '2.0.1')
+        self.assertEqual(list(wcs.contents.keys()),
+                         list(owslib_wcs.contents.keys()))
+        for name, coverage in owslib_wcs.contents.items():
+            self.assertEqual(wcs.contents[name].formats,
+                             coverage.supportedFormats)
+
+        # OWSLib fetches DescribeCoverage on demand: give it the fixture
+        owslib_wcs._describeCoverage['dem'] = etree.fromstring(
+            WCS_DESCRIBE_COVERAGE)
+        describe = summarise(io.BytesIO(WCS_DESCRIBE_COVERAGE),
+                             'WCS:DescribeCoverage')
+        bbox = owslib_wcs.contents['dem'].boundingboxes[0]
+        self.assertEqual(describe.contents['dem'].bbox,
+                         bbox['bbox'] + (bbox['nativeSrs'],))
+        self.assertEqual(describe.contents['dem'].crs_options,
+                         [bbox['nativeSrs']])
+
+    def testCapabilitiesStored(self):
+        # Probe edit forms expand params from stored Capabilities summary
+        resource = Resource.query.filter_by(resource_type='OGC:WMS').first()
+        summary = summarise(io.BytesIO(WMS_CAPABILITIES), 'WMS')
+        resource.set_capabilities_summary(
+            'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1', '1.1.1', summary)
+        self.db.session.commit()
+
+        stored = resource.get_capabilities_summary('1.1.1')
+        self.assertEqual(list(stored.contents.keys()),
+                         ['roads', 'rivers', 'canals'])
+        self.assertEqual(stored.contents['canals'].bbox,
+                         (0.0, 3.0, 2.0, 6.0, 'EPSG:28992'))
+
+        probes = get_probes_avail(resource.resource_type, resource)
+        probe_class = 'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1'
+        param_defs = probes[probe_class]['PARAM_DEFS']
+        self.assertEqual(param_defs['layers']['range'],
+                         ['roads', 'rivers', 'canals'])
+        self.assertEqual(param_defs['format']['range'],
+                         ['image/png', 'image/jpeg'])
+
+        # Expanded on a copy: class-level PARAM_DEFS unchanged
+        probe_class = Factory.create_class(probe_class)
+        self.assertIsNone(probe_class.PARAM_DEFS['layers']['range'])
+
+        # Not valid anymore when Resource URL changes
+        resource.url = 'http://example.com/other'
+        self.assertIsNone(resource.get_capabilities_summary('1.1.1'))
+
+    def testCapabilitiesStoredTiles(self):
+        # WMTS encodings and TMS tile formats fetched with the metadata
+        documents = {
+            'http://example.com/wmts?service=WMTS&version=1.0.0'
+            '&request=GetCapabilities': WMTS_CAPABILITIES,
+            'http://example.com/tms/': TMS_CAPABILITIES,
+            'http://example.com/tms/1.0.0/top': TMS_TILEMAP,
+            'http://example.com/tms/1.0.0/aerial': TMS_TILEMAP
+        }
+        urls = []
+
+        class Session(object):
+            def get(self, url, **kwargs):
+                urls.append(url)
+                response = requests.Response()
+                response.status_code = 200 if url in documents else 404
+                response._content = documents.get(url, b'')
+                response.raw = io.BytesIO(response._content)
+                return response
+
+        resource = Resource.query.filter_by(resource_type='OGC:WMS').first()
+        resource.url = 'http://example.com/wmts'
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.wmts.WmtsGetTile')
+        probe._session = Session()
+        wmts = probe.get_metadata(resource, '1.0.0')
+        self.assertEqual(wmts.encodings, ['KVP'])
+        self.assertEqual(list(wmts.contents.keys()),
+                         list(summarise(io.BytesIO(WMTS_CAPABILITIES),
+                                        'WMTS').contents.keys()))
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(probe.response_times, [])
+
+        resource.url = 'http://example.com/tms/'
+        probe = Factory.create_obj(
+            'GeoHealthCheck.plugins.probe.tms.TmsGetTile')
+        probe._session = Session()
+        tms = probe.get_metadata(resource, '1.0.0')
+        self.assertEqual([layer.formats for layer in tms.contents.values()],
+                         [['jpeg'], ['jpeg']])
+
+        # Probe edit forms use the stored summaries, no live requests
+        def perform_get_request(probe, url, stream=False):
+            raise AssertionError('Request to %s' % url)
+
+        base_class = Factory.create_class('GeoHealthCheck.probe.Probe')
+        perform_get_request_orig = base_class.perform_get_request
+        base_class.perform_get_request = perform_get_request
+        try:
+            resource.resource_type = 'OSGeo:TMS'
+            resource.set_capabilities_summary(
+                'GeoHealthCheck.plugins.probe.tms.TmsGetTile', '1.0.0', tms)
+            probes = get_probes_avail(resource.resource_type, resource)
+            param_defs = probes['GeoHealthCheck.plugins.probe.tms.'
+                                'TmsGetTile']['PARAM_DEFS']
+            self.assertEqual(param_defs['layer']['range'], ['top', 'aerial'])
+            self.assertEqual(param_defs['extension']['range'], ['jpeg'])
+
+            resource.url = 'http://example.com/wmts'
+            resource.resource_type = 'OGC:WMTS'
+            resource.set_capabilities_summary(
+                'GeoHealthCheck.plugins.probe.wmts.WmtsGetTile', '1.0.0',
+                wmts)
+            probes = get_probes_avail(resource.resource_type, resource)
+            for name in ['WmtsGetTile', 'WmtsGetTileAll']:
+                param_defs = probes['GeoHealthCheck.plugins.probe.wmts.'
+                                    + name]['PARAM_DEFS']
+                self.assertEqual(param_defs['kvprest']['range'], ['KVP'])
+                self.assertEqual(param_defs['layers']['range'],
+                                 list(wmts.contents.keys()))
+        finally:
+            base_class.perform_get_request = perform_get_request_orig
+        self.assertEqual(len(urls), 6)
+
+    def testCapabilitiesRefreshed(self):
+        # Runner stores summaries for the Probes of a Resource, from the
+        # metadata cache shared with the Probes, when missing or stale
+        resource = Resource.query.filter_by(resource_type='OGC:WMS').first()
+        self.assertIsNone(resource.get_capabilities_summary('1.1.1'))
+
+        probe_class = Factory.create_class(
+            'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1')
+        # Cache of the Probe class: plugins import GeoHealthCheck.probe
+        cache = probe_class.METADATA_CACHE
+        key = probe_class.get_metadata_cache_key(resource, '1.1.1')
+        cache.pop(key, None)
+        config = App.get_config()
+        cache_secs = config['GHC_METADATA_CACHE_SECS']
+        stale_secs = config['GHC_METADATA_CACHE_STALE_SECS']
+        fetches = []
+
+        def get_metadata(probe, resource, version):
+            fetches.append(version)
+            return summarise(io.BytesIO(WMS_CAPABILITIES), 'WMS')
+
+        def get_stored():
+            return resource.capabilities.filter_by(version='1.1.1').first()
+
+        get_metadata_orig = probe_class.get_metadata
+        probe_class.get_metadata = get_metadata
+        try:
+            # Fetched by the Probe run, stored without fetching again
+            probe_class().get_metadata_cached(resource, '1.1.1')
+            refresh_capabilities(resource)
+            self.assertEqual(fetches, ['1.1.1'])
+            stored = resource.get_capabilities_summary('1.1.1')
+            self.assertEqual(list(stored.contents.keys()),
+                             ['roads', 'rivers', 'canals'])
+
+            # Fresh: not stored again
+            updated_datetime = get_stored().updated_datetime
+            refresh_capabilities(resource)
+            self.assertEqual(get_stored().updated_datetime, updated_datetime)
+
+            # Stale, cache newer: updated from cache
+            get_stored().updated_datetime -= timedelta(
+                seconds=cache_secs + 1)
+            self.db.session.commit()
+            refresh_capabilities(resource)
+            self.assertEqual(fetches, ['1.1.1'])
+            self.assertTrue(get_stored().is_fresh(cache_secs))
+
+            # Stale and cache expired: fetched once into the cache
+            get_stored().updated_datetime -= timedelta(
+                seconds=cache_secs + 1)
+            self.db.session.commit()
+            cache[key]['time'] -= timedelta(
+                seconds=cache_secs + stale_secs + 1)
+            refresh_capabilities(resource)
+            self.assertEqual(fetches, ['1.1.1', '1.1.1'])
+            self.assertEqual(resource.capabilities.count(), 1)
+            self.assertTrue(get_stored().is_fresh(cache_secs))
+        finally:
+            probe_class.get_metadata = get_metadata_orig
+            cache.pop(key, None)
+
+        # One summary per version, also with concurrent runners
+        self.db.session.add(ResourceCapabilities(
+            resource, probe_class.__module__ + '.WmsGetMapV1', '1.1.1',
+            stored))
+        with self.assertRaises(IntegrityError):
+            self.db.session.commit()
+        self.db.session.rollback()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -28,12 +28,19 @@
 #
 # =================================================================
 
+import json
 import unittest
 import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event
 
 from init import App
-from models import (DB, Resource, Run, load_data, Recipient)
+from models import (DB, Resource, Run, RunRollup, load_data, Recipient,
+                    flush_runs, backfill_rollups, get_rollup_runs_counts,
+                    compact_reports, get_run_reports, RunReport)
+from result import Result
 from healthcheck import run_test_resource
+import views
 from notifications import _parse_webhook_location
 from resourceauth import ResourceAuth
 
@@ -57,6 +64,25 @@ class GeoHealthCheckTest(unittest.TestCase):
         self.db.session.commit()
         self.db.session.close()
 
+    def count_queries(self, fn):
+        """
+        Call `fn` and count the SQL statements it executes.
+        :return: tuple of result of `fn` and number of statements
+        """
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        event.listen(self.db.engine, 'before_cursor_execute',
+                     count_statement)
+        try:
+            result = fn()
+        finally:
+            event.remove(self.db.engine, 'before_cursor_execute',
+                         count_statement)
+        return result, len(statements)
+
     def testResourcesPresent(self):
         resources = Resource.query.all()
 
@@ -89,6 +115,448 @@ class GeoHealthCheckTest(unittest.TestCase):
                 'Run should be success for %s report=%s' %
                 (resource.url, str(resource.runs[0])))
 
+    def testFlushRuns(self):
+        resource = Resource.query.first()
+        retention_days = App.get_config()['GHC_RETENTION_DAYS']
+        now = datetime.now(timezone.utc)
+        for days_old in [0, 1, retention_days, retention_days + 1,
+                         retention_days + 2, 2 * retention_days,
+                         3 * retention_days]:
+            for _ in range(2):
+                self.db.session.add(Run(resource, Result(),
+                                        now - timedelta(days=days_old)))
+        self.db.session.commit()
+
+        # Batches of 3 of 8 old Runs
+        progress = []
+        self.assertEqual(flush_runs(3, 0, progress.append), 8)
+        self.assertEqual(progress, [3, 6, 8])
+        self.assertEqual(Run.query.count(), 6)
+        oldest = Run.query.order_by(Run.checked_datetime).first()
+        self.assertEqual(
+            (now - oldest.checked_datetime.replace(tzinfo=timezone.utc))
+            .days, retention_days)
+
+        # Nothing left to flush
+        self.assertEqual(flush_runs(3, 0), 0)
+        self.assertEqual(Run.query.count(), 6)
+
+    def testRunRollups(self):
+        resource = Resource.query.first()
+        retention_days = App.get_config()['GHC_RETENTION_DAYS']
+        now = datetime.now(timezone.utc).replace(minute=30)
+        day_start = RunRollup.get_period_start(now, 'day')
+        for hours_old, success, response_time in [
+                (0, True, 0.5), (0, False, 1.5), (1, True, 1.0),
+                (24 * (retention_days + 2), True, 2.0)]:
+            run = Run(resource, Result(), now - timedelta(hours=hours_old))
+            run.success = success
+            run.response_time = response_time
+            self.db.session.add(run)
+            RunRollup.add_run(run)
+        self.db.session.commit()
+
+        rollup = resource.run_rollups.filter_by(
+            period='hour',
+            period_start=RunRollup.get_period_start(now, 'hour')).one()
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(rollup.success_count, 1)
+        self.assertEqual(rollup.reliability, 50)
+        self.assertEqual(rollup.response_time_min, 0.5)
+        self.assertEqual(rollup.response_time_max, 1.5)
+        self.assertEqual(rollup.average_response_time, 1.0)
+        self.assertEqual(rollup.sketch.samples, 2)
+        self.assertAlmostEqual(rollup.sketch.quantile(1), 1.5, delta=0.03)
+
+        # Daily rollup equals merged hourly rollups of that day
+        expected = {}
+        for rollup in resource.run_rollups.filter(
+                RunRollup.period == 'hour',
+                RunRollup.period_start >= day_start):
+            if 'sketch' not in expected:
+                expected['sketch'] = rollup.sketch
+            else:
+                expected['sketch'].merge(rollup.sketch)
+            expected['count'] = expected.get('count', 0) + rollup.count
+        rollup = resource.run_rollups.filter_by(
+            period='day', period_start=day_start).one()
+        self.assertEqual(rollup.count, expected['count'])
+        self.assertEqual(rollup.sketch.buckets, expected['sketch'].buckets)
+
+        self.assertEqual(get_rollup_runs_counts(), (4, 3))
+        self.assertEqual(get_rollup_runs_counts(now - timedelta(days=1)),
+                         (3, 2))
+
+        # Backfill from Runs gives the same rollups
+        def rollup_values():
+            return sorted(
+                (r.period, r.period_start, r.count, r.success_count,
+                 r.response_time_sum, r.response_time_min,
+                 r.response_time_max, r._sketch)
+                for r in RunRollup.query.all())
+
+        incremental = rollup_values()
+        self.assertEqual(backfill_rollups(), 4)
+        self.assertEqual(rollup_values(), incremental)
+
+        # Old hourly rollups are flushed with the Runs, daily kept
+        self.assertEqual(flush_runs(10, 0), 1)
+        self.assertEqual(RunRollup.query.filter_by(period='hour').count(),
+                         len([r for r in incremental if r[0] == 'hour']) - 1)
+        self.assertEqual(get_rollup_runs_counts(), (4, 3))
+
+    def testLoadRunStats(self):
+        resources = Resource.query.order_by(Resource.identifier).all()
+        now = datetime.now(timezone.utc)
+        for success, response_time in [(True, 0.5), (False, 1.5),
+                                       (True, 2.5), (True, 3.5)]:
+            run = Run(resources[0], Result(), now)
+            run.success = success
+            run.response_time = response_time
+            self.db.session.add(run)
+        self.db.session.commit()
+        resources = Resource.query.order_by(Resource.identifier).all()
+
+        # One query for the statistics of all Resources
+        def load_run_stats():
+            Resource.load_run_stats(resources)
+            for resource in resources:
+                resource.run_count, resource.reliability
+                resource.min_response_time, resource.max_response_time
+                resource.average_response_time
+
+        query_count = self.count_queries(load_run_stats)[1]
+        self.assertEqual(query_count, 1)
+
+        self.assertEqual(resources[0].run_count, 4)
+        self.assertEqual(resources[0].reliability, 75)
+        self.assertEqual(resources[0].min_response_time, 0.5)
+        self.assertEqual(resources[0].average_response_time, 2.0)
+        self.assertEqual(resources[0].max_response_time, 3.5)
+        self.assertEqual(sorted(resources[0].all_response_times),
+                         [0.5, 1.5, 2.5, 3.5])
+        self.assertEqual(resources[1].run_count, 0)
+        self.assertEqual(resources[1].reliability, 0)
+        self.assertEqual(resources[1].average_response_time, 0)
+        self.assertEqual(resources[1].all_response_times, [0])
+
+        # Without preloading the same
+        self.db.session.expunge_all()
+        resource = Resource.query.get(resources[0].identifier)
+        self.assertEqual(resource.reliability, 75)
+        self.assertEqual(resource.max_response_time, 3.5)
+
+    def testUpdateState(self):
+        resource = Resource.query.first()
+        self.assertIsNone(resource.last_run)
+        self.assertIsNone(resource.last_success)
+        self.assertEqual(resource.consecutive_failures, 0)
+
+        start = datetime.now(timezone.utc).replace(tzinfo=None)
+        expected = [(True, 0, 0), (False, 1, 1), (False, 2, 1),
+                    (True, 0, 3), (True, 0, 3)]
+        for minutes, (success, failures, since) in enumerate(expected):
+            run = Run(resource, Result(), start + timedelta(minutes=minutes))
+            run.success = success
+            self.db.session.add(run)
+            resource.update_state(run)
+            self.db.session.commit()
+
+            self.assertEqual(resource.last_run_identifier, run.identifier)
+            self.assertEqual(resource.last_success, success)
+            self.assertEqual(resource.last_checked, run.checked_datetime)
+            self.assertEqual(resource.consecutive_failures, failures)
+            self.assertEqual(resource.state_since,
+                             start + timedelta(minutes=since))
+
+        # Last Run from the stored identifier
+        self.db.session.expunge_all()
+        resource = Resource.query.get(resource.identifier)
+        self.assertEqual(resource.last_run.identifier,
+                         resource.runs.order_by(
+                             Run.checked_datetime.desc()).first().identifier)
+
+    def testCompactReports(self):
+        resource = Resource.query.first()
+        report = {'success': True, 'message': 'OK', 'probes': [
+            {'class': 'GeoHealthCheck.plugins.probe.wms.WmsGetMapV1',
+             'success': True, 'message': 'OK', 'response_time': '0.5',
+             'checks': []} for _ in range(50)]}
+        data = Run.encode_report(report)
+        self.assertLess(len(data), len(json.dumps(report)) / 10)
+        self.assertEqual(Run.decode_report(data), report)
+        with self.assertRaises(ValueError):
+            Run.decode_report(b'\x02' + data[1:])
+
+        # Runs stored before: JSON string or compact encoded, compacted
+        # in background
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for values in [{'report': json.dumps(report)}] * 2 + \
+                [{'report_data': data}]:
+            self.db.session.execute(Run.__table__.insert().values(
+                resource_identifier=resource.identifier,
+                checked_datetime=now, success=True, response_time=0.5,
+                message='OK', **values))
+        self.db.session.commit()
+        for run in Run.query.all():
+            self.assertEqual(run.report, report)
+
+        progress = []
+        self.assertEqual(compact_reports(2, 0, progress.append), 3)
+        self.assertEqual(progress, [2, 3])
+        self.db.session.expire_all()
+        for run in Run.query.all():
+            self.assertIsNone(run._report)
+            self.assertIsNone(run._report_data)
+            self.assertEqual(run.report, report)
+        self.assertEqual(RunReport.query.count(), 1)
+        self.assertEqual(compact_reports(2, 0), 0)
+
+    def testRunReports(self):
+        resource = Resource.query.first()
+        retention_days = App.get_config()['GHC_RETENTION_DAYS']
+        now = datetime.now(timezone.utc)
+
+        def make_report(response_time, message='OK'):
+            return {
+                'success': True, 'message': message,
+                'start_time': now.isoformat(), 'end_time': now.isoformat(),
+                'response_time': response_time,
+                'probes': [{'class': 'GeoHealthCheck.plugins.probe.http.'
+                                     'HttpGet',
+                            'response_time': response_time, 'checks': [
+                                {'name': 'check', 'response_time': '0.1'}]}]}
+
+        # Same structure, other timings: stored once
+        reports = [make_report('%.1f' % (index / 10.0))
+                   for index in range(5)] + [make_report('0.1', 'Failed')]
+        for days_old, report in zip([0, 0, 0, 0, 0, 2 * retention_days],
+                                    reports):
+            run = Run(resource, Result(), now - timedelta(days=days_old))
+            run.report = report
+            self.db.session.add(run)
+            # Read back before flush
+            self.assertEqual(run.report, report)
+        self.db.session.commit()
+        # Plus the one of Result() in Run(), no longer referenced
+        self.assertEqual(RunReport.query.count(), 3)
+        self.assertEqual(json.loads(run._report_timings),
+                         [now.isoformat(), '0.1', '0.1', '0.1',
+                          now.isoformat()])
+
+        self.db.session.expire_all()
+        RunReport.STRUCTURE_CACHE.clear()
+        runs = Run.query.order_by(Run.identifier).all()
+        self.assertEqual([run.report for run in runs], reports)
+
+        # Structures of flushed Runs only are flushed, not those added
+        # meanwhile, e.g. for a Run not committed yet
+        def add_structure(run_count):
+            RunReport.get_or_create(make_report('0.1', 'New'))
+            self.db.session.commit()
+
+        flush_runs(10, 0, add_structure)
+        self.assertEqual(RunReport.query.count(), 2)
+        self.assertEqual(Run.query.first().report, reports[0])
+
+        # Run of a structure flushed anyway: no report
+        run = Run.query.first()
+        run.report_identifier = 9999
+        self.db.session.commit()
+        self.db.session.expire_all()
+        self.assertIsNone(Run.query.first().report)
+
+    def testHealthSummary(self):
+        resources = Resource.query.order_by(Resource.identifier).all()
+        now = datetime.now(timezone.utc)
+
+        def add_run(resource, success):
+            run = Run(resource, Result(), now)
+            run.success = success
+            run.response_time = 0.5
+            self.db.session.add(run)
+            resource.update_state(run)
+            RunRollup.add_run(run)
+            self.db.session.commit()
+
+        def get_summary():
+            summary = views.get_health_summary()
+            [resource.reliability for resource in summary['failed_resources']]
+            return summary
+
+        for resource, success in zip(resources[:3], [True, False, True]):
+            add_run(resource, success)
+        add_run(resources[0], False)
+        add_run(resources[0], True)
+
+        summary, query_count = self.count_queries(get_summary)
+        self.assertEqual(summary['total'], 9)
+        self.assertEqual(summary['fail']['number'], 1)
+        self.assertEqual(summary['success']['number'], 8)
+        self.assertEqual(summary['reliability'], 60)
+        self.assertEqual(
+            [resource.identifier for resource in summary['failed_resources']],
+            [resources[1].identifier])
+        self.assertEqual(summary['failed_resources'][0].reliability, 0)
+
+        # Constant number of queries with more failing Resources
+        add_run(resources[2], False)
+        add_run(resources[3], False)
+        summary, more_query_count = self.count_queries(get_summary)
+        self.assertEqual(summary['fail']['number'], 3)
+        self.assertEqual(more_query_count, query_count)
+
+        # Statistics of failing Resources from rollups, also of Runs
+        # flushed
+        run = resources[2].runs.order_by(Run.identifier).first()
+        self.assertTrue(run.success)
+        self.db.session.delete(run)
+        self.db.session.commit()
+        summary = get_summary()
+        self.assertEqual(summary['reliability'], 42.9)
+        self.assertEqual(summary['failed_resources'][1].run_count, 2)
+        self.assertEqual(summary['failed_resources'][1].reliability, 50)
+
+        # No rollups, e.g. not built after upgrading: from Runs
+        RunRollup.query.delete()
+        self.db.session.commit()
+        summary = get_summary()
+        self.assertEqual(summary['reliability'], 33.3)
+        self.assertEqual(summary['fail']['number'], 3)
+        self.assertEqual(summary['failed_resources'][1].run_count, 1)
+        self.assertEqual(summary['failed_resources'][1].reliability, 0)
+
+    def testListResources(self):
+        resources = Resource.query.order_by(Resource.identifier).all()
+        now = datetime.now(timezone.utc)
+        for resource, success in zip(resources[:3], [True, False, True]):
+            run = Run(resource, Result(), now)
+            run.success = success
+            run.response_time = 0.5
+            self.db.session.add(run)
+            resource.update_state(run)
+        self.db.session.commit()
+        identifiers = [resource.identifier for resource in resources]
+        tag_names = sorted(tag.name for tag in resources[0].tags)
+
+        def get_listing(**kwargs):
+            self.db.session.expunge_all()
+            return self.count_queries(
+                lambda: views.list_resources(**kwargs))
+
+        listing, query_count = get_listing()
+        self.assertEqual(listing['total'], 9)
+        self.assertEqual(len(listing['resources']), 9)
+        self.assertEqual(listing['success']['number'], 2)
+        self.assertEqual(listing['fail']['number'], 1)
+        self.assertEqual(
+            [resource.identifier for resource in listing['resources']],
+            identifiers)
+        self.assertEqual(listing['resources'][0].run_count, 1)
+        self.assertEqual(listing['resources'][1].reliability, 0)
+        self.assertEqual(listing['reliability'], 66.7)
+        self.assertTrue(listing['resources'][0].last_run.success)
+        self.assertEqual(
+            sorted(tag.name for tag in listing['resources'][0].tags),
+            tag_names)
+        self.assertIsNotNone(listing['first_run'])
+        self.assertIsNotNone(listing['last_run'])
+
+        # Sorted and paginated, same number of queries
+        listing, page_query_count = get_listing(
+            sort='reliability', order='desc', page=2, per_page=4)
+        self.assertEqual(listing['total'], 9)
+        self.assertEqual(listing['pages'], 3)
+        self.assertEqual(len(listing['resources']), 4)
+        reliabilities = [resource.reliability
+                         for resource in listing['resources']]
+        self.assertEqual(reliabilities, sorted(reliabilities, reverse=True))
+        self.assertEqual(page_query_count, query_count)
+
+        # JSON export: reports of last Runs in a fixed number of queries,
+        # whatever the number of Runs and of distinct reports
+        def export():
+            listing = views.list_resources()
+            return get_run_reports(
+                [resource.last_run.identifier
+                 for resource in listing['resources'] if resource.last_run])
+
+        self.db.session.expunge_all()
+        reports, export_query_count = self.count_queries(export)
+        self.assertEqual(len(reports), 3)
+
+        resources = Resource.query.order_by(Resource.identifier).all()
+        for index, resource in enumerate(resources):
+            run = Run(resource, Result(True, 'Run %d' % index), now)
+            run.response_time = 0.5
+            self.db.session.add(run)
+            resource.update_state(run)
+        self.db.session.commit()
+        self.db.session.expunge_all()
+        reports, more_export_query_count = self.count_queries(export)
+        self.assertEqual(
+            sorted(report['message'] for report in reports.values()),
+            ['Run %d' % index for index in range(9)])
+        self.assertEqual(more_export_query_count, export_query_count)
+
+    def testRunsPages(self):
+        resource = Resource.query.first()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        for minutes_old in range(9, -1, -1):
+            self.db.session.add(Run(resource, Result(),
+                                    now - timedelta(minutes=minutes_old)))
+        self.db.session.commit()
+        identifiers = [run.identifier for run in resource.runs.order_by(
+            Run.checked_datetime)]
+
+        # Follow pages until no next page
+        pages = []
+        after_id = None
+        while True:
+            runs, after_id = views.get_run_by_resource_id(
+                resource.identifier, after_id=after_id, limit=4)
+            pages.append([run.identifier for run in runs])
+            if after_id is None:
+                break
+        self.assertEqual(pages, [identifiers[:4], identifiers[4:8],
+                                 identifiers[8:]])
+
+        # Time range and bounded page size
+        now = now.replace(tzinfo=None)
+        runs, after_id = views.get_run_by_resource_id(
+            resource.identifier, from_datetime=now - timedelta(minutes=5),
+            to_datetime=now, limit=100000)
+        self.assertEqual([run.identifier for run in runs],
+                         identifiers[4:9])
+        self.assertIsNone(after_id)
+        App.get_config()['GHC_API_RUNS_MAX_LIMIT'] = 2
+        try:
+            runs, after_id = views.get_run_by_resource_id(
+                resource.identifier, limit=100000)
+        finally:
+            App.get_config()['GHC_API_RUNS_MAX_LIMIT'] = 1000
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(after_id, identifiers[1])
+
+    def testRunHistory(self):
+        resource = Resource.query.first()
+        now = datetime.now(timezone.utc)
+        for minutes_old, success in [(1, True), (3, False), (2, True)]:
+            run = Run(resource, Result(), now - timedelta(minutes=minutes_old))
+            run.success = success
+            run.response_time = minutes_old / 10.0
+            self.db.session.add(run)
+        self.db.session.commit()
+        identifier = resource.identifier
+        self.db.session.expunge_all()
+
+        # Rows in time order, no Run objects in the session
+        history = list(views.get_run_history(identifier))
+        self.assertEqual([(row.response_time, row.success)
+                          for row in history],
+                         [(0.3, False), (0.2, True), (0.1, True)])
+        self.assertEqual(len(self.db.session.identity_map), 0)
+
     def testNotificationsApi(self):
         Rcp = Recipient
         test_emails = ['test@test.com', 'other@test.com', 'unused@test.com']